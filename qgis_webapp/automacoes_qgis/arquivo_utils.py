@@ -0,0 +1,16 @@
+"""Somas e assinaturas de arquivos, usadas pelos caches do pipeline e do download."""
+import hashlib
+import os
+from pathlib import Path
+
+
+def hash_arquivo(caminho: Path) -> str:
+    """sha256 (hex) do conteúdo do arquivo."""
+    with open(caminho, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def assinatura_arquivo(caminho: Path, st: os.stat_result = None) -> list:
+    """[tamanho, mtime_ns, inode]: se não mudou, o conteúdo também não (sem ler o arquivo)."""
+    st = st or os.stat(caminho)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
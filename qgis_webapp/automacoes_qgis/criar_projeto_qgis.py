@@ -1,5 +1,4 @@
 from qgis.core import (
-    QgsApplication,
     QgsVectorLayer,
     QgsProject,
     QgsCoordinateReferenceSystem,
@@ -8,7 +7,6 @@ from qgis.core import (
     QgsVectorLayerSimpleLabeling,
     Qgis,
     QgsField,
-    QgsProject,
     QgsRendererCategory,
     QgsFillSymbol,
     QgsCategorizedSymbolRenderer,
@@ -16,45 +14,28 @@ from qgis.core import (
     QgsRasterLayer,
     QgsEditFormConfig,
     QgsLayerTreeLayer,
-    QgsReadWriteContext,
     QgsAttributeTableConfig,
     QgsVectorFileWriter,
-    QgsCoordinateTransformContext,
+    QgsRectangle,
 )
 from pathlib import Path
 from qgis.PyQt.QtGui import QColor, QFont
 from qgis.PyQt.QtCore import QVariant
-import zipfile
-import geopandas as gpd
+from qgis.PyQt.QtXml import QDomDocument, QDomElement
+from .metricas import registrar_cache, subetapa
+from .qgis_setup import init_qgis
 from .stylize import stylize_layer_lotes, stylize_layer_ruas, stylize_layer_quadras
+from .projeto_template import (
+    CAMADAS_PROJETO, CAMPOS_LOTES, NOME_ORTOFOTO, capturar_template, renderizar_projeto
+)
 import qgis.core as qgs
-import xml.etree.ElementTree as ET
-import copy
-import tempfile
 from PyQt5.QtCore import Qt
 import os
-import shutil
 
 # CRS padrão (SIRGAS 2000 / UTM 22S)
 project_crs = QgsCoordinateReferenceSystem("EPSG:31982")
 
 
-def fix_relative_paths(qgz_path: Path, base_dir: Path):
-    base_str = str(base_dir).replace('\\', '/').rstrip('/') + '/'
-
-    with zipfile.ZipFile(qgz_path, 'r') as zip_in:
-        qgs_name = [n for n in zip_in.namelist() if n.endswith('.qgs')][0]
-        xml_data = zip_in.read(qgs_name).decode('utf-8')
-
-    # Ex: /media/uploads/ProjetoX/final/... → final/...
-    xml_data = xml_data.replace(base_str, '')
-    xml_data = xml_data.replace('\\', '/')
-
-    with zipfile.ZipFile(qgz_path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
-        zip_out.writestr(qgs_name, xml_data)
-
-    print("🔧 Caminhos absolutos removidos, agora são relativos ao diretório do projeto.")
-
 def enable_text_label(layer, field_name="Text", grupo_nome=None):
     field_names = [f.name() for f in layer.fields()]
     if field_name not in field_names:
@@ -110,15 +91,187 @@ def atualizar_campos_final(layer):
         provider.addAttributes(novos_campos)
         layer.updateFields()
 
-def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="EPSG:31983"):
+def _elemento_texto(doc: QDomDocument, tag: str, texto: str) -> QDomElement:
+    el = doc.createElement(tag)
+    el.appendChild(doc.createTextNode(texto))
+    return el
+
+
+def _substituir_texto(doc: QDomDocument, el: QDomElement, texto: str):
+    while el.hasChildNodes():
+        el.removeChild(el.firstChild())
+    el.appendChild(doc.createTextNode(texto))
+
+
+def ajustar_documento_qfieldsync(doc: QDomDocument, project, final_layer=None, ortho_layer=None):
+    """
+    Ajustes para o QFieldSync feitos no DOM que o QGIS está gravando
+    (sinal QgsProject.writeProject), sem reler o arquivo salvo:
+    fonte da ortofoto, <layerorder>, custom-order, mapcanvas, legenda e GPS.
+    """
+    root = doc.documentElement()
+    layer_ids = list(project.mapLayers().keys())
+
+    # 1) Fontes das camadas, como ficaram no DOM (já relativas)
+    datasource_for = {}
+    projectlayers_el = root.firstChildElement("projectlayers")
+    ml = projectlayers_el.firstChildElement("maplayer")
+    while not ml.isNull():
+        lid = ml.firstChildElement("id").text()
+        ds_el = ml.firstChildElement("datasource")
+        if ortho_layer is not None and lid == ortho_layer.id() and not ds_el.isNull():
+            # 🔹 mantém estrutura correta do pacote
+            _substituir_texto(doc, ds_el, f"./ortofoto/{Path(ds_el.text()).name}")
+        datasource_for[lid] = ds_el.text()
+        ml = ml.nextSiblingElement("maplayer")
+
+    # 2) <layerorder> explícito, logo depois de </projectlayers>
+    layerorder_el = root.firstChildElement("layerorder")
+    if layerorder_el.isNull():
+        layerorder_el = doc.createElement("layerorder")
+        root.insertAfter(layerorder_el, projectlayers_el)
+    while layerorder_el.hasChildNodes():
+        layerorder_el.removeChild(layerorder_el.firstChild())
+    for lid in layer_ids:
+        el = doc.createElement("layer")
+        el.setAttribute("id", lid)
+        layerorder_el.appendChild(el)
+
+    # 3) custom-order enabled="1" dentro de <layer-tree-group>
+    ltg_root = root.firstChildElement("layer-tree-group")
+    if not ltg_root.isNull():
+        custom_order = ltg_root.firstChildElement("custom-order")
+        if custom_order.isNull():
+            custom_order = doc.createElement("custom-order")
+            ltg_root.appendChild(custom_order)
+        while custom_order.hasChildNodes():
+            custom_order.removeChild(custom_order.firstChild())
+        custom_order.setAttribute("enabled", "1")
+        for lid in layer_ids:
+            custom_order.appendChild(_elemento_texto(doc, "item", lid))
+
+    # 4) relations / polymorphicRelations / mapcanvas / projectModels / mapViewDocks
+    anterior = root.firstChildElement("snapping-settings")
+
+    def garantir_apos(tag):
+        nonlocal anterior
+        el = root.firstChildElement(tag)
+        if el.isNull():
+            el = doc.createElement(tag)
+            if anterior.isNull():
+                root.insertBefore(el, root.firstChild())
+            else:
+                root.insertAfter(el, anterior)
+            anterior = el
+        return el
+
+    garantir_apos("relations")
+    garantir_apos("polymorphicRelations")
+
+    if root.firstChildElement("mapcanvas").isNull():
+        # extent combinado das camadas
+        extent = None
+        for layer in project.mapLayers().values():
+            if extent is None:
+                extent = QgsRectangle(layer.extent())
+            else:
+                extent.combineExtentWith(layer.extent())
+
+        mapcanvas_el = garantir_apos("mapcanvas")
+        mapcanvas_el.setAttribute("name", "theMapCanvas")
+        mapcanvas_el.setAttribute("annotationsVisible", "1")
+        mapcanvas_el.appendChild(_elemento_texto(doc, "units", "meters"))
+        extent_el = doc.createElement("extent")
+        for tag, metodo in (("xmin", "xMinimum"), ("ymin", "yMinimum"), ("xmax", "xMaximum"), ("ymax", "yMaximum")):
+            valor = getattr(extent, metodo)() if extent is not None else 0
+            extent_el.appendChild(_elemento_texto(doc, tag, repr(valor)))
+        mapcanvas_el.appendChild(extent_el)
+        mapcanvas_el.appendChild(_elemento_texto(doc, "rotation", "0"))
+        dest_el = doc.createElement("destinationsrs")
+        srs_el = root.firstChildElement("projectCrs").firstChildElement("spatialrefsys")
+        if not srs_el.isNull():
+            dest_el.appendChild(srs_el.cloneNode(True))
+        mapcanvas_el.appendChild(dest_el)
+
+    garantir_apos("projectModels")
+    garantir_apos("mapViewDocks")
+
+    # 5) properties / Legend / filterByMap = false
+    properties_el = root.firstChildElement("properties")
+    if properties_el.isNull():
+        properties_el = doc.createElement("properties")
+        root.appendChild(properties_el)
+    legend_el = properties_el.firstChildElement("Legend")
+    if legend_el.isNull():
+        legend_el = doc.createElement("Legend")
+        properties_el.appendChild(legend_el)
+    filter_el = legend_el.firstChildElement("filterByMap")
+    if filter_el.isNull():
+        filter_el = doc.createElement("filterByMap")
+        legend_el.appendChild(filter_el)
+    filter_el.setAttribute("type", "bool")
+    _substituir_texto(doc, filter_el, "false")
+
+    # 6) GPS apenas na camada final_gpkg
+    gps_old = root.firstChildElement("ProjectGpsSettings")
+    while not gps_old.isNull():
+        proximo = gps_old.nextSiblingElement("ProjectGpsSettings")
+        root.removeChild(gps_old)
+        gps_old = proximo
+
+    if final_layer is not None:
+        gps_el = doc.createElement("ProjectGpsSettings")
+        for nome, valor in (
+            ("autoCommitFeatures", "0"),
+            ("destinationFollowsActiveLayer", "1"),
+            ("autoAddTrackVertices", "0"),
+            ("destinationLayerProvider", "ogr"),
+            ("destinationLayer", final_layer.id()),
+            ("destinationLayerName", final_layer.name()),
+            ("destinationLayerSource", datasource_for.get(final_layer.id(), "./final/final_gpkg.gpkg")),
+        ):
+            gps_el.setAttribute(nome, valor)
+        gps_el.appendChild(doc.createElement("timeStampFields"))
+        root.appendChild(gps_el)
+
+
+def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="EPSG:31983", medidor=None):
+    """
+    Gera o project_cloud.qgs do job. Usa o template já validado para esta
+    combinação de camadas (projeto_template); só na primeira vez monta o
+    projeto com QGIS e captura o resultado como template.
+    Com um medidor (metricas.MedidorEtapas), registra o tempo de cada caminho
+    e o acerto/falta do cache de templates.
+    """
+    try:
+        with subetapa(medidor, "template"):
+            project_path = renderizar_projeto(base_dir, ortho_path, DEFAULT_CRS)
+        registrar_cache(medidor, "template_projeto", project_path is not None)
+        if project_path:
+            return project_path
+    except Exception as e:
+        registrar_cache(medidor, "template_projeto", False)
+        print(f"⚠️ Falha ao gerar projeto pelo template, usando QGIS: {e}")
+
+    with subetapa(medidor, "qgis"):
+        project_path = _criar_projeto_com_qgis(base_dir, ortho_path, DEFAULT_CRS)
+    if project_path:
+        try:
+            with subetapa(medidor, "captura_template"):
+                capturar_template(base_dir, ortho_path, DEFAULT_CRS)
+        except Exception as e:
+            print(f"⚠️ Não foi possível capturar o template do projeto: {e}")
+    return project_path
+
+
+def _criar_projeto_com_qgis(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="EPSG:31983"):
     print("🧠 Iniciando criação do projeto QGIS com campos customizados e ajustes QFieldSync...")
 
-    qgs = QgsApplication([], False)
-    qgs.initQgis()
+    # No worker o QGIS já está aquecido; aqui é só garantia (no-op)
+    init_qgis()
 
-    project = QgsProject.instance()
-    project.removeAllMapLayers()
-    project.clear()
+    # Projeto próprio do job: nada de QgsProject.instance() compartilhado
+    project = QgsProject()
 
     project_path = base_dir / "project_cloud.qgs"
     project.setFileName(str(project_path))
@@ -132,15 +285,9 @@ def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="E
     project.setTitle(project_name)
 
     # --- Carregar camadas vetoriais ---
-    camadas = [
-        ("final/final_gpkg.gpkg", "Lotes/Quadras - Polígonos"),
-        ("quadras/quadras_rotulo_pt.gpkg", "Quadras"),
-        ("ruas/ruas_osm_detalhadas.gpkg", "Ruas"),
-    ]
-
     final_layer_obj = None
 
-    for rel_path, nome_grupo in camadas:
+    for rel_path, nome_grupo in CAMADAS_PROJETO:
         camada_path = base_dir / rel_path
         if not camada_path.exists():
             print(f"⚠️ Arquivo não encontrado: {camada_path}")
@@ -168,27 +315,17 @@ def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="E
 
         if "final" in rel_path.lower():
             final_layer_obj = layer
-            camada_filtrada = str(camada_path.resolve())
 
             # --- 1. Garantir que os campos necessários existam ---
             layer.startEditing()
             prov = layer.dataProvider()
             existing = {f.name() for f in layer.fields()}
 
-            required_fields = [
-                ("Nome", QVariant.String),
-                ("Telefone", QVariant.String),
-                ("Endereco", QVariant.String),
-                ("Nº Casa", QVariant.Int),
-                ("STATUS", QVariant.String),
-                ("quadra", QVariant.String),
-                ("lote_num", QVariant.String),
-            ]
-
-            for fname, ftype in required_fields:
+            tipos = {"String": QVariant.String, "Integer": QVariant.Int}
+            for fname, ftype in CAMPOS_LOTES:
                 if fname not in existing:
                     print(f"➕ Criando campo ausente: {fname}")
-                    prov.addAttributes([QgsField(fname, ftype)])
+                    prov.addAttributes([QgsField(fname, tipos[ftype])])
             layer.updateFields()
 
             # --- 2. Configuração do formulário (editFormConfig) ---
@@ -310,13 +447,15 @@ def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="E
         group.addLayer(layer)
         print(f"✅ Camada adicionada: {rel_path} | ID: {layer.id()}")
     
+    ortho_layer = None
     if ortho_path:
-        rlayer = QgsRasterLayer(str(ortho_path.resolve()), "Ortofoto de Base")
+        rlayer = QgsRasterLayer(str(ortho_path.resolve()), NOME_ORTOFOTO)
         if rlayer.isValid():
             rlayer.setCrs(QgsCoordinateReferenceSystem(DEFAULT_CRS))
-            rlayer.setCustomProperty("QFieldSync/cloud_action", "copy")
+            rlayer.setCustomProperty("QFieldSync/cloud_action", "no_action")
             rlayer.setCustomProperty("identify/format", "Value")
             project.addMapLayer(rlayer, False)
+            ortho_layer = rlayer
             ortho_group = root_tree.addGroup("Ortofoto")
             ortho_group.addLayer(rlayer)
             print(f"🖼️ Ortofoto adicionada: {ortho_path.name}")
@@ -339,206 +478,19 @@ def create_final_project(base_dir: Path, ortho_path: Path = None, DEFAULT_CRS="E
     if final_layer_obj:
         final_layer_obj.setDisplayExpression('"Nome"')
     
-    # Salva o projeto uma primeira vez
-    if not project.write(str(project_path)):
-        print("❌ Erro ao salvar projeto (primeira escrita).")
-        qgs.exitQgis()
+    # Ajustes do QFieldSync aplicados no DOM antes da gravação (vale para .qgs e .qgz)
+    def ajustar(doc):
+        ajustar_documento_qfieldsync(doc, project, final_layer_obj, ortho_layer)
+
+    project.writeProject.connect(ajustar)
+    try:
+        salvo = project.write(str(project_path))
+    finally:
+        project.writeProject.disconnect(ajustar)
+
+    if not salvo:
+        print("❌ Erro ao salvar projeto.")
         return
 
-    # --- Pós-processamento do .qgs para ficar compatível com o QFieldSync ---
-
-    text = project_path.read_text(encoding="utf-8")
-
-    # Preservar DOCTYPE
-    if text.lstrip().startswith("<!DOCTYPE"):
-        first_nl = text.find("\n")
-        doctype = text[:first_nl]
-        xml_str = text[first_nl + 1 :]
-    else:
-        doctype = ""
-        xml_str = text
-
-    root = ET.fromstring(xml_str)
-
-    # 1) Mapa de IDs das camadas a partir de <projectlayers>
-    layer_ids = []  # lista na ordem
-    name_to_id = {}
-    datasource_for = {}
-    projectlayers_el = root.find("projectlayers")
-    if projectlayers_el is not None:
-        for ml in projectlayers_el.findall("maplayer"):
-            if ml.get("type") == "raster":
-                lname = ml.findtext("layername") or ""
-                if lname == "Ortofoto de Base":
-                    ds_el = ml.find("datasource")
-                    if ds_el is not None and ds_el.text:
-                        fname = Path(ds_el.text).name
-                        ds_el.text = f"./ortofoto/{fname}"  # 🔹 mantém estrutura correta
-
-                    cp = ml.find("customproperties")
-                    if cp is None:
-                        cp = ET.SubElement(ml, "customproperties")
-
-                    opt_map = cp.find("Option")
-                    if opt_map is None or opt_map.get("type") != "Map":
-                        opt_map = ET.SubElement(cp, "Option", {"type": "Map"})
-
-                    # Remove duplicatas antigas
-                    for opt in list(opt_map):
-                        if opt.get("name") in ["QFieldSync/cloud_action", "identify/format"]:
-                            opt_map.remove(opt)
-
-                    # Recria as propriedades do QFieldSync conforme o projeto original
-                    ET.SubElement(
-                        opt_map,
-                        "Option",
-                        {"name": "QFieldSync/cloud_action", "value": "no_action", "type": "QString"},
-                    )
-                    ET.SubElement(
-                        opt_map,
-                        "Option",
-                        {"name": "identify/format", "value": "Value", "type": "QString"},
-                    )
-
-    # 2) <layerorder> explícito
-    layerorder_el = root.find("layerorder")
-    if layerorder_el is None:
-        # inserir logo depois de </projectlayers>
-        idx = list(root).index(projectlayers_el) + 1 if projectlayers_el is not None else len(list(root))
-        layerorder_el = ET.Element("layerorder")
-        root.insert(idx, layerorder_el)
-    else:
-        layerorder_el.clear()
-
-    for lid in layer_ids:
-        ET.SubElement(layerorder_el, "layer", {"id": lid})
-
-    # 3) custom-order enabled="1" dentro de <layer-tree-group>
-    ltg_root = root.find("layer-tree-group")
-    if ltg_root is not None:
-        # procura custom-order existente
-        custom_order = None
-        for child in ltg_root.findall("custom-order"):
-            custom_order = child
-        if custom_order is None:
-            custom_order = ET.SubElement(ltg_root, "custom-order")
-        custom_order.set("enabled", "1")
-        custom_order.clear()
-        custom_order.set("enabled", "1")
-        for lid in layer_ids:
-            item = ET.SubElement(custom_order, "item")
-            item.text = lid
-
-    # 4) relations / polymorphicRelations / mapcanvas / projectModels / mapViewDocks
-    snap_el = root.find("snapping-settings")
-    insert_index = list(root).index(snap_el) + 1 if snap_el is not None else 0
-
-    def ensure_after(tag, current_index):
-        el = root.find(tag)
-        if el is None:
-            el = ET.Element(tag)
-            root.insert(current_index, el)
-            current_index += 1
-        return el, current_index
-
-    relations_el, insert_index = ensure_after("relations", insert_index)
-    poly_el, insert_index = ensure_after("polymorphicRelations", insert_index)
-
-    # mapcanvas com extent combinado das camadas
-    mapcanvas_el = root.find("mapcanvas")
-    if mapcanvas_el is None:
-        # calcula extent a partir dos <maplayer><extent>
-        xmin = ymin = xmax = ymax = None
-        if projectlayers_el is not None:
-            for ml in projectlayers_el.findall("maplayer"):
-                ext = ml.find("extent")
-                if ext is None:
-                    continue
-                exmin = float(ext.findtext("xmin"))
-                eymin = float(ext.findtext("ymin"))
-                exmax = float(ext.findtext("xmax"))
-                eymax = float(ext.findtext("ymax"))
-                if xmin is None:
-                    xmin, ymin, xmax, ymax = exmin, eymin, exmax, eymax
-                else:
-                    xmin = min(xmin, exmin)
-                    ymin = min(ymin, eymin)
-                    xmax = max(xmax, exmax)
-                    ymax = max(ymax, eymax)
-
-        mapcanvas_el = ET.Element("mapcanvas", {"name": "theMapCanvas", "annotationsVisible": "1"})
-        units_el = ET.SubElement(mapcanvas_el, "units")
-        units_el.text = "meters"
-
-        extent_el = ET.SubElement(mapcanvas_el, "extent")
-        for tag, val in (("xmin", xmin), ("ymin", ymin), ("xmax", xmax), ("ymax", ymax)):
-            el = ET.SubElement(extent_el, tag)
-            el.text = f"{val}" if val is not None else "0"
-
-        rot_el = ET.SubElement(mapcanvas_el, "rotation")
-        rot_el.text = "0"
-
-        dest_el = ET.SubElement(mapcanvas_el, "destinationsrs")
-        # copia o <spatialrefsys> de <projectCrs>
-        proj_crs = root.find("projectCrs")
-        if proj_crs is not None:
-            srs_el = proj_crs.find("spatialrefsys")
-            if srs_el is not None:
-                dest_el.append(copy.deepcopy(srs_el))
-
-        root.insert(insert_index, mapcanvas_el)
-        insert_index += 1
-
-    projectModels_el, insert_index = ensure_after("projectModels", insert_index)
-    mapViewDocks_el, insert_index = ensure_after("mapViewDocks", insert_index)
-
-    # 5) properties / Legend / filterByMap = false  (já gravamos, aqui só garantimos)
-    properties_el = root.find("properties")
-    if properties_el is None:
-        properties_el = ET.Element("properties")
-        root.append(properties_el)
-
-    legend_prop_el = None
-    for child in properties_el.findall("Legend"):
-        legend_prop_el = child
-    if legend_prop_el is None:
-        legend_prop_el = ET.SubElement(properties_el, "Legend")
-
-    filter_el = legend_prop_el.find("filterByMap")
-    if filter_el is None:
-        filter_el = ET.SubElement(legend_prop_el, "filterByMap", {"type": "bool"})
-    filter_el.set("type", "bool")
-    filter_el.text = "false"
-
-    # 6) GPS apenas na camada final_gpkg
-    # remove ProjectGpsSettings antigo, se existir
-    for gps_old in root.findall("ProjectGpsSettings"):
-        root.remove(gps_old)
-
-    if "final_gpkg" in name_to_id:
-        final_id = name_to_id["final_gpkg"]
-        final_ds = datasource_for.get("final_gpkg", "./final/final_gpkg.gpkg")
-
-        gps_el = ET.Element(
-            "ProjectGpsSettings",
-            {
-                "autoCommitFeatures": "0",
-                "destinationFollowsActiveLayer": "1",
-                "autoAddTrackVertices": "0",
-                "destinationLayerProvider": "ogr",
-                "destinationLayer": final_id,
-                "destinationLayerName": "final_gpkg",
-                "destinationLayerSource": final_ds,
-            },
-        )
-        ET.SubElement(gps_el, "timeStampFields")
-        root.append(gps_el)
-
-    # 7) reescrever o arquivo com DOCTYPE preservado
-    new_xml = ET.tostring(root, encoding="unicode")
-    if doctype:
-        project_path.write_text(doctype + "\n" + new_xml, encoding="utf-8")
-    else:
-        project_path.write_text(new_xml, encoding="utf-8")
-
     print(f"🎉 Projeto salvo e pós-processado em {project_path}")
+    return project_path
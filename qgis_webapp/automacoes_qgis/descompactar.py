@@ -0,0 +1,175 @@
+"""
+Uploads compactados: DXF em .dxf.gz e pacotes .zip (DXF, e opcionalmente a
+ortofoto com seus arquivos auxiliares).
+
+A descompactação é em streaming, direto para o diretório do job, contando
+os bytes realmente escritos: os tamanhos declarados no cabeçalho do ZIP/gzip
+não são confiáveis. Passou de QGIS_DESCOMPACTADO_MAXIMO ou de
+QGIS_TAXA_COMPRESSAO_MAXIMA (bomba de compressão), para no meio e apaga o
+que já tinha escrito. Os caminhos de dentro do ZIP são descartados: cada
+arquivo entra pelo nome, então nada escapa do diretório do job.
+"""
+import gzip
+import stat
+import zipfile
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+from .upload_parcial import ErroUpload
+
+BLOCO = 1 << 20
+EXTENSOES_COMPACTADAS = (".zip", ".gz")
+EXTENSOES_ORTOFOTO = (".ecw", ".tif", ".tiff", ".jp2")
+# georreferência e metadados que acompanham a ortofoto (mesmo nome, outra extensão)
+EXTENSOES_AUXILIARES = (".tfw", ".tifw", ".eww", ".j2w", ".prj", ".aux.xml", ".ovr")
+# a taxa só é conferida depois disso: arquivos pequenos comprimem muito sem ser ataque
+MINIMO_PARA_TAXA = 16 * 2**20
+
+
+def compactado(nome: str) -> bool:
+    return nome.lower().endswith(EXTENSOES_COMPACTADAS)
+
+
+def nome_sem_compactacao(nome: str) -> str:
+    """obra.dxf.gz → obra.dxf; obra.zip → obra."""
+    nome = Path(nome).name
+    for sufixo in EXTENSOES_COMPACTADAS:
+        if nome.lower().endswith(sufixo):
+            return nome[: -len(sufixo)]
+    return nome
+
+
+class _Limite:
+    """Total descompactado e taxa de compressão de todo o upload."""
+
+    def __init__(self):
+        self.maximo = settings.QGIS_DESCOMPACTADO_MAXIMO
+        self.taxa = settings.QGIS_TAXA_COMPRESSAO_MAXIMA
+        self.escrito = 0
+
+    def contar(self, n: int, comprimido: int):
+        self.escrito += n
+        if self.escrito > self.maximo:
+            raise ErroUpload(f"Conteúdo descompactado maior que o permitido ({self.maximo} bytes).", 413)
+        if self.escrito > MINIMO_PARA_TAXA and self.escrito > self.taxa * max(comprimido, 1):
+            raise ErroUpload(f"Taxa de compressão acima de {self.taxa:g}:1; arquivo recusado.", 413)
+
+
+def _copiar(origem, destino: Path, limite: _Limite, comprimido):
+    """Copia o stream descompactado; comprimido() diz quantos bytes compactados já foram consumidos."""
+    with open(destino, "wb") as f:
+        while pedaco := origem.read(BLOCO):
+            f.write(pedaco)
+            limite.contar(len(pedaco), comprimido())
+
+
+def _gzip(arquivo, nome: str, upload_dir: Path, limite: _Limite) -> Path:
+    destino = upload_dir / nome_sem_compactacao(nome)
+    if destino.suffix.lower() != ".dxf":
+        raise ErroUpload("Só DXF compactado com gzip (.dxf.gz) é aceito.")
+    arquivo.seek(0)
+    try:
+        with gzip.GzipFile(fileobj=arquivo, mode="rb") as g:
+            _copiar(g, destino, limite, arquivo.tell)
+    except (OSError, EOFError, zlib.error) as e:
+        raise ErroUpload(f"Arquivo .gz inválido: {e}")
+    return destino
+
+
+def _nome(info) -> str:
+    """Só o nome do membro (ZIPs feitos no Windows às vezes usam barra invertida)."""
+    return Path(info.filename.replace("\\", "/")).name
+
+
+def _classificar(infos):
+    """(DXF, ortofoto ou None, auxiliares da ortofoto) entre os membros do ZIP."""
+    dxfs, ortofotos, outros = [], [], []
+    for info in infos:
+        nome = _nome(info)
+        if info.is_dir() or not nome or info.filename.startswith("__MACOSX/") or nome.startswith("._"):
+            continue
+        if stat.S_ISLNK(info.external_attr >> 16):
+            raise ErroUpload(f"Link simbólico no ZIP não é aceito: {info.filename}")
+        minusculo = nome.lower()
+        if minusculo.endswith(".dxf"):
+            dxfs.append(info)
+        elif minusculo.endswith(EXTENSOES_ORTOFOTO):
+            ortofotos.append(info)
+        elif minusculo.endswith(EXTENSOES_AUXILIARES):
+            outros.append(info)
+    if len(dxfs) != 1:
+        raise ErroUpload(f"O ZIP deve ter exatamente um DXF (encontrados: {len(dxfs)}).")
+    if len(ortofotos) > 1:
+        raise ErroUpload(f"O ZIP deve ter no máximo uma ortofoto (encontradas: {len(ortofotos)}).")
+    ortofoto = ortofotos[0] if ortofotos else None
+    base = _nome(ortofoto).rsplit(".", 1)[0].lower() if ortofoto else None
+    auxiliares = [i for i in outros if base and _nome(i).lower().startswith(base + ".")]
+    return dxfs[0], ortofoto, auxiliares
+
+
+def _zip(arquivo, upload_dir: Path, limite: _Limite, com_ortofoto: bool):
+    try:
+        zf = zipfile.ZipFile(arquivo)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ErroUpload(f"ZIP inválido: {e}")
+    with zf:
+        dxf, ortofoto, auxiliares = _classificar(zf.infolist())
+        membros = [(dxf, upload_dir)]
+        if ortofoto and com_ortofoto:
+            membros += [(info, upload_dir / "ortofoto") for info in [ortofoto, *auxiliares]]
+        ortho_path = None
+        comprimido = 0
+        for info, pasta in membros:
+            if info.flag_bits & 0x1:
+                raise ErroUpload(f"Arquivo protegido por senha no ZIP: {info.filename}")
+            pasta.mkdir(parents=True, exist_ok=True)
+            destino = pasta / _nome(info)
+            # o zipfile nunca lê mais que compress_size do membro: limite real do compactado
+            comprimido += info.compress_size
+            try:
+                with zf.open(info) as membro:
+                    _copiar(membro, destino, limite, lambda: comprimido)
+            except (zipfile.BadZipFile, NotImplementedError, OSError, EOFError, zlib.error) as e:
+                raise ErroUpload(f"Não foi possível extrair {info.filename}: {e}")
+            if info is ortofoto:
+                ortho_path = destino
+        return upload_dir / _nome(dxf), ortho_path
+
+
+def descompactar_upload(arquivo, nome: str, upload_dir: Path, com_ortofoto: bool = True):
+    """
+    Extrai o upload compactado (arquivo: binário com seek, como o UploadedFile
+    ou o destino do upload em partes) no diretório do job. Retorna
+    (caminho do DXF, caminho da ortofoto ou None). Em erro, apaga o que já
+    tinha extraído e levanta ErroUpload.
+    """
+    upload_dir = Path(upload_dir)
+    antes = set(upload_dir.rglob("*"))
+    limite = _Limite()
+    try:
+        if nome.lower().endswith(".zip"):
+            dxf_path, ortho_path = _zip(arquivo, upload_dir, limite, com_ortofoto)
+        else:
+            dxf_path, ortho_path = _gzip(arquivo, nome, upload_dir, limite), None
+    except BaseException:
+        for caminho in sorted(set(upload_dir.rglob("*")) - antes, reverse=True):
+            caminho.rmdir() if caminho.is_dir() else caminho.unlink(missing_ok=True)
+        raise
+    print(f"📦 {nome} descompactado: {limite.escrito} bytes")
+    return dxf_path, ortho_path
+
+
+def descompactar_arquivo(caminho: Path, upload_dir: Path, com_ortofoto: bool = True):
+    """
+    Extrai um compactado já gravado no diretório do job (upload em partes) e
+    o apaga, tendo dado certo ou não. É a primeira etapa do pipeline no
+    worker, para o PATCH da última parte não esperar a descompactação.
+    """
+    caminho = Path(caminho)
+    try:
+        with open(caminho, "rb") as f:
+            return descompactar_upload(f, caminho.name, upload_dir, com_ortofoto)
+    finally:
+        caminho.unlink(missing_ok=True)
@@ -0,0 +1,632 @@
+"""
+Envio de projetos ao QFieldCloud (API REST, a mesma usada pelo qfieldcloud-sdk).
+
+Vários arquivos sobem ao mesmo tempo (QFIELDCLOUD_UPLOAD_THREADS). O ritmo é
+ditado pelo servidor: um 429 segura todas as threads pelo Retry-After; 5xx e
+falhas de rede são repetidos com backoff exponencial. O corpo multipart é lido
+do disco em blocos, contando os bytes para o progresso de cada arquivo.
+
+Reenvios do mesmo job reaproveitam o projeto remoto, só mandam os arquivos
+cujo checksum mudou e apagam os que saíram do projeto (estado em
+.qfieldcloud.json no diretório do job).
+
+O envio roda como job na fila (executar_envio_qfieldcloud) e usa um cliente
+por processo (cliente_compartilhado): conexões reaproveitadas e token
+guardado, renovado quando vence ou é recusado.
+"""
+import email.utils
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .jobs import ETAPA_QFIELDCLOUD, JobInterrompido, limite_etapa, pedido_de_cancelamento
+from .progresso_bus import publicar
+
+ESTADO_QFIELDCLOUD = ".qfieldcloud.json"
+
+# o que sobe do diretório do job (além do project_cloud.qgs)
+PASTAS_ENVIO = ["final", "quadras", "ruas", "ortofoto"]
+EXTENSOES_ENVIO = {".gpkg", ".tif", ".vrt", ".png", ".qgs"}
+
+# tamanho das partes do ETag multipart do object storage (como o SDK calcula)
+PARTE_ETAG = 8 * 2**20
+
+
+class ErroQFieldCloud(Exception):
+    """Resposta de erro da API (status None = falha de rede)."""
+
+    def __init__(self, mensagem, status=None):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class _CorpoMultipart:
+    """multipart/form-data com um único campo "file", lido do disco sob demanda."""
+
+    def __init__(self, caminho: Path, nome_remoto: str, ao_ler=None):
+        fronteira = uuid.uuid4().hex
+        nome = nome_remoto.replace('"', "%22")
+        inicio = (
+            f"--{fronteira}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{nome}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        fim = f"\r\n--{fronteira}--\r\n".encode()
+        self.content_type = f"multipart/form-data; boundary={fronteira}"
+        self.len = len(inicio) + Path(caminho).stat().st_size + len(fim)
+        self._fontes = [io.BytesIO(inicio), open(caminho, "rb"), io.BytesIO(fim)]
+        self._ao_ler = ao_ler
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.len
+        partes = []
+        falta = n
+        while falta > 0 and self._fontes:
+            pedaco = self._fontes[0].read(falta)
+            if not pedaco:
+                self._fontes.pop(0).close()
+                continue
+            partes.append(pedaco)
+            falta -= len(pedaco)
+        dados = b"".join(partes)
+        if dados and self._ao_ler:
+            self._ao_ler(len(dados))
+        return dados
+
+    def close(self):
+        for fonte in self._fontes:
+            fonte.close()
+        self._fontes = []
+
+
+class ClienteQFieldCloud:
+    """
+    Chamadas da API usadas pelo site, sobre uma requests.Session. Com usuário
+    e senha, o login é feito na primeira chamada e refeito quando o token
+    vence (QFIELDCLOUD_TOKEN_VALIDADE) ou a API responde 401.
+    """
+
+    def __init__(self, url: str = None, token: str = "", sessao: requests.Session = None,
+                 usuario: str = "", senha: str = ""):
+        self.url = (url or settings.QFIELDCLOUD_URL).rstrip("/") + "/"
+        self.token = token
+        self.sessao = sessao or requests.Session()
+        self._usuario = usuario
+        self._senha = senha
+        self._token_obtido_em = time.monotonic()
+        self._trava = threading.Lock()
+
+    def _requisicao(self, metodo, caminho, timeout=(10, 300), **kwargs):
+        headers = {"Accept": "application/json", **kwargs.pop("headers", {})}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        # a API exige a barra final (o SDK acrescenta sempre)
+        url = self.url + caminho.strip("/") + "/"
+        return self.sessao.request(metodo, url, headers=headers, timeout=timeout, allow_redirects=False, **kwargs)
+
+    def _renovar_token(self, token_recusado):
+        with self._trava:
+            if self.token == token_recusado:  # outra thread pode já ter renovado
+                self.login(self._usuario, self._senha)
+
+    def _autenticada(self, fazer):
+        """Executa fazer() com um token válido; num 401, renova o token e repete uma vez."""
+        if self._usuario and (not self.token or
+                              time.monotonic() - self._token_obtido_em > settings.QFIELDCLOUD_TOKEN_VALIDADE):
+            self._renovar_token(self.token)
+        token = self.token
+        resp = fazer()
+        if resp.status_code == 401 and self._usuario:
+            print("🔑 Token do QFieldCloud recusado; refazendo o login")
+            self._renovar_token(token)
+            resp = fazer()
+        return resp
+
+    def _json(self, metodo, caminho, autenticar=True, **kwargs):
+        try:
+            if autenticar:
+                resp = self._autenticada(lambda: self._requisicao(metodo, caminho, **kwargs))
+            else:
+                resp = self._requisicao(metodo, caminho, **kwargs)
+        except requests.RequestException as e:
+            raise ErroQFieldCloud(f"{metodo} {caminho}: {e}") from e
+        if not resp.ok:
+            raise ErroQFieldCloud(f"{metodo} {caminho}: HTTP {resp.status_code} {resp.text[:200]}", resp.status_code)
+        return resp.json()
+
+    def login(self, usuario: str, senha: str) -> dict:
+        self.token = ""
+        dados = self._json("POST", "auth/login", autenticar=False, data={"username": usuario, "password": senha})
+        self.token = dados["token"]
+        self._usuario, self._senha = usuario, senha
+        self._token_obtido_em = time.monotonic()
+        print("🔑 Login no QFieldCloud feito")
+        return dados
+
+    def criar_projeto(self, nome: str, owner: str, descricao: str = "", publico: bool = False) -> dict:
+        return self._json("POST", "projects", json={
+            "name": nome, "owner": owner, "description": descricao, "is_public": publico,
+        })
+
+    def obter_projeto(self, project_id: str) -> dict | None:
+        """Dados do projeto; None se ele não existe mais (ou não é acessível)."""
+        try:
+            return self._json("GET", f"projects/{project_id}")
+        except ErroQFieldCloud as e:
+            if e.status in (403, 404):
+                return None
+            raise
+
+    def listar_arquivos(self, project_id: str) -> list:
+        """Arquivos do projeto: name, size, md5sum (ETag do object storage) e, se houver, sha256."""
+        return self._json("GET", f"files/{project_id}")
+
+    def enviar_arquivo(self, project_id: str, local: Path, remoto: str, ao_ler=None) -> requests.Response:
+        """Uma tentativa de envio; quem chama decide o que fazer com a resposta."""
+        def enviar():
+            corpo = _CorpoMultipart(local, remoto, ao_ler)
+            try:
+                return self._requisicao("POST", f"files/{project_id}/{quote(remoto)}", data=corpo,
+                                        headers={"Content-Type": corpo.content_type})
+            finally:
+                corpo.close()
+
+        return self._autenticada(enviar)
+
+    def apagar_arquivo(self, project_id: str, remoto: str):
+        """Apaga um arquivo do projeto (um que já não existe conta como apagado)."""
+        caminho = f"files/{project_id}/{quote(remoto)}"
+        try:
+            resp = self._autenticada(lambda: self._requisicao("DELETE", caminho, timeout=(10, 60)))
+        except requests.RequestException as e:
+            raise ErroQFieldCloud(f"DELETE {caminho}: {e}") from e
+        if not resp.ok and resp.status_code != 404:
+            raise ErroQFieldCloud(f"DELETE {caminho}: HTTP {resp.status_code} {resp.text[:200]}", resp.status_code)
+
+
+_clientes = {}
+_trava_clientes = threading.Lock()
+
+
+def cliente_compartilhado(url: str = None, usuario: str = None, senha: str = None) -> ClienteQFieldCloud:
+    """
+    Um cliente por processo para cada servidor/usuário: a sessão HTTP mantém
+    as conexões abertas entre envios (keep-alive, TLS já negociado) e o token
+    é reaproveitado, sem login a cada exportação.
+    """
+    url = url or settings.QFIELDCLOUD_URL
+    usuario = settings.QFIELDCLOUD_USUARIO if usuario is None else usuario
+    senha = settings.QFIELDCLOUD_SENHA if senha is None else senha
+    with _trava_clientes:
+        cliente = _clientes.get((url, usuario))
+        if cliente is None:
+            sessao = requests.Session()
+            # uma conexão por thread de envio, mais as chamadas de listagem
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=settings.QFIELDCLOUD_UPLOAD_THREADS + 2)
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            cliente = _clientes[(url, usuario)] = ClienteQFieldCloud(
+                url, token=settings.QFIELDCLOUD_TOKEN, sessao=sessao, usuario=usuario, senha=senha
+            )
+    return cliente
+
+
+# ==================== ENVIO EM PARALELO ====================
+def _retry_after(resposta) -> float | None:
+    """Segundos do Retry-After (número ou data HTTP); None se ausente/inválido."""
+    valor = resposta.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (email.utils.parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(tentativa: int, base: float, maximo: float) -> float:
+    return min(maximo, base * 2 ** (tentativa - 1)) * random.uniform(0.5, 1.0)
+
+
+class _Ritmo:
+    """Pausa compartilhada pelas threads, definida pelos 429 do servidor."""
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._liberado_em = 0.0
+
+    def segurar(self, segundos: float):
+        with self._trava:
+            self._liberado_em = max(self._liberado_em, time.monotonic() + segundos)
+
+    def aguardar(self):
+        while (espera := self._liberado_em - time.monotonic()) > 0:
+            time.sleep(min(espera, 1.0))
+
+
+@dataclass
+class ResultadoEnvio:
+    enviados: list = field(default_factory=list)
+    # já iguais no servidor (sincronização)
+    ignorados: list = field(default_factory=list)
+    # removidos do servidor por não fazerem mais parte do projeto (sincronização)
+    apagados: list = field(default_factory=list)
+    # caminho remoto → última mensagem de erro
+    falhas: dict = field(default_factory=dict)
+    bytes_enviados: int = 0
+    # motivo, se o envio parou antes do fim (os arquivos que faltavam não foram tentados)
+    interrompido: str = ""
+
+
+class _Progresso:
+    """Bytes por arquivo somados num estado único, repassado a ao_progredir."""
+
+    def __init__(self, arquivos, ao_progredir, intervalo):
+        self._trava = threading.Lock()
+        self._tamanhos = {remoto: Path(local).stat().st_size for local, remoto in arquivos}
+        self._enviado = dict.fromkeys(self._tamanhos, 0)
+        self._ativos = []
+        self.resultado = ResultadoEnvio()
+        self._ao_progredir = ao_progredir
+        self._intervalo = intervalo
+        self._ultimo = 0.0
+
+    def iniciar(self, remoto):
+        with self._trava:
+            self._enviado[remoto] = 0  # nova tentativa recomeça do zero
+            if remoto not in self._ativos:
+                self._ativos.append(remoto)
+
+    def somar(self, remoto, n):
+        with self._trava:
+            self._enviado[remoto] = min(self._tamanhos[remoto], self._enviado[remoto] + n)
+            self._notificar()
+
+    def concluir(self, remoto, erro=None):
+        with self._trava:
+            if remoto in self._ativos:
+                self._ativos.remove(remoto)
+            if erro:
+                self._enviado[remoto] = 0
+                self.resultado.falhas[remoto] = erro
+            else:
+                self._enviado[remoto] = self._tamanhos[remoto]
+                self.resultado.enviados.append(remoto)
+            self._notificar(forcar=True)
+
+    def _notificar(self, forcar=False):
+        self.resultado.bytes_enviados = sum(self._enviado.values())
+        agora = time.monotonic()
+        if not self._ao_progredir or (not forcar and agora - self._ultimo < self._intervalo):
+            return
+        self._ultimo = agora
+        total = sum(self._tamanhos.values())
+        self._ao_progredir({
+            "percentual": 100.0 * self.resultado.bytes_enviados / total if total else 100.0,
+            "concluidos": len(self.resultado.enviados) + len(self.resultado.falhas),
+            "total": len(self._tamanhos),
+            "falhas": len(self.resultado.falhas),
+            "enviando": list(self._ativos),
+            "bytes_enviados": self.resultado.bytes_enviados,
+            "bytes_total": total,
+        })
+
+
+def _enviar_com_tentativas(cliente, project_id, local, remoto, ritmo, progresso, tentativas, espera_base, espera_maxima):
+    erro = ""
+    for tentativa in range(1, tentativas + 1):
+        ritmo.aguardar()
+        progresso.iniciar(remoto)
+        espera = None
+        try:
+            resp = cliente.enviar_arquivo(project_id, local, remoto, ao_ler=lambda n: progresso.somar(remoto, n))
+        except requests.RequestException as e:
+            erro = f"falha de rede: {e}"
+        else:
+            if resp.ok:
+                return
+            erro = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if resp.status_code == 429:
+                # todas as threads esperam; esta tenta de novo logo após
+                ritmo.segurar(_retry_after(resp) or _backoff(tentativa, espera_base, espera_maxima))
+                espera = 0.0
+            elif resp.status_code < 500 and resp.status_code != 408:
+                raise ErroQFieldCloud(erro, resp.status_code)  # repetir não adianta
+            else:
+                espera = _retry_after(resp)
+        if tentativa < tentativas:
+            print(f"🔁 {remoto}: {erro}; tentativa {tentativa + 1}/{tentativas}")
+            time.sleep(_backoff(tentativa, espera_base, espera_maxima) if espera is None else espera)
+    raise ErroQFieldCloud(erro)
+
+
+def enviar_arquivos(cliente: ClienteQFieldCloud, project_id: str, arquivos, ao_progredir=None,
+                    threads: int = None, tentativas: int = None, espera_base: float = 1.0,
+                    espera_maxima: float = 60.0, intervalo_progresso: float = 0.5, parar=None) -> ResultadoEnvio:
+    """
+    Envia [(caminho local, caminho remoto)] com até `threads` envios ao mesmo
+    tempo. ao_progredir recebe o estado agregado (percentual em bytes,
+    concluídos, falhas, arquivos em envio) a cada intervalo_progresso
+    segundos e ao fim de cada arquivo. Falhas não interrompem os demais.
+    parar() é consultado antes de cada arquivo e de cada lote: o motivo que
+    ele devolver encerra o envio (os arquivos já em curso terminam).
+    """
+    threads = threads or settings.QFIELDCLOUD_UPLOAD_THREADS
+    tentativas = tentativas or settings.QFIELDCLOUD_UPLOAD_TENTATIVAS
+    ritmo = _Ritmo()
+    progresso = _Progresso(arquivos, ao_progredir, intervalo_progresso)
+
+    def deve_parar():
+        if not progresso.resultado.interrompido and parar:
+            progresso.resultado.interrompido = parar() or ""
+        return bool(progresso.resultado.interrompido)
+
+    def enviar(local, remoto):
+        if deve_parar():
+            return
+        try:
+            _enviar_com_tentativas(cliente, project_id, local, remoto, ritmo, progresso,
+                                   tentativas, espera_base, espera_maxima)
+        except Exception as e:
+            print(f"⚠️ Falha ao enviar {remoto}: {e}")
+            progresso.concluir(remoto, erro=str(e))
+        else:
+            print(f"✅ Upload concluído: {remoto}")
+            progresso.concluir(remoto)
+
+    # o .qgs sobe por último, com os dados já no servidor (o QFieldCloud
+    # processa o projeto quando ele chega)
+    dados = [a for a in arquivos if not a[1].lower().endswith((".qgs", ".qgz"))]
+    projetos = [a for a in arquivos if a[1].lower().endswith((".qgs", ".qgz"))]
+    with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="qfieldcloud") as executor:
+        for lote in (dados, projetos):
+            if deve_parar():
+                break
+            wait([executor.submit(enviar, Path(local), remoto) for local, remoto in lote])
+    return progresso.resultado
+
+
+# ==================== SINCRONIZAÇÃO ====================
+def _somas_arquivo(caminho: Path) -> tuple[str, str]:
+    """(ETag do object storage, sha256) numa leitura só."""
+    sha = hashlib.sha256()
+    partes = []
+    with open(caminho, "rb") as f:
+        while parte := f.read(PARTE_ETAG):
+            sha.update(parte)
+            partes.append(hashlib.md5(parte).digest())
+    if len(partes) <= 1:
+        etag = (partes[0] if partes else hashlib.md5().digest()).hex()
+    else:
+        etag = f"{hashlib.md5(b''.join(partes)).hexdigest()}-{len(partes)}"
+    return etag, sha.hexdigest()
+
+
+def _ler_estado(upload_dir: Path) -> dict:
+    try:
+        return json.loads((upload_dir / ESTADO_QFIELDCLOUD).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _gravar_estado(upload_dir: Path, estado: dict):
+    tmp = upload_dir / (ESTADO_QFIELDCLOUD + ".tmp")
+    tmp.write_text(json.dumps(estado, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, upload_dir / ESTADO_QFIELDCLOUD)
+
+
+def somas_locais(arquivos, cache: dict) -> dict:
+    """
+    remoto → (etag, sha256). Cada arquivo só é lido quando tamanho, mtime ou
+    inode mudam desde o cálculo guardado em cache (atualizado no lugar).
+    """
+    somas = {}
+    for local, remoto in arquivos:
+        st = Path(local).stat()
+        assinatura = [st.st_size, st.st_mtime_ns, st.st_ino]
+        anterior = cache.get(remoto)
+        if not anterior or anterior[:3] != assinatura:
+            anterior = cache[remoto] = assinatura + list(_somas_arquivo(local))
+        somas[remoto] = tuple(anterior[3:5])
+    return somas
+
+
+def _igual_no_servidor(remoto: dict | None, etag: str, sha: str) -> bool | None:
+    """
+    Compara pelo sha256 quando o servidor informa; senão pelo ETag. Um ETag
+    multipart ("<md5>-N") que não bate não prova mudança (as partes podem ter
+    outro tamanho): None, a decidir pelo que este job já enviou.
+    """
+    if not remoto:
+        return False
+    if remoto.get("sha256"):
+        return remoto["sha256"] == sha
+    etag_remoto = (remoto.get("md5sum") or remoto.get("etag") or "").strip('"')
+    if etag_remoto == etag:
+        return True
+    if "-" in etag_remoto or "-" in etag:
+        return None
+    return False
+
+
+def _gerenciado(remoto: str) -> bool:
+    """Arquivo que a sincronização mantém (o resto, como as fotos do QField em DCIM/, não é apagado)."""
+    caminho = Path(remoto)
+    if remoto == "project_cloud.qgs":
+        return True
+    return len(caminho.parts) > 1 and caminho.parts[0] in PASTAS_ENVIO and caminho.suffix.lower() in EXTENSOES_ENVIO
+
+
+def sincronizar_projeto(cliente: ClienteQFieldCloud, upload_dir: Path, arquivos, nome: str, owner: str,
+                        descricao: str = "", novo: bool = False, ao_progredir=None, parar=None):
+    """
+    Envia o projeto do job reaproveitando o projeto remoto criado antes (a
+    menos que novo=True ou ele tenha sumido do servidor), pula os arquivos
+    cujo checksum remoto já bate com o local e, depois dos envios, apaga do
+    servidor os arquivos gerenciados que saíram do projeto (não se o envio
+    foi interrompido por parar(), ver enviar_arquivos). Retorna
+    (project_id, ResultadoEnvio).
+    """
+    upload_dir = Path(upload_dir)
+    estado = _ler_estado(upload_dir)
+    project_id = None if novo else estado.get("project_id")
+    if project_id and cliente.obter_projeto(project_id) is None:
+        print(f"⚠️ Projeto {project_id} não existe mais no QFieldCloud; criando outro")
+        project_id = None
+
+    if project_id:
+        remotos = {f["name"]: f for f in cliente.listar_arquivos(project_id)}
+    else:
+        project_id = cliente.criar_projeto(nome, owner, descricao)["id"]
+        remotos = {}
+    if estado.get("project_id") != project_id:
+        estado["enviados"] = {}
+    estado["project_id"] = project_id
+    # remoto → sha256 do que este job enviou com sucesso ao projeto atual
+    enviados = estado.setdefault("enviados", {})
+
+    somas = somas_locais(arquivos, estado.setdefault("arquivos", {}))
+    _gravar_estado(upload_dir, estado)
+
+    pendentes = []
+    for local, remoto in arquivos:
+        igual = _igual_no_servidor(remotos.get(remoto), *somas[remoto])
+        if igual is None:
+            # ETag incomparável: vale o registro do último envio, se o tamanho ainda bate
+            igual = (enviados.get(remoto) == somas[remoto][1]
+                     and remotos[remoto].get("size") == Path(local).stat().st_size)
+        if not igual:
+            pendentes.append((local, remoto))
+    ignorados = [remoto for _, remoto in arquivos if remoto not in {r for _, r in pendentes}]
+    obsoletos = sorted(n for n in set(remotos) - {r for _, r in arquivos} if _gerenciado(n))
+    print(f"🔄 QFieldCloud {project_id}: {len(pendentes)} arquivo(s) a enviar, {len(ignorados)} já atualizado(s), "
+          f"{len(obsoletos)} a apagar")
+
+    resultado = enviar_arquivos(cliente, project_id, pendentes, ao_progredir=ao_progredir, parar=parar)
+    resultado.ignorados = ignorados
+    for remoto in resultado.enviados:
+        enviados[remoto] = somas[remoto][1]
+
+    # só depois dos envios: o projeto nunca fica sem um arquivo que o .qgs ainda usa
+    for remoto in [] if resultado.interrompido else obsoletos:
+        try:
+            cliente.apagar_arquivo(project_id, remoto)
+        except ErroQFieldCloud as e:
+            print(f"⚠️ Falha ao apagar {remoto} do QFieldCloud: {e}")
+            resultado.falhas[remoto] = str(e)
+            continue
+        enviados.pop(remoto, None)
+        resultado.apagados.append(remoto)
+    _gravar_estado(upload_dir, estado)
+    return project_id, resultado
+
+
+def arquivos_para_envio(upload_dir: Path):
+    """(arquivo, caminho remoto) do projeto do job, mantendo as subpastas."""
+    upload_dir = Path(upload_dir)
+    files = []
+    for pasta in PASTAS_ENVIO:
+        dir_path = upload_dir / pasta
+        if dir_path.exists():
+            for root, _, fnames in os.walk(dir_path):
+                for fname in fnames:
+                    fpath = Path(root) / fname
+                    if fpath.suffix.lower() in EXTENSOES_ENVIO:
+                        files.append(fpath)
+
+    project_qgs = upload_dir / "project_cloud.qgs"
+    if project_qgs.exists():
+        files.append(project_qgs)
+    return [(f, f.relative_to(upload_dir).as_posix()) for f in sorted(files)]
+
+
+def nome_do_projeto(upload_dir: Path) -> str:
+    """Nome do projeto remoto, tirado do nome da ortofoto."""
+    ortho_files = sorted((Path(upload_dir) / "ortofoto").glob("*.tif"))
+    if not ortho_files:
+        return "Projeto_Sem_Ortofoto"
+    ortho_name = ortho_files[0].stem.replace("reduzido", "")
+    ortho_name = ortho_name.replace("Ortofoto", "").replace("ortofoto", "").strip().replace(" ", "").replace("_", "")
+    return ortho_name or "Projeto_Sem_Nome"
+
+
+def executar_envio_qfieldcloud(upload_dir: Path, canal: str, novo: bool = False, job_id=None):
+    """
+    Job de envio (Job.TIPO_QFIELDCLOUD): sincroniza o projeto do job com o
+    cliente compartilhado do processo e publica o progresso no canal. Entre
+    um arquivo e outro, para se o job foi cancelado ou passou do limite do
+    envio (JobInterrompido, como as etapas do pipeline).
+    """
+    upload_dir = Path(upload_dir)
+    # publicado a cada passo: o supervisor mede o limite a partir daqui
+    inicio = time.time()
+    limite = limite_etapa(ETAPA_QFIELDCLOUD)
+    ultima = {"etapa": 0}
+
+    def parar():
+        if job_id and pedido_de_cancelamento(job_id):
+            return "Cancelado pelo usuário."
+        if time.time() - inicio > limite:
+            return f"Tempo esgotado no envio ao QFieldCloud (limite {limite:.0f} s)."
+        return None
+
+    try:
+        arquivos = arquivos_para_envio(upload_dir)
+        total = len(arquivos)
+        print(f"📦 {total} arquivos encontrados para upload em {upload_dir}")
+
+        def ao_progredir(estado):
+            enviando = ", ".join(estado["enviando"][:3]) or "finalizando"
+            ultima["etapa"] = estado["concluidos"]
+            publicar(
+                canal, estado["concluidos"], f"⬆️ Enviando {enviando} ({estado['concluidos']}/{estado['total']})",
+                percentual=estado["percentual"], total=estado["total"], falhas=estado["falhas"], inicio_etapa=inicio,
+            )
+
+        publicar(canal, 0, "🔎 Comparando com o QFieldCloud...", inicio_etapa=inicio)
+        project_id, resultado = sincronizar_projeto(
+            cliente_compartilhado(), upload_dir, arquivos,
+            nome=nome_do_projeto(upload_dir),
+            owner=settings.QFIELDCLOUD_OWNER,
+            descricao="Exportado via Django",
+            novo=novo,
+            ao_progredir=ao_progredir,
+            parar=parar,
+        )
+    except Exception as e:
+        publicar(canal, 99, f"❌ Falha ao enviar para o QFieldCloud: {e}", final=True)
+        raise
+
+    if resultado.interrompido:
+        publicar(canal, 99, f"🛑 {resultado.interrompido}", final=True, etapa_interrompida=ultima["etapa"])
+        raise JobInterrompido(ultima["etapa"], resultado.interrompido)
+
+    if resultado.falhas:
+        mensagem = f"⚠️ Upload concluído com {len(resultado.falhas)} falha(s): " + ", ".join(resultado.falhas)
+    elif not resultado.enviados and not resultado.apagados:
+        mensagem = "✅ Projeto já estava atualizado no QFieldCloud."
+    else:
+        mensagem = (f"✅ Upload concluído! ({len(resultado.enviados)} enviado(s), {len(resultado.ignorados)} sem mudança"
+                    + (f", {len(resultado.apagados)} apagado(s))" if resultado.apagados else ")"))
+    publicar(canal, total, mensagem, percentual=100, final=True, total=total, falhas=len(resultado.falhas),
+             projeto_id=project_id)
+    print("✅ Finalizado!")
+    return project_id, resultado
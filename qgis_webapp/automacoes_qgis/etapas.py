@@ -0,0 +1,24 @@
+"""
+Avanço e cancelamento cooperativo das etapas escritas em Python puro.
+
+Sem QGIS: serve ao pipeline (worker) e a medidas_lotes.py (testado fora
+dele). O feedback é qualquer objeto com isCanceled()/setProgress(), como o
+FeedbackJob de tarefas.py.
+"""
+
+
+class ProcessamentoCancelado(Exception):
+    """O job foi cancelado pelo feedback (feedback.isCanceled())."""
+
+
+def avancar(feedback, percentual=None):
+    """
+    Informa o avanço (0–100) de uma etapa ao feedback e interrompe se o job
+    foi cancelado. Usado entre os trechos das etapas em Python puro.
+    """
+    if feedback is None:
+        return
+    if feedback.isCanceled():
+        raise ProcessamentoCancelado("Processamento cancelado.")
+    if percentual is not None:
+        feedback.setProgress(percentual)
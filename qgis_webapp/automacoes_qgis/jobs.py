@@ -0,0 +1,312 @@
+"""
+Fila de jobs persistida no banco (modelo Job).
+
+O web só enfileira; quem executa são os processos de `manage.py qgis_worker`,
+que reivindicam o próximo job com um UPDATE condicional (funciona em SQLite
+e Postgres sem lock de tabela).
+"""
+import gc
+import importlib
+import os
+import shutil
+import socket
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .metricas import ARQUIVO_METRICAS, metricas_do_job
+from .models import Job
+from .progresso_bus import canal_job, ler, publicar
+
+
+class JobInterrompido(Exception):
+    """O job parou no meio: cancelado pelo usuário ou por tempo esgotado numa etapa."""
+
+    def __init__(self, etapa, motivo):
+        super().__init__(motivo)
+        self.etapa = etapa
+        self.motivo = motivo
+
+
+def identificador_worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enfileirar_job(upload_dir, session_key="", tipo=Job.TIPO_PIPELINE, prioridade=0, **parametros) -> Job:
+    """Cria o job pendente; os caminhos em parametros são gravados como texto."""
+    parametros = {k: (str(v) if v is not None else None) for k, v in parametros.items()}
+    job = Job.objects.create(
+        tipo=tipo,
+        prioridade=prioridade,
+        session_key=session_key or "",
+        upload_dir=str(upload_dir),
+        parametros=parametros,
+    )
+    print(f"📥 Job {job.pk} enfileirado ({tipo}, prioridade {prioridade})")
+    return job
+
+
+def reivindicar_job(worker: str) -> Job | None:
+    """Pega o próximo job pendente (prioridade desc, FIFO). None se a fila estiver vazia."""
+    while True:
+        pk = (
+            Job.objects.filter(status=Job.Status.PENDENTE)
+            .order_by("-prioridade", "criado_em")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if pk is None:
+            return None
+        ok = Job.objects.filter(pk=pk, status=Job.Status.PENDENTE).update(
+            status=Job.Status.EXECUTANDO, worker=worker, iniciado_em=timezone.now()
+        )
+        if ok:
+            return Job.objects.get(pk=pk)
+        # outro worker levou este; tenta o próximo
+
+
+def finalizar_job(job: Job, erro: str = ""):
+    job.status = Job.Status.FALHOU if erro else Job.Status.CONCLUIDO
+    job.erro = erro
+    job.concluido_em = timezone.now()
+    job.metricas = metricas_do_job(Path(job.upload_dir), job.pk)
+    job.save(update_fields=["status", "erro", "concluido_em", "metricas"])
+    _arquivo_cancelamento(job.pk).unlink(missing_ok=True)
+
+
+def canal_do_job(job: Job) -> str:
+    # o retry publica no canal do job original, que o navegador já acompanha
+    return job.parametros.get("canal") or canal_job(job.pk)
+
+
+# chave de QGIS_LIMITE_ETAPAS do envio ao QFieldCloud, que publica arquivos, não etapas
+ETAPA_QFIELDCLOUD = "qfieldcloud"
+
+
+def limite_etapa(etapa) -> float:
+    """Tempo máximo (s) da etapa, de QGIS_LIMITE_ETAPAS ou o padrão."""
+    return settings.QGIS_LIMITE_ETAPAS.get(str(etapa), settings.QGIS_LIMITE_ETAPA_PADRAO)
+
+
+def _arquivo_cancelamento(job_id) -> Path:
+    return Path(settings.PROGRESSO_DIR) / f"cancelar-{job_id}"
+
+
+def pedido_de_cancelamento(job_id) -> float | None:
+    """Instante (epoch) em que o cancelamento foi pedido; None se não foi."""
+    try:
+        return _arquivo_cancelamento(job_id).stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def cancelar_job(job: Job) -> str:
+    """
+    Pendente: sai da fila na hora. Executando: deixa o pedido para o worker,
+    que cancela o feedback na próxima verificação (e o supervisor mata o
+    processo se ele não parar). Retorna o status resultante.
+    """
+    if Job.objects.filter(pk=job.pk, status=Job.Status.PENDENTE).update(
+        status=Job.Status.CANCELADO, erro="Cancelado pelo usuário.", concluido_em=timezone.now()
+    ):
+        publicar(canal_do_job(job), 99, "🛑 Processamento cancelado.", final=True, **extras_da_interrupcao(job))
+        return Job.Status.CANCELADO
+
+    job.refresh_from_db()
+    if job.status == Job.Status.EXECUTANDO:
+        arquivo = _arquivo_cancelamento(job.pk)
+        arquivo.parent.mkdir(parents=True, exist_ok=True)
+        arquivo.touch()
+        print(f"🛑 Cancelamento do job {job.pk} pedido")
+    return job.status
+
+
+def limpar_saidas_parciais(upload_dir: Path):
+    """
+    Apaga o que o pipeline gerou no upload, mantendo só as entradas (DXF e
+    ortofoto) e o run_metrics.json, que mostra onde e por que o job parou.
+    """
+    if not upload_dir.is_dir():
+        return
+    for item in upload_dir.iterdir():
+        if item.name in ("ortofoto", ARQUIVO_METRICAS) or (item.is_file() and item.suffix.lower() == ".dxf"):
+            continue
+        if item.is_dir():
+            shutil.rmtree(item, ignore_errors=True)
+        else:
+            item.unlink(missing_ok=True)
+
+
+def limpar_saidas_do_retry(upload_dir: Path):
+    """
+    Apaga só o que o retry do Overpass gera (ruas, produtos das etapas 15+ e o
+    projeto final); as quadras e o final.shp da etapa 13 ficam para a próxima tentativa.
+    """
+    shutil.rmtree(upload_dir / "ruas", ignore_errors=True)
+    final_dir = upload_dir / "final"
+    if final_dir.is_dir():
+        for item in final_dir.iterdir():
+            if item.is_file() and item.stem != "final":
+                item.unlink(missing_ok=True)
+    (upload_dir / "project_cloud.qgs").unlink(missing_ok=True)
+
+
+def extras_da_interrupcao(job: Job) -> dict:
+    """Campos do canal ao parar o job: o retry interrompido deixa o Overpass pendente de novo."""
+    if job.tipo != Job.TIPO_OVERPASS:
+        return {}
+    return {"aguardando_ruas": True, "ortho_path": job.parametros.get("ortho_path")}
+
+
+def interromper_job(job: Job, etapa, motivo: str):
+    """Registra onde o job parou e apaga as saídas parciais (o envio não gera nenhuma)."""
+    job.status = Job.Status.CANCELADO
+    job.erro = motivo
+    job.etapa_interrompida = etapa
+    job.concluido_em = timezone.now()
+    job.metricas = metricas_do_job(Path(job.upload_dir), job.pk)
+    job.save(update_fields=["status", "erro", "etapa_interrompida", "concluido_em", "metricas"])
+    _arquivo_cancelamento(job.pk).unlink(missing_ok=True)
+    if job.tipo == Job.TIPO_PIPELINE:
+        limpar_saidas_parciais(Path(job.upload_dir))
+    elif job.tipo == Job.TIPO_OVERPASS:
+        limpar_saidas_do_retry(Path(job.upload_dir))
+    print(f"🛑 Job {job.pk} interrompido na etapa {etapa}: {motivo}")
+
+
+def verificar_worker_travado(worker: str):
+    """
+    (job, etapa, motivo) se o job em execução no worker já devia ter parado e
+    não parou: cancelamento pedido ou etapa acima do limite há mais de
+    QGIS_TOLERANCIA_CANCELAMENTO segundos. None se está tudo em ordem.
+    """
+    job = Job.objects.filter(status=Job.Status.EXECUTANDO, worker=worker).first()
+    if job is None:
+        return None
+    estado = ler(canal_do_job(job)) or {}
+    etapa = estado.get("etapa")
+    tolerancia = settings.QGIS_TOLERANCIA_CANCELAMENTO
+    agora = time.time()
+
+    pedido = pedido_de_cancelamento(job.pk)
+    if pedido and agora - pedido > tolerancia:
+        return job, etapa, "Cancelado pelo usuário (worker encerrado à força)."
+
+    inicio = estado.get("inicio_etapa")
+    if inicio and etapa is not None and not estado.get("final"):
+        limite = limite_etapa(ETAPA_QFIELDCLOUD if job.tipo == Job.TIPO_QFIELDCLOUD else etapa)
+        if agora - inicio > limite + tolerancia:
+            return job, etapa, f"Tempo esgotado na etapa {etapa} (limite {limite:.0f} s); worker encerrado à força."
+    return None
+
+
+def executar_job(job: Job):
+    """Despacha o job para a função do tipo correspondente."""
+    p = job.parametros
+    canal = canal_do_job(job)
+    if job.tipo == Job.TIPO_QFIELDCLOUD:
+        # só rede: não carrega o QGIS
+        from .envio_qfieldcloud import executar_envio_qfieldcloud
+        return executar_envio_qfieldcloud(Path(job.upload_dir), canal, novo=p.get("novo") == "1", job_id=job.pk)
+
+    from .tarefas import executar_pipeline, executar_retry_overpass
+
+    ortho_path = Path(p["ortho_path"]) if p.get("ortho_path") else None
+    if job.tipo == Job.TIPO_PIPELINE:
+        return executar_pipeline(Path(job.upload_dir), Path(p["dxf_path"]), ortho_path, canal, job.pk,
+                                 ortho_upload=p.get("ortho_upload"), compactado=p.get("compactado"))
+    if job.tipo == Job.TIPO_OVERPASS:
+        return executar_retry_overpass(Path(job.upload_dir), ortho_path, canal, job.pk)
+    raise ValueError(f"Tipo de job desconhecido: {job.tipo}")
+
+
+def rss_mb() -> float | None:
+    """Memória residente atual do processo (MB); None se não der para medir."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def motivo_reciclagem(feitos: int, rss: float | None, max_jobs: int = 0, max_rss_mb: float = 0) -> str | None:
+    """
+    Por que o worker deve sair para ser reciclado depois do último job, ou
+    None para continuar. max_jobs/max_rss_mb = 0 desligam o limite; sem
+    medição de memória (rss None) só vale o de jobs.
+    """
+    if max_jobs and feitos >= max_jobs:
+        return f"atingiu {feitos} jobs"
+    if max_rss_mb and rss and rss > max_rss_mb:
+        return f"com {rss:.0f} MB (> {max_rss_mb} MB)"
+    return None
+
+
+def loop_worker(intervalo: float = 1.0, parar=lambda: False, max_jobs: int = 0, max_rss_mb: float = 0):
+    """
+    Laço de um processo worker: aquece o QGIS uma vez, depois reivindica,
+    executa e registra jobs. Sai sozinho (para ser reciclado pelo supervisor)
+    depois de max_jobs jobs ou quando a memória passar de max_rss_mb.
+    """
+    from .qgis_setup import init_qgis, resetar_estado_qgis
+
+    worker = identificador_worker()
+    init_qgis()
+    # aquecimento: tarefas puxa o pipeline, o processing e o geopandas; importado
+    # aqui, o primeiro job não paga esses segundos (executar_job o importa de novo, já em cache)
+    importlib.import_module(".tarefas", __package__)
+    print(f"👷 Worker {worker} aquecido, aguardando jobs...")
+
+    feitos = 0
+    while not parar():
+        close_old_connections()
+        job = reivindicar_job(worker)
+        if job is None:
+            time.sleep(intervalo)
+            continue
+
+        print(f"▶️ Worker {worker} executando job {job.pk}")
+        try:
+            executar_job(job)
+            finalizar_job(job)
+        except JobInterrompido as e:
+            interromper_job(job, e.etapa, e.motivo)
+        except Exception:
+            finalizar_job(job, erro=traceback.format_exc())
+            print(f"❌ Job {job.pk} falhou:\n{job.erro}")
+        finally:
+            resetar_estado_qgis()
+            gc.collect()
+
+        feitos += 1
+        motivo = motivo_reciclagem(feitos, rss_mb() if max_rss_mb else None, max_jobs, max_rss_mb)
+        if motivo:
+            print(f"♻️ Worker {worker} {motivo}; reciclando")
+            return
+
+
+def recuperar_jobs_orfaos(host: str = None) -> int:
+    """Devolve à fila os jobs que estavam em execução neste host quando os workers caíram."""
+    host = host or socket.gethostname()
+    n = Job.objects.filter(status=Job.Status.EXECUTANDO, worker__startswith=f"{host}:").update(
+        status=Job.Status.PENDENTE, worker="", iniciado_em=None
+    )
+    if n:
+        print(f"♻️ {n} job(s) interrompido(s) devolvido(s) à fila")
+    return n
+
+
+def marcar_falha_do_worker(worker: str, motivo: str):
+    """Jobs de um worker que morreu no meio da execução ficam como falha (sem loop de reexecução)."""
+    Job.objects.filter(status=Job.Status.EXECUTANDO, worker=worker).update(
+        status=Job.Status.FALHOU, erro=motivo, concluido_em=timezone.now()
+    )
@@ -0,0 +1,93 @@
+import multiprocessing
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _processo_worker(intervalo, max_jobs, max_rss_mb):
+    """Ponto de entrada de cada processo filho (spawn: reconfigura o Django)."""
+    import django
+    django.setup()
+
+    from automacoes_qgis.jobs import loop_worker
+
+    parar = {"sinal": False}
+    signal.signal(signal.SIGTERM, lambda *_: parar.update(sinal=True))
+    loop_worker(intervalo=intervalo, parar=lambda: parar["sinal"], max_jobs=max_jobs, max_rss_mb=max_rss_mb)
+
+
+class Command(BaseCommand):
+    help = "Sobe N processos worker que executam os jobs QGIS enfileirados pelo site."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processos", type=int, default=settings.QGIS_WORKERS,
+                            help="Quantidade de processos worker (padrão: QGIS_WORKERS).")
+        parser.add_argument("--intervalo", type=float, default=settings.QGIS_WORKER_INTERVALO,
+                            help="Segundos entre consultas à fila quando ela está vazia.")
+        parser.add_argument("--max-jobs", type=int, default=settings.QGIS_WORKER_MAX_JOBS,
+                            help="Recicla o processo depois de N jobs (0 = nunca).")
+        parser.add_argument("--max-rss-mb", type=float, default=settings.QGIS_WORKER_MAX_RSS_MB,
+                            help="Recicla o processo quando a memória residente passar disso (0 = nunca).")
+
+    def handle(self, *args, processos, intervalo, max_jobs, max_rss_mb, **options):
+        from automacoes_qgis.jobs import (canal_do_job, extras_da_interrupcao, interromper_job,
+                                          marcar_falha_do_worker, recuperar_jobs_orfaos, verificar_worker_travado)
+        from automacoes_qgis.progresso_bus import publicar
+
+        recuperar_jobs_orfaos()
+        connections.close_all()
+
+        ctx = multiprocessing.get_context("spawn")
+        host = socket.gethostname()
+        filhos = {}
+        encerrando = {"sinal": False}
+
+        def iniciar(indice):
+            p = ctx.Process(target=_processo_worker, args=(intervalo, max_jobs, max_rss_mb), name=f"qgis-worker-{indice}")
+            p.start()
+            filhos[indice] = p
+
+        def encerrar(*_):
+            encerrando["sinal"] = True
+
+        signal.signal(signal.SIGTERM, encerrar)
+        signal.signal(signal.SIGINT, encerrar)
+
+        for i in range(processos):
+            iniciar(i)
+        self.stdout.write(f"🚀 {processos} worker(s) QGIS iniciados")
+
+        # Supervisor: mata workers que não atenderam a um cancelamento/limite
+        # de tempo e repõe processos que morreram
+        while not encerrando["sinal"]:
+            time.sleep(1)
+            for i, p in list(filhos.items()):
+                if p.is_alive():
+                    travado = verificar_worker_travado(f"{host}:{p.pid}")
+                    if travado is None:
+                        continue
+                    job, etapa, motivo = travado
+                    self.stdout.write(f"🛑 Worker {p.name} não parou o job {job.pk}; encerrando o processo")
+                    p.kill()
+                    p.join(timeout=10)
+                    interromper_job(job, etapa, motivo)
+                    publicar(canal_do_job(job), 99, f"🛑 {motivo}", final=True, etapa_interrompida=etapa,
+                             **extras_da_interrupcao(job))
+                    iniciar(i)
+                    continue
+                if p.exitcode == 0:
+                    self.stdout.write(f"♻️ Worker {p.name} reciclado")
+                else:
+                    marcar_falha_do_worker(f"{host}:{p.pid}", f"Worker encerrado inesperadamente (código {p.exitcode}).")
+                    self.stdout.write(f"⚠️ Worker {p.name} saiu (código {p.exitcode}); reiniciando")
+                iniciar(i)
+
+        self.stdout.write("🛑 Encerrando workers...")
+        for p in filhos.values():
+            p.terminate()
+        for p in filhos.values():
+            p.join(timeout=30)
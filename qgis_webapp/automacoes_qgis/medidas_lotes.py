@@ -0,0 +1,386 @@
+"""
+Medidas, rumos e confrontantes dos lotes, e o grafo de adjacência que
+essas etapas usam. Só geopandas/shapely/NumPy: nada aqui depende do QGIS,
+então roda (e é testado) fora do worker.
+"""
+import inspect
+import json
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from .arquivo_utils import assinatura_arquivo, hash_arquivo
+from .etapas import avancar
+
+
+LADOS_LOTE = ["Frente", "Direita", "Fundos", "Esquerda"]
+
+
+def _formatar_rumos(dx, dy):
+    """
+    Converte vetores (dx, dy) em rumos no formato 45°30'15" NE.
+    Recebe arrays; devolve lista de strings (None onde o vetor é nulo).
+    """
+    dx = np.asarray(dx, dtype=float)
+    dy = np.asarray(dy, dtype=float)
+    az = np.degrees(np.arctan2(dx, dy)) % 360.0  # azimute a partir do Norte
+
+    rumo = np.select(
+        [az <= 90, az <= 180, az <= 270],
+        [az, 180.0 - az, az - 180.0],
+        default=360.0 - az
+    )
+    ns = np.where((az <= 90) | (az >= 270), "N", "S")
+    ew = np.where(az <= 180, "E", "W")
+
+    seg = np.rint(rumo * 3600).astype(np.int64)
+    graus, resto = np.divmod(seg, 3600)
+    minutos, segundos = np.divmod(resto, 60)
+    nulo = np.hypot(dx, dy) == 0
+
+    # rumos exatos sobre os eixos usam só uma letra (N, S, E, W)
+    sufixo = np.char.add(ns, ew)
+    sufixo = np.where(seg == 0, ns, sufixo)
+    sufixo = np.where(seg == 90 * 3600, ew, sufixo)
+
+    return [
+        None if z else f"{g}°{m:02d}'{s:02d}\" {suf}"
+        for z, g, m, s, suf in zip(nulo, graus, minutos, segundos, sufixo)
+    ]
+
+
+def _lotes_e_ruas_nomeadas(upload_dir, arquivo_lotes, epsg_lotes=31983):
+    """Lotes do GPKG final e ruas com nome dissolvidas por nome, no mesmo CRS."""
+    lotes = gpd.read_file(upload_dir / "final" / arquivo_lotes)
+    ruas = gpd.read_file(upload_dir / "ruas" / "ruas_osm_detalhadas.gpkg")
+
+    if not lotes.crs:
+        lotes.set_crs(epsg=epsg_lotes, inplace=True)
+    if not ruas.crs:
+        ruas.set_crs(epsg=4326, inplace=True)
+    ruas = ruas.to_crs(lotes.crs)
+    ruas = ruas[ruas["name"].notna()]
+
+    if len(ruas):
+        ruas = ruas.dissolve(by="name", as_index=False, aggfunc="first")
+    return lotes, ruas
+
+
+def _poligono_principal(geoms):
+    """Um polígono por feição (a maior parte, se multipart); None se vazio."""
+    n = len(geoms)
+    partes, idx_parte = shapely.get_parts(np.asarray(geoms, dtype=object), return_index=True)
+    poligonos = np.full(n, None, dtype=object)
+    if len(partes):
+        ordem = np.lexsort((-shapely.area(partes), idx_parte))
+        primeira = ordem[np.r_[True, idx_parte[ordem][1:] != idx_parte[ordem][:-1]]]
+        poligonos[idx_parte[primeira]] = partes[primeira]
+    return poligonos
+
+
+# ==================== ADJACÊNCIA ====================
+ARQUIVO_ADJACENCIA = "adjacencia.npz"
+# Incrementar quando o formato do grafo mudar (invalida os grafos guardados)
+VERSAO_ADJACENCIA = 1
+
+
+def _entradas_adjacencia(upload_dir, arquivo_lotes):
+    return [upload_dir / "final" / arquivo_lotes, upload_dir / "ruas" / "ruas_osm_detalhadas.gpkg"]
+
+
+def _assinaturas(caminhos):
+    """Tamanho/mtime/inode de cada entrada: se não mudaram, o conteúdo também não."""
+    return np.array([assinatura_arquivo(c) for c in caminhos], dtype=np.int64)
+
+
+def _parametros_adjacencia(upload_dir, **kwargs) -> str:
+    """Parâmetros efetivos de construir_adjacencia (com os padrões), como texto comparável."""
+    args = inspect.signature(construir_adjacencia).bind(upload_dir, **kwargs)
+    args.apply_defaults()
+    campos = {k: v for k, v in args.arguments.items() if k not in ("upload_dir", "feedback")}
+    return json.dumps({"versao": VERSAO_ADJACENCIA, **campos}, sort_keys=True)
+
+
+def construir_adjacencia(
+        upload_dir,
+        arquivo_lotes="final_gpkg.gpkg",
+        epsg_lotes=31983,
+        buffer_rua=9,
+        tolerancia=0.1,
+        min_compartilhado=0.5,
+        min_testada=1.0,
+        feedback=None
+    ):
+    """
+    Grafo de vizinhança dos lotes, calculado uma vez por job e salvo ao lado
+    do GPKG final (final/adjacencia.npz) em formato CSR:
+      - nós 0..n_lotes-1: lotes, na ordem do GPKG
+      - nós n_lotes..: ruas com nome (dissolvidas por nome)
+      - indptr/indices: vizinhos de cada nó; comprimento: trecho compartilhado (m)
+    Lote × lote = divisa comum (>= min_compartilhado); lote × rua = testada
+    dentro da faixa de buffer_rua (>= min_testada). Uma única consulta em bulk no STRtree.
+    """
+    lotes, ruas = _lotes_e_ruas_nomeadas(upload_dir, arquivo_lotes, epsg_lotes)
+    avancar(feedback, 20)
+    n = len(lotes)
+    m = len(ruas)
+    total = n + m
+
+    poligonos = _poligono_principal(lotes.geometry.values)
+    contornos = shapely.boundary(poligonos)
+    ruas_geom = np.asarray(ruas.geometry.values, dtype=object) if m else np.empty(0, dtype=object)
+
+    # Faixa de cada nó: contorno do lote com tolerância / buffer da rua
+    faixas = np.concatenate([shapely.buffer(contornos, tolerancia), shapely.buffer(ruas_geom, buffer_rua)])
+    arvore = STRtree(np.concatenate([poligonos, shapely.buffer(ruas_geom, buffer_rua)]))
+
+    i, j = arvore.query(poligonos, predicate="dwithin", distance=tolerancia)
+    par = (i != j) & ((j >= n) | (i < j))
+    i, j = i[par], j[par]
+    avancar(feedback, 50)
+
+    comp = shapely.length(shapely.intersection(contornos[i], faixas[j]))
+    minimo = np.where(j >= n, min_testada, min_compartilhado)
+    ok = comp >= minimo
+    i, j, comp = i[ok], j[ok], comp[ok]
+
+    avancar(feedback, 85)
+    # CSR simétrico
+    origem = np.concatenate([i, j])
+    destino = np.concatenate([j, i])
+    peso = np.concatenate([comp, comp])
+    ordem = np.lexsort((destino, origem))
+    indptr = np.zeros(total + 1, dtype=np.int64)
+    np.cumsum(np.bincount(origem, minlength=total), out=indptr[1:])
+
+    quadras = lotes["quadra"].astype(str).to_numpy() if "quadra" in lotes.columns else np.full(n, "")
+    nums = lotes["lote_num"] if "lote_num" in lotes.columns else pd.Series(np.arange(1, n + 1))
+    nums = nums.map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)).to_numpy()
+
+    entradas = _entradas_adjacencia(upload_dir, arquivo_lotes)
+    out = upload_dir / "final" / ARQUIVO_ADJACENCIA
+    np.savez_compressed(
+        out,
+        assinaturas=_assinaturas(entradas),
+        somas=np.array([hash_arquivo(c) for c in entradas]),
+        parametros=np.array(_parametros_adjacencia(
+            upload_dir, arquivo_lotes=arquivo_lotes, epsg_lotes=epsg_lotes, buffer_rua=buffer_rua,
+            tolerancia=tolerancia, min_compartilhado=min_compartilhado, min_testada=min_testada
+        )),
+        indptr=indptr,
+        indices=destino[ordem].astype(np.int64),
+        comprimento=peso[ordem],
+        n_lotes=np.int64(n),
+        nomes_ruas=ruas["name"].to_numpy(dtype=str) if m else np.empty(0, dtype=str),
+        quadra=quadras.astype(str),
+        lote_num=nums.astype(str),
+    )
+    print(f"✅ Adjacência salva: {out.name} ({n} lotes, {m} ruas, {len(i)} contatos)")
+    return out
+
+
+def carregar_adjacencia(upload_dir) -> dict:
+    """Lê final/adjacencia.npz para um dicionário de arrays."""
+    with np.load(upload_dir / "final" / ARQUIVO_ADJACENCIA) as z:
+        return {k: z[k] for k in z.files}
+
+
+def obter_adjacencia(upload_dir, **kwargs) -> dict:
+    """
+    Carrega a adjacência do job, (re)construindo se não existir ou se as
+    entradas (lotes e ruas) ou os parâmetros mudaram. Como no pacote do QField,
+    tamanho/mtime/inode iguais dispensam a leitura; só as entradas em que eles
+    mudaram são relidas para conferir o sha256.
+    """
+    caminho = upload_dir / "final" / ARQUIVO_ADJACENCIA
+    if caminho.exists():
+        adj = carregar_adjacencia(upload_dir)
+        entradas = _entradas_adjacencia(upload_dir, kwargs.get("arquivo_lotes", "final_gpkg.gpkg"))
+        if "parametros" in adj and str(adj["parametros"]) == _parametros_adjacencia(upload_dir, **kwargs):
+            assinaturas = _assinaturas(entradas)
+            if np.array_equal(adj["assinaturas"], assinaturas):
+                return adj
+            mudaram = [k for k in range(len(entradas))
+                       if adj["assinaturas"].shape != assinaturas.shape
+                       or not np.array_equal(adj["assinaturas"][k], assinaturas[k])]
+            if len(adj["somas"]) == len(entradas) and all(
+                    adj["somas"][k] == hash_arquivo(entradas[k]) for k in mudaram):
+                # regravado com o mesmo conteúdo: só atualiza as assinaturas
+                adj["assinaturas"] = assinaturas
+                np.savez_compressed(caminho, **adj)
+                return adj
+    construir_adjacencia(upload_dir, **kwargs)
+    return carregar_adjacencia(upload_dir)
+
+
+def rotulos_nos(adj):
+    """Texto de cada nó: 'Lote X da Quadra Y' para lotes, o nome para ruas."""
+    lotes = np.char.add(np.char.add(np.char.add("Lote ", adj["lote_num"]), " da Quadra "), adj["quadra"])
+    return np.concatenate([lotes.astype(object), adj["nomes_ruas"].astype(object)])
+
+
+def calcular_medidas_azimutes(
+        upload_dir,
+        arquivo_entrada="final_gpkg.gpkg",
+        arquivo_saida="final_medidas_azimutes.gpkg",
+        epsg_lotes=31983,
+        buffer_rua=9,
+        dist_sonda=0.5,
+        tol_simplificacao=0.05,
+        feedback=None
+    ):
+    """
+    Calcula, para todos os lotes de uma vez, os campos usados nos memoriais:
+      - Comp_<Lado>: soma dos comprimentos das arestas daquele lado (m)
+      - Rumo_<Lado>: rumo da corda do lado (ex.: 45°30'15" NE)
+      - Conf_<Lado>: confrontante (lote vizinho ou rua)
+    Lados: Frente, Direita, Fundos, Esquerda, classificados pela normal externa
+    de cada aresta em relação à direção lote → rua mais próxima (a rua da frente).
+    Tudo em NumPy sobre o array de arestas e o grafo de adjacência do job
+    (construir_adjacencia); não há laço por lote.
+    Salva em final/final_medidas_azimutes.gpkg.
+    """
+    lotes, ruas_dis = _lotes_e_ruas_nomeadas(upload_dir, arquivo_entrada, epsg_lotes)
+    avancar(feedback, 15)
+
+    n = len(lotes)
+    out = upload_dir / "final" / arquivo_saida
+    for lado in LADOS_LOTE:
+        lotes[f"Comp_{lado}"] = None
+        lotes[f"Rumo_{lado}"] = None
+        lotes[f"Conf_{lado}"] = None
+
+    if n == 0 or len(ruas_dis) == 0:
+        print("⚠ Sem lotes ou sem ruas com nome: medidas e rumos não calculados.")
+        lotes.to_file(out, driver="GPKG", encoding="utf-8")
+        return out
+
+    ruas_geom = np.asarray(ruas_dis.geometry.values, dtype=object)
+    ruas_nome = ruas_dis["name"].to_numpy(dtype=object)
+
+    adj = obter_adjacencia(upload_dir, arquivo_lotes=arquivo_entrada,
+                           epsg_lotes=epsg_lotes, buffer_rua=buffer_rua)
+    indptr, indices, compartilhado = adj["indptr"], adj["indices"], adj["comprimento"]
+
+    # 1) Um polígono por lote (maior parte, se multipart)
+    poligonos = _poligono_principal(lotes.geometry.values)
+
+    # 2) Anel externo simplificado (junta vértices colineares) e no sentido horário
+    aneis = shapely.simplify(shapely.get_exterior_ring(poligonos), tol_simplificacao)
+    aneis = np.where(shapely.is_ccw(aneis), shapely.reverse(aneis), aneis)
+
+    # 3) Arestas explodidas: (p0, p1, lote)
+    coords, idx_anel = shapely.get_coordinates(aneis, return_index=True)
+    mesmo = idx_anel[1:] == idx_anel[:-1]
+    p0 = coords[:-1][mesmo]
+    p1 = coords[1:][mesmo]
+    lote_e = idx_anel[:-1][mesmo]
+
+    vet = p1 - p0
+    comp = np.hypot(vet[:, 0], vet[:, 1])
+    ok = comp > 1e-9
+    p0, p1, lote_e, vet, comp = p0[ok], p1[ok], lote_e[ok], vet[ok], comp[ok]
+    # anel horário → interior à direita → normal externa à esquerda
+    normal = np.column_stack([-vet[:, 1], vet[:, 0]]) / comp[:, None]
+    meio = (p0 + p1) / 2.0
+
+    avancar(feedback, 35)
+    # 4) Rua da frente: a de maior testada no grafo; sem testada, a mais próxima
+    centroides = shapely.centroid(poligonos)
+    rua_lote = np.full(n, -1)
+
+    no_origem = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    e_testada = (no_origem < n) & (indices >= n)
+    if e_testada.any():
+        o, r, c = no_origem[e_testada], indices[e_testada] - n, compartilhado[e_testada]
+        ordem = np.lexsort((-c, o))
+        primeiro, pos = np.unique(o[ordem], return_index=True)
+        rua_lote[primeiro] = r[ordem][pos]
+
+    sem_rua = np.flatnonzero((rua_lote < 0) & ~shapely.is_missing(poligonos))
+    if len(sem_rua):
+        i_lote, i_rua = STRtree(ruas_geom).query_nearest(centroides[sem_rua], all_matches=False)
+        rua_lote[sem_rua[i_lote]] = i_rua
+
+    i_lote = np.flatnonzero(rua_lote >= 0)
+    i_rua = rua_lote[i_lote]
+    frente = np.full((n, 2), np.nan)
+    alvo = shapely.get_point(shapely.shortest_line(centroides[i_lote], ruas_geom[i_rua]), 1)
+    frente[i_lote] = shapely.get_coordinates(alvo) - shapely.get_coordinates(centroides[i_lote])
+    norma = np.hypot(frente[:, 0], frente[:, 1])
+    frente /= np.where(norma > 0, norma, np.nan)[:, None]
+
+    # 5) Classificação das arestas pelo ângulo normal × frente (0=F, 1=D, 2=Fu, 3=E)
+    f = frente[lote_e]
+    direita = np.column_stack([f[:, 1], -f[:, 0]])  # à direita de quem olha para a rua
+    ang = np.degrees(np.arctan2((normal * direita).sum(1), (normal * f).sum(1)))
+    lado_e = np.select(
+        [np.abs(ang) <= 45, (ang > 45) & (ang <= 135), (ang < -45) & (ang >= -135)],
+        [0, 1, 3],
+        default=2
+    )
+    tem_frente = ~np.isnan(ang)
+    lote_e, lado_e, vet, comp, normal, meio = (
+        a[tem_frente] for a in (lote_e, lado_e, vet, comp, normal, meio)
+    )
+
+    # 6) Comprimento e corda (para o rumo) de cada lado
+    chave = lote_e * 4 + lado_e
+    comp_lado = np.bincount(chave, weights=comp, minlength=4 * n).reshape(n, 4)
+    dx_lado = np.bincount(chave, weights=vet[:, 0], minlength=4 * n).reshape(n, 4)
+    dy_lado = np.bincount(chave, weights=vet[:, 1], minlength=4 * n).reshape(n, 4)
+    rumos = np.array(_formatar_rumos(dx_lado.ravel(), dy_lado.ravel()), dtype=object).reshape(n, 4)
+
+    avancar(feedback, 55)
+    # 7) Confrontantes: ponto-sonda logo fora de cada aresta, testado só
+    #    contra os vizinhos do lote no grafo de adjacência
+    sondas = shapely.points(meio + normal * dist_sonda)
+    ini = indptr[lote_e]
+    qtd = indptr[lote_e + 1] - ini
+    aresta_rep = np.repeat(np.arange(len(sondas)), qtd)
+    desloc = np.arange(qtd.sum()) - np.repeat(np.cumsum(qtd) - qtd, qtd)
+    cand = indices[np.repeat(ini, qtd) + desloc]
+
+    geom_no = np.concatenate([poligonos, shapely.buffer(ruas_geom, buffer_rua)])
+    toca = shapely.intersects(sondas[aresta_rep], geom_no[cand])
+    aresta_rep, cand = aresta_rep[toca], cand[toca]
+
+    # lote vizinho tem prioridade; entre ruas, a mais próxima da sonda
+    e_rua = cand >= n
+    prioridade = np.zeros(len(cand))
+    prioridade[e_rua] = 1.0 + shapely.distance(sondas[aresta_rep[e_rua]], ruas_geom[cand[e_rua] - n])
+    ordem = np.lexsort((prioridade, aresta_rep))
+    primeiro, pos = np.unique(aresta_rep[ordem], return_index=True)
+    escolhido = np.full(len(sondas), -1)
+    escolhido[primeiro] = cand[ordem][pos]
+
+    conf = np.full(len(sondas), "área não identificada", dtype=object)
+    conf[escolhido >= 0] = rotulos_nos(adj)[escolhido[escolhido >= 0]]
+
+    # confrontantes distintos por lado, na ordem do perímetro
+    df_conf = pd.DataFrame({"lote": lote_e, "lado": lado_e, "conf": conf})
+    df_conf = df_conf.drop_duplicates()
+    conf_lado = df_conf.groupby(["lote", "lado"], sort=False)["conf"].agg(" e ".join)
+
+    avancar(feedback, 80)
+    # 8) Colunas finais
+    conf_mat = np.full((n, 4), None, dtype=object)
+    idx = conf_lado.index.to_frame().to_numpy()
+    conf_mat[idx[:, 0], idx[:, 1]] = conf_lado.to_numpy()
+    # frente confronta com a rua atribuída ao lote
+    tem_rua = rua_lote >= 0
+    conf_mat[tem_rua, 0] = ruas_nome[rua_lote[tem_rua]]
+
+    presente = comp_lado > 0
+    for j, lado in enumerate(LADOS_LOTE):
+        p = presente[:, j]
+        lotes[f"Comp_{lado}"] = np.where(p, np.round(comp_lado[:, j], 2), np.nan)
+        lotes[f"Rumo_{lado}"] = np.where(p, rumos[:, j], None)
+        lotes[f"Conf_{lado}"] = np.where(p, conf_mat[:, j], None)
+
+    lotes.to_file(out, driver="GPKG", encoding="utf-8")
+    print(f"✅ {arquivo_saida} gerado com medidas, rumos e confrontantes. Lotes: {n}")
+    return out
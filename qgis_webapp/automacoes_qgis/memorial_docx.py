@@ -0,0 +1,441 @@
+"""
+Motor de renderização dos memoriais descritivos (.docx).
+
+O cabeçalho e o rodapé são montados uma única vez com python-docx e guardados
+como template (partes XML já comprimidas). Cada memorial só gera o XML dos
+parágrafos dos lotes, a partir de uma tabela em colunas pré-calculada, e grava
+o pacote .docx direto, reaproveitando as demais partes do template.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from multiprocessing import get_context
+import os
+from pathlib import Path
+from xml.sax.saxutils import escape
+import zipfile
+
+import geopandas as gpd
+import pandas as pd
+from docx import Document
+from docx.shared import Pt
+
+from .docx_utils import _add_cabecalho_memorial, _fmt_num_br, _fmt_coord
+from .zip_stream import ZipStream, ParteZip
+
+RODAPE_MEMORIAL = (
+    "Todas as medidas lineares, áreas e rumos foram calculados no sistema de projeção "
+    "e datum adotados no projeto (ex.: SIRGAS2000 / UTM)."
+)
+
+CAMPOS_LADOS = [
+    "Conf_Frente", "Comp_Frente", "Rumo_Frente",
+    "Conf_Direita", "Comp_Direita", "Rumo_Direita",
+    "Conf_Fundos", "Comp_Fundos", "Rumo_Fundos",
+    "Conf_Esquerda", "Comp_Esquerda", "Rumo_Esquerda",
+]
+
+_PARTE_DOCUMENTO = "word/document.xml"
+_MARCA_QUADRA = "⟦QUADRA⟧"
+_MARCA_CORPO = "⟦CORPO⟧"
+_RECUO_DESCRICAO = Pt(12).twips
+_PARAGRAFO_VAZIO = "<w:p/>"
+
+
+# ==================== TABELA EM COLUNAS ====================
+def _coluna(serie):
+    """Série → lista Python, com NaN/None do pandas virando None."""
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+
+def tabela_memorial(gdf) -> dict:
+    """Pré-calcula, em colunas, todos os valores usados no texto dos memoriais."""
+    n = len(gdf)
+    geom = gdf.geometry
+    tem_geom = geom.notna() & ~geom.is_empty
+    centroides = geom.centroid
+
+    tabela = {
+        "quadra": _coluna(gdf["quadra"]),
+        "lote_num": _coluna(gdf["lote_num"]) if "lote_num" in gdf.columns else [None] * n,
+        "area": _coluna(geom.area.where(tem_geom)),
+        "perimetro": _coluna(geom.length.where(tem_geom)),
+        "x": _coluna(centroides.x.where(tem_geom)),
+        "y": _coluna(centroides.y.where(tem_geom)),
+    }
+    for campo in CAMPOS_LADOS:
+        tabela[campo] = _coluna(gdf[campo]) if campo in gdf.columns else [None] * n
+    return tabela
+
+
+def registros(tabela: dict):
+    """Percorre a tabela em colunas devolvendo um dicionário por lote."""
+    chaves = list(tabela)
+    for valores in zip(*tabela.values()):
+        yield dict(zip(chaves, valores))
+
+
+def registro_de_linha(row) -> dict:
+    """Mesmo formato de `registros`, para uma única linha (iterrows)."""
+    def limpo(v):
+        return None if v is None or pd.isna(v) else v
+
+    geom = row.geometry
+    tem_geom = geom is not None and not geom.is_empty
+    reg = {
+        "quadra": limpo(row.get("quadra")),
+        "lote_num": limpo(row.get("lote_num")),
+        "area": geom.area if tem_geom else None,
+        "perimetro": geom.length if tem_geom else None,
+        "x": geom.centroid.x if tem_geom else None,
+        "y": geom.centroid.y if tem_geom else None,
+    }
+    for campo in CAMPOS_LADOS:
+        reg[campo] = limpo(row.get(campo))
+    return reg
+
+
+# ==================== TEXTO ====================
+def texto_memorial_lote(reg: dict, nucleo: str, municipio: str, uf: str, individual: bool = False) -> str:
+    """
+    Narrativa do perímetro de um lote (frente, direita, fundos, esquerda).
+    `individual=True` gera a versão do memorial avulso do lote, com o ponto de referência.
+    """
+    lote_num = reg["lote_num"]
+    quadra = reg["quadra"]
+    area_m2 = reg["area"]
+    perimetro_m = reg["perimetro"]
+
+    texto = []
+
+    intro = (
+        f"O lote de terreno sob nº {lote_num} da Quadra {quadra}, "
+        f"do Núcleo denominado “{nucleo}”, no município de {municipio} - {uf}, "
+        f"apresenta área de {_fmt_num_br(area_m2, 2)} m²"
+    )
+    if perimetro_m is not None:
+        intro += f" e um perímetro de {_fmt_num_br(perimetro_m, 2)} m."
+    else:
+        intro += "."
+    texto.append(intro)
+
+    if individual and reg["x"] is not None and reg["y"] is not None:
+        texto.append(
+            f"Para fins de localização, toma-se como referência um ponto interno do lote, "
+            f"com coordenadas aproximadas E = {_fmt_coord(reg['x'])} m e N = {_fmt_coord(reg['y'])} m, "
+            f"no sistema de referência do projeto."
+        )
+
+    rua_frente = reg["Conf_Frente"]
+    if rua_frente and reg["Comp_Frente"] and reg["Rumo_Frente"]:
+        texto.append(
+            f"Para quem de dentro do lote {lote_num} olha para {rua_frente}, "
+            f"inicia-se a descrição pela frente, com rumo {reg['Rumo_Frente']} "
+            f"e distância de {_fmt_num_br(reg['Comp_Frente'], 2)} m, "
+            f"confrontando com {rua_frente}."
+        )
+
+    if reg["Comp_Direita"] and reg["Rumo_Direita"] and reg["Conf_Direita"]:
+        texto.append(
+            f"Deste ponto, deflete à direita, seguindo com rumo {reg['Rumo_Direita']} "
+            f"e distância de {_fmt_num_br(reg['Comp_Direita'], 2)} m, "
+            f"confrontando com {reg['Conf_Direita']}."
+        )
+
+    if reg["Comp_Fundos"] and reg["Rumo_Fundos"] and reg["Conf_Fundos"]:
+        deflexao = "deflete novamente" if individual else "deflete"
+        texto.append(
+            f"Em seguida, {deflexao}, seguindo pelos fundos com rumo {reg['Rumo_Fundos']} "
+            f"e distância de {_fmt_num_br(reg['Comp_Fundos'], 2)} m, "
+            f"confrontando com {reg['Conf_Fundos']}."
+        )
+
+    if reg["Comp_Esquerda"] and reg["Rumo_Esquerda"] and reg["Conf_Esquerda"]:
+        retorno = (
+            "retornando ao ponto inicial da descrição do perímetro do lote."
+            if individual else "retornando ao ponto inicial."
+        )
+        texto.append(
+            f"Por fim, deflete à esquerda, seguindo com rumo {reg['Rumo_Esquerda']} "
+            f"e distância de {_fmt_num_br(reg['Comp_Esquerda'], 2)} m, "
+            f"confrontando com {reg['Conf_Esquerda']}, {retorno}"
+        )
+
+    return " ".join(texto)
+
+
+# ==================== XML (WordprocessingML) ====================
+def _run_xml(texto: str, negrito: bool = False) -> str:
+    # Mesmo resultado do python-docx: "\n" vira <w:br/>
+    partes = []
+    for i, trecho in enumerate(texto.split("\n")):
+        if i:
+            partes.append("<w:br/>")
+        if trecho:
+            partes.append(f'<w:t xml:space="preserve">{escape(trecho)}</w:t>')
+    rpr = "<w:rPr><w:b/></w:rPr>" if negrito else ""
+    return f"<w:r>{rpr}{''.join(partes)}</w:r>"
+
+
+def _paragrafo_xml(*runs: str, recuo=None) -> str:
+    ppr = f'<w:pPr><w:ind w:firstLine="{recuo}"/></w:pPr>' if recuo else ""
+    return f"<w:p>{ppr}{''.join(runs)}</w:p>"
+
+
+def _runs_medidas(reg: dict) -> list:
+    runs = []
+    if reg["area"] is not None:
+        runs.append(_run_xml(f"Área: {_fmt_num_br(reg['area'], 2)} m²\n"))
+    if reg["perimetro"] is not None:
+        runs.append(_run_xml(f"Perímetro: {_fmt_num_br(reg['perimetro'], 2)} m\n"))
+    return runs
+
+
+def corpo_memorial_lote(reg: dict, nucleo: str, municipio: str, uf: str) -> str:
+    """Parágrafos do memorial avulso de um lote."""
+    info = [
+        _run_xml(f"Quadra: {reg['quadra']}\n"),
+        _run_xml(f"Lote: {reg['lote_num']}\n"),
+        *_runs_medidas(reg),
+    ]
+    texto = texto_memorial_lote(reg, nucleo, municipio, uf, individual=True)
+    return (
+        _paragrafo_xml(*info)
+        + _PARAGRAFO_VAZIO
+        + _paragrafo_xml(_run_xml(texto), recuo=_RECUO_DESCRICAO)
+    )
+
+
+def corpo_memorial_quadra(regs, nucleo: str, municipio: str, uf: str) -> str:
+    """Parágrafos de todos os lotes de uma quadra, na ordem recebida."""
+    blocos = []
+    for reg in regs:
+        texto = texto_memorial_lote(reg, nucleo, municipio, uf)
+        blocos.append(
+            _paragrafo_xml(_run_xml(f"Quadra: {reg['quadra']} - Lote: {reg['lote_num']}", negrito=True))
+            + _paragrafo_xml(*_runs_medidas(reg))
+            + _PARAGRAFO_VAZIO
+            + _paragrafo_xml(_run_xml(texto), recuo=_RECUO_DESCRICAO)
+            + _PARAGRAFO_VAZIO  # espaço entre lotes
+        )
+    return "".join(blocos)
+
+
+# ==================== TEMPLATE ====================
+def _docx_cabecalho(quadra, nucleo, municipio, uf, promotor, titulo) -> BytesIO:
+    """.docx com o cabeçalho, a marca do corpo e o rodapé, montado com python-docx."""
+    doc = Document()
+    _add_cabecalho_memorial(
+        doc,
+        titulo=titulo,
+        quadra=quadra,
+        nucleo=nucleo,
+        municipio=municipio,
+        uf=uf,
+        promotor=promotor
+    )
+    doc.add_paragraph(_MARCA_CORPO)
+    doc.add_paragraph()
+    doc.add_paragraph().add_run(RODAPE_MEMORIAL)
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer
+
+
+def _separar_corpo(xml: str) -> tuple[str, str]:
+    """(antes, depois) do parágrafo da marca do corpo no document.xml."""
+    marca = xml.index(_MARCA_CORPO)
+    inicio = max(xml.rfind("<w:p>", 0, marca), xml.rfind("<w:p ", 0, marca))
+    fim = xml.index("</w:p>", marca) + len("</w:p>")
+    return xml[:inicio], xml[fim:]
+
+
+class MemorialTemplate:
+    """
+    Cabeçalho/rodapé pré-compilados; só o corpo do document.xml muda por memorial.
+    Sem quadra (None), o cabeçalho sai sem a linha "QUADRA … - NÚCLEO …", como no python-docx.
+    """
+
+    def __init__(self, nucleo, municipio, uf, promotor="Instituto Cidade Legal", titulo="MEMORIAL DESCRITIVO"):
+        # Todas as partes, menos o document.xml, são comprimidas uma única vez
+        self._partes = []
+        xml = ""
+        with zipfile.ZipFile(_docx_cabecalho(_MARCA_QUADRA, nucleo, municipio, uf, promotor, titulo)) as zf:
+            for info in zf.infolist():
+                dados = zf.read(info.filename)
+                if info.filename == _PARTE_DOCUMENTO:
+                    xml = dados.decode("utf-8")
+                    self._partes.append(None)
+                else:
+                    self._partes.append(ParteZip.comprimir(info.filename, dados))
+        self._prefixo, self._sufixo = _separar_corpo(xml)
+
+        with zipfile.ZipFile(_docx_cabecalho(None, nucleo, municipio, uf, promotor, titulo)) as zf:
+            self._prefixo_sem_quadra, _ = _separar_corpo(zf.read(_PARTE_DOCUMENTO).decode("utf-8"))
+
+    def documento_xml(self, quadra, corpo_xml: str) -> bytes:
+        if quadra is None:
+            prefixo = self._prefixo_sem_quadra
+        else:
+            prefixo = self._prefixo.replace(_MARCA_QUADRA, escape(str(quadra)))
+        return (prefixo + corpo_xml + self._sufixo).encode("utf-8")
+
+    def pacote(self, quadra, corpo_xml: str):
+        """Gera os bytes do .docx aos poucos (entrada por entrada)."""
+        zs = ZipStream()
+        documento = self.documento_xml(quadra, corpo_xml)
+        for parte in self._partes:
+            if parte is None:
+                yield zs.adicionar_bytes(_PARTE_DOCUMENTO, documento)
+            else:
+                yield zs.adicionar_parte(parte)
+        yield zs.finalizar()
+
+    def renderizar(self, quadra, corpo_xml: str) -> bytes:
+        return b"".join(self.pacote(quadra, corpo_xml))
+
+    def salvar(self, docx_path: Path, quadra, corpo_xml: str) -> Path:
+        docx_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(docx_path, "wb") as f:
+            f.writelines(self.pacote(quadra, corpo_xml))
+        return docx_path
+
+
+@lru_cache(maxsize=32)
+def obter_template(nucleo, municipio, uf, promotor="Instituto Cidade Legal",
+                   titulo="MEMORIAL DESCRITIVO") -> MemorialTemplate:
+    """Template compartilhado por processo para o mesmo núcleo/município."""
+    return MemorialTemplate(nucleo, municipio, uf, promotor, titulo)
+
+
+# ==================== MEMORIAIS ====================
+def _nome_lote(lote_num):
+    if isinstance(lote_num, float) and lote_num.is_integer():
+        return str(int(lote_num))
+    return str(lote_num)
+
+
+def renderizar_memorial_lote(row,
+                             docx_path: Path,
+                             nucleo: str,
+                             municipio: str,
+                             uf: str = "MG",
+                             promotor: str = "Instituto Cidade Legal") -> Path:
+    reg = registro_de_linha(row)
+    template = obter_template(nucleo, municipio, uf, promotor)
+    return template.salvar(docx_path, reg["quadra"], corpo_memorial_lote(reg, nucleo, municipio, uf))
+
+
+def renderizar_memorial_quadra(lotes_quadra,
+                               quadra_str: str,
+                               docx_path: Path,
+                               nucleo: str,
+                               municipio: str,
+                               uf: str,
+                               promotor: str = "Instituto Cidade Legal") -> Path:
+    """
+    Monta e salva o memorial de uma quadra a partir dos lotes já filtrados.
+    Não lê nada do disco, então pode rodar em processos separados.
+    """
+    lotes_quadra = lotes_quadra.sort_values(by="lote_num")
+    template = obter_template(nucleo, municipio, uf, promotor)
+    corpo = corpo_memorial_quadra(registros(tabela_memorial(lotes_quadra)), nucleo, municipio, uf)
+    template.salvar(docx_path, quadra_str, corpo)
+    print(f"✅ Memorial da quadra {quadra_str} salvo em: {docx_path}")
+    return docx_path
+
+
+def renderizar_memoriais_quadras(gdf,
+                                 saida_dir: Path,
+                                 nucleo: str,
+                                 municipio: str,
+                                 uf: str,
+                                 promotor: str = "Instituto Cidade Legal",
+                                 max_workers: int | None = None) -> list:
+    """
+    Grava um memorial .docx por quadra em `saida_dir`, cada quadra num
+    processo. O pool usa spawn: o worker que chama isto roda o QGIS, e um
+    fork copiaria as threads e o estado do Qt para os filhos.
+    """
+    saida_dir.mkdir(parents=True, exist_ok=True)
+    grupos = {q: lotes for q, lotes in gdf.groupby(gdf["quadra"].astype(str), sort=False)}
+    quadras = sorted(grupos)
+
+    if max_workers is None:
+        max_workers = min(len(quadras), os.cpu_count() or 1) or 1
+
+    tarefas = [
+        (grupos[q], q, saida_dir / f"memorial_quadra_{q}.docx", nucleo, municipio, uf, promotor)
+        for q in quadras
+    ]
+    if max_workers <= 1:
+        return [renderizar_memorial_quadra(*t) for t in tarefas]
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as pool:
+        futuros = [pool.submit(renderizar_memorial_quadra, *t) for t in tarefas]
+        return [f.result() for f in futuros]
+
+
+def iterar_memoriais_lotes(gdf, nucleo: str, municipio: str, uf: str,
+                           promotor: str = "Instituto Cidade Legal"):
+    """
+    Gera (nome_arquivo, chunks) para o memorial de cada lote, sem tocar no disco.
+    A tabela e o template são calculados uma vez para todo o lote de documentos.
+    """
+    template = obter_template(nucleo, municipio, uf, promotor)
+    ordenado = gdf.sort_values(by=["quadra", "lote_num"], key=lambda s: s.astype(str) if s.name == "quadra" else s)
+    for reg in registros(tabela_memorial(ordenado)):
+        nome = f"memorial_quadra_{reg['quadra']}_lote_{_nome_lote(reg['lote_num'])}.docx"
+        corpo = corpo_memorial_lote(reg, nucleo, municipio, uf)
+        yield nome, template.pacote(reg["quadra"], corpo)
+
+
+def iterar_memoriais_quadras(gdf, nucleo: str, municipio: str, uf: str,
+                             promotor: str = "Instituto Cidade Legal"):
+    """Gera (nome_arquivo, chunks) para o memorial de cada quadra, sem tocar no disco."""
+    template = obter_template(nucleo, municipio, uf, promotor)
+    grupos = gdf.groupby(gdf["quadra"].astype(str), sort=True)
+    for quadra_str, lotes in grupos:
+        lotes = lotes.sort_values(by="lote_num")
+        corpo = corpo_memorial_quadra(registros(tabela_memorial(lotes)), nucleo, municipio, uf)
+        yield f"memorial_quadra_{quadra_str}.docx", template.pacote(quadra_str, corpo)
+
+
+def carregar_lotes_memorial(upload_dir: Path, quadras=None, arquivo_final_nome: str | None = None):
+    """
+    Lê o GPKG final do núcleo (de preferência o que já tem medidas e rumos)
+    e, se informado, mantém só os lotes das quadras pedidas.
+    """
+    final_dir = upload_dir / "final"
+    if arquivo_final_nome is None:
+        candidatos = ["final_medidas_azimutes.gpkg", "final_gpkg.gpkg"]
+        arquivo_final_nome = next((n for n in candidatos if (final_dir / n).exists()), None)
+        if arquivo_final_nome is None:
+            raise FileNotFoundError(f"Nenhum GPKG final encontrado em {final_dir}")
+
+    gdf = gpd.read_file(final_dir / arquivo_final_nome)
+    if "quadra" not in gdf.columns:
+        raise ValueError("Coluna 'quadra' não encontrada no GPKG final.")
+
+    if quadras:
+        gdf = gdf[gdf["quadra"].astype(str).isin([str(q) for q in quadras])]
+    return gdf
+
+
+def renderizar_memoriais_lotes(gdf,
+                               saida_dir: Path,
+                               nucleo: str,
+                               municipio: str,
+                               uf: str,
+                               promotor: str = "Instituto Cidade Legal") -> list:
+    """Grava um memorial .docx por lote em `saida_dir`."""
+    saida_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for nome, chunks in iterar_memoriais_lotes(gdf, nucleo, municipio, uf, promotor):
+        docx_path = saida_dir / nome
+        with open(docx_path, "wb") as f:
+            f.writelines(chunks)
+        paths.append(docx_path)
+    print(f"✅ {len(paths)} memoriais de lote salvos em: {saida_dir}")
+    return paths
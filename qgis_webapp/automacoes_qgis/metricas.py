@@ -0,0 +1,311 @@
+"""
+Métricas por etapa dos jobs.
+
+O worker mede cada etapa (MedidorEtapas) e grava o manifesto run_metrics.json
+no upload do job; ao terminar, as medições da execução vão para Job.metricas.
+A view /metrics agrega os jobs concluídos nas últimas QGIS_METRICAS_JANELA_HORAS
+no formato texto do Prometheus. Como os jobs antigos saem da janela, os
+valores podem cair: tudo é exposto como gauge (nada de counter/histogram).
+"""
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+ARQUIVO_METRICAS = "run_metrics.json"
+
+# limites (s) das faixas de duração (qgis_*_execucoes_ate)
+BUCKETS_SEGUNDOS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def _bytes_no_diretorio(pasta: Path) -> int:
+    total = 0
+    pilha = [pasta]
+    while pilha:
+        try:
+            with os.scandir(pilha.pop()) as itens:
+                for item in itens:
+                    if item.is_dir(follow_symlinks=False):
+                        pilha.append(item.path)
+                    elif item.is_file(follow_symlinks=False):
+                        total += item.stat().st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def _memoria_mb() -> dict:
+    """VmRSS (atual) e VmHWM (pico desde o último zerar) do processo, em MB; {} fora do Linux."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            linhas = [l.split() for l in f if l.startswith(("VmRSS:", "VmHWM:"))]
+    except OSError:
+        return {}
+    # os valores vêm em kB
+    return {l[0].rstrip(":"): int(l[1]) / 1024 for l in linhas}
+
+
+def _zerar_pico_rss() -> bool:
+    """Zera o VmHWM (pico de RSS) do processo para medir só a etapa seguinte."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _contagem(valor):
+    """Aceita um número ou uma camada (featureCount)."""
+    if valor is None or isinstance(valor, int):
+        return valor
+    return int(valor.featureCount())
+
+
+class MedidorEtapas:
+    """
+    Mede tempo de parede, CPU, memória (pico de RSS da etapa, variação do
+    RSS e, opcionalmente, pico do tracemalloc),
+    feições de entrada/saída e bytes gravados de cada etapa de um job.
+    O manifesto é regravado ao fim de cada etapa, então um job travado ou
+    morto pelo supervisor ainda deixa as etapas já concluídas.
+    """
+
+    def __init__(self, upload_dir: Path, job_id=None, usar_tracemalloc=False):
+        self.upload_dir = Path(upload_dir)
+        self.job_id = str(job_id) if job_id is not None else "local"
+        self.usar_tracemalloc = usar_tracemalloc
+        self.execucao = {"etapas": {}, "caches": {}}
+        self._iniciou_tracemalloc = False
+        self._atual = None
+        self._inicio_job = time.perf_counter()
+        self._cpu_job = time.process_time()
+
+    def iniciar(self, etapa, nome: str):
+        """Fecha a etapa em andamento e começa a medir a próxima."""
+        self._fechar()
+        if self.usar_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._iniciou_tracemalloc = True
+            tracemalloc.reset_peak()
+        self._atual = {
+            "etapa": str(etapa),
+            "nome": nome,
+            "inicio": time.perf_counter(),
+            "cpu": time.process_time(),
+            "bytes": _bytes_no_diretorio(self.upload_dir),
+            "rss": _memoria_mb().get("VmRSS"),
+            "pico_zerado": _zerar_pico_rss(),
+            "dados": {"entrada": None, "saida": None, "subetapas": {}},
+        }
+
+    def contar(self, entrada=None, saida=None):
+        """Feições de entrada/saída da etapa atual (números ou camadas)."""
+        if self._atual is None:
+            return
+        if entrada is not None:
+            self._atual["dados"]["entrada"] = _contagem(entrada)
+        if saida is not None:
+            self._atual["dados"]["saida"] = _contagem(saida)
+
+    def registrar_subetapa(self, nome: str, segundos: float):
+        if self._atual is not None:
+            self._atual["dados"]["subetapas"][nome] = round(segundos, 3)
+
+    def registrar_cache(self, nome: str, acerto: bool):
+        c = self.execucao["caches"].setdefault(nome, {"acertos": 0, "faltas": 0})
+        c["acertos" if acerto else "faltas"] += 1
+
+    def encerrar(self, status: str):
+        """Fecha a última etapa e grava o manifesto com o status final do job."""
+        self._fechar()
+        self.execucao["status"] = status
+        self.execucao["total"] = {
+            "wall_s": round(time.perf_counter() - self._inicio_job, 3),
+            "cpu_s": round(time.process_time() - self._cpu_job, 3),
+        }
+        picos = [d["pico_rss_mb"] for d in self.execucao["etapas"].values() if "pico_rss_mb" in d]
+        if picos:
+            self.execucao["total"]["pico_rss_mb"] = max(picos)
+        self._salvar()
+        if self._iniciou_tracemalloc:
+            tracemalloc.stop()
+            self._iniciou_tracemalloc = False
+
+    def _fechar(self):
+        atual, self._atual = self._atual, None
+        if atual is None:
+            return
+        dados = atual["dados"]
+        dados.update(
+            nome=atual["nome"],
+            wall_s=round(time.perf_counter() - atual["inicio"], 3),
+            cpu_s=round(time.process_time() - atual["cpu"], 3),
+            bytes_escritos=max(0, _bytes_no_diretorio(self.upload_dir) - atual["bytes"]),
+        )
+        memoria = _memoria_mb()
+        if atual["pico_zerado"] and "VmHWM" in memoria:
+            dados["pico_rss_mb"] = round(memoria["VmHWM"], 1)
+        if atual["rss"] is not None and "VmRSS" in memoria:
+            dados["rss_delta_mb"] = round(memoria["VmRSS"] - atual["rss"], 1)
+        if self.usar_tracemalloc and tracemalloc.is_tracing():
+            dados["pico_tracemalloc_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        self.execucao["etapas"][atual["etapa"]] = dados
+        self._salvar()
+
+    def _salvar(self):
+        """
+        run_metrics.json guarda cada execução em "jobs" (um retry do Overpass
+        é outro job no mesmo upload) e, em "etapas", a visão consolidada.
+        """
+        if not self.upload_dir.is_dir():
+            return
+        manifesto = carregar_manifesto(self.upload_dir) or {}
+        execucoes = manifesto.get("jobs", {})
+        execucoes[self.job_id] = self.execucao
+        etapas = {}
+        for execucao in execucoes.values():
+            etapas.update(execucao.get("etapas", {}))
+        destino = self.upload_dir / ARQUIVO_METRICAS
+        tmp = destino.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"etapas": etapas, "jobs": execucoes}, ensure_ascii=False, indent=2),
+                       encoding="utf-8")
+        os.replace(tmp, destino)
+
+
+@contextmanager
+def subetapa(medidor, nome: str):
+    """Cronometra um trecho dentro da etapa atual (no-op sem medidor)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if medidor is not None:
+            medidor.registrar_subetapa(nome, time.perf_counter() - inicio)
+
+
+def registrar_cache(medidor, nome: str, acerto: bool):
+    if medidor is not None:
+        medidor.registrar_cache(nome, acerto)
+
+
+def carregar_manifesto(upload_dir: Path) -> dict | None:
+    try:
+        return json.loads((Path(upload_dir) / ARQUIVO_METRICAS).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def metricas_do_job(upload_dir: Path, job_id) -> dict:
+    """Medições de uma execução (o que vai para Job.metricas)."""
+    return ((carregar_manifesto(upload_dir) or {}).get("jobs") or {}).get(str(job_id), {})
+
+
+# ==================== PROMETHEUS ====================
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(**rotulos) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in rotulos.items()) + "}"
+
+
+class _Distribuicao:
+    """Durações observadas na janela, por rótulos: quantas, quantas até cada limite e a soma."""
+
+    def __init__(self):
+        self.series = {}
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        s = self.series.setdefault(chave, {"buckets": [0] * len(BUCKETS_SEGUNDOS), "soma": 0.0, "n": 0})
+        for i, limite in enumerate(BUCKETS_SEGUNDOS):
+            if valor <= limite:
+                s["buckets"][i] += 1
+        s["soma"] += valor
+        s["n"] += 1
+
+    def linhas(self, prefixo, descricao):
+        series = sorted(self.series.items())
+        yield f"# HELP {prefixo}_execucoes {descricao} na janela."
+        yield f"# TYPE {prefixo}_execucoes gauge"
+        for chave, s in series:
+            yield f"{prefixo}_execucoes{_rotulos(**dict(chave))} {s['n']}"
+        yield f"# HELP {prefixo}_execucoes_ate {descricao} na janela com duração até le segundos."
+        yield f"# TYPE {prefixo}_execucoes_ate gauge"
+        for chave, s in series:
+            for limite, qtd in zip(BUCKETS_SEGUNDOS, s["buckets"]):
+                yield f"{prefixo}_execucoes_ate{_rotulos(**dict(chave), le=limite)} {qtd}"
+        yield f"# HELP {prefixo}_duracao_segundos_soma Soma do tempo de parede ({descricao.lower()}) na janela."
+        yield f"# TYPE {prefixo}_duracao_segundos_soma gauge"
+        for chave, s in series:
+            yield f"{prefixo}_duracao_segundos_soma{_rotulos(**dict(chave))} {s['soma']:.3f}"
+
+
+def exposicao_prometheus(manifestos, fila: dict) -> str:
+    """
+    Texto no formato de exposição do Prometheus a partir dos manifestos dos
+    jobs (Job.metricas) e da contagem de jobs por status.
+    """
+    duracao_etapa = _Distribuicao()
+    duracao_job = _Distribuicao()
+    cpu = {}
+    bytes_escritos = {}
+    pico_rss = {}
+    caches = {}
+
+    for m in manifestos:
+        if not m:
+            continue
+        for etapa, dados in (m.get("etapas") or {}).items():
+            duracao_etapa.observar(dados.get("wall_s", 0.0), etapa=etapa)
+            cpu[etapa] = cpu.get(etapa, 0.0) + dados.get("cpu_s", 0.0)
+            bytes_escritos[etapa] = bytes_escritos.get(etapa, 0) + dados.get("bytes_escritos", 0)
+            if "pico_rss_mb" in dados:
+                pico_rss[etapa] = max(pico_rss.get(etapa, 0.0), dados["pico_rss_mb"])
+        if m.get("total"):
+            duracao_job.observar(m["total"].get("wall_s", 0.0), status=m.get("status", ""))
+        for nome, c in (m.get("caches") or {}).items():
+            t = caches.setdefault(nome, {"acertos": 0, "faltas": 0})
+            t["acertos"] += c.get("acertos", 0)
+            t["faltas"] += c.get("faltas", 0)
+
+    linhas = [
+        "# HELP qgis_fila_jobs Jobs por status.",
+        "# TYPE qgis_fila_jobs gauge",
+    ]
+    linhas += [f"qgis_fila_jobs{_rotulos(status=s)} {n}" for s, n in sorted(fila.items())]
+
+    linhas += list(duracao_etapa.linhas("qgis_etapa", "Execuções de cada etapa do pipeline"))
+    linhas += list(duracao_job.linhas("qgis_job", "Jobs concluídos"))
+
+    linhas += ["# HELP qgis_etapa_cpu_segundos Tempo de CPU somado por etapa na janela.",
+               "# TYPE qgis_etapa_cpu_segundos gauge"]
+    linhas += [f"qgis_etapa_cpu_segundos{_rotulos(etapa=e)} {v:.3f}" for e, v in sorted(cpu.items())]
+
+    linhas += ["# HELP qgis_etapa_bytes_escritos Bytes gravados no upload por etapa na janela.",
+               "# TYPE qgis_etapa_bytes_escritos gauge"]
+    linhas += [f"qgis_etapa_bytes_escritos{_rotulos(etapa=e)} {v}" for e, v in sorted(bytes_escritos.items())]
+
+    linhas += ["# HELP qgis_etapa_pico_rss_mb Maior pico de RSS (VmHWM) medido dentro de cada etapa na janela.",
+               "# TYPE qgis_etapa_pico_rss_mb gauge"]
+    linhas += [f"qgis_etapa_pico_rss_mb{_rotulos(etapa=e)} {v:.1f}" for e, v in sorted(pico_rss.items())]
+
+    linhas += ["# HELP qgis_cache_consultas Consultas aos caches do pipeline na janela.",
+               "# TYPE qgis_cache_consultas gauge"]
+    for nome, c in sorted(caches.items()):
+        linhas.append(f"qgis_cache_consultas{_rotulos(cache=nome, resultado='acerto')} {c['acertos']}")
+        linhas.append(f"qgis_cache_consultas{_rotulos(cache=nome, resultado='falta')} {c['faltas']}")
+
+    linhas += ["# HELP qgis_cache_taxa_acerto Fração de acertos de cada cache na janela.",
+               "# TYPE qgis_cache_taxa_acerto gauge"]
+    for nome, c in sorted(caches.items()):
+        total = c["acertos"] + c["faltas"]
+        linhas.append(f"qgis_cache_taxa_acerto{_rotulos(cache=nome)} {c['acertos'] / total if total else 0:.4f}")
+
+    return "\n".join(linhas) + "\n"
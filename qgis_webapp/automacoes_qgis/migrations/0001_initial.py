@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("tipo", models.CharField(default="pipeline", max_length=32)),
+                ("status", models.CharField(
+                    choices=[
+                        ("pendente", "Pendente"),
+                        ("executando", "Executando"),
+                        ("concluido", "Concluído"),
+                        ("falhou", "Falhou"),
+                    ],
+                    default="pendente",
+                    max_length=16,
+                )),
+                ("prioridade", models.IntegerField(default=0)),
+                ("session_key", models.CharField(blank=True, max_length=40)),
+                ("upload_dir", models.CharField(max_length=500)),
+                ("parametros", models.JSONField(blank=True, default=dict)),
+                ("worker", models.CharField(blank=True, max_length=100)),
+                ("erro", models.TextField(blank=True)),
+                ("criado_em", models.DateTimeField(auto_now_add=True)),
+                ("iniciado_em", models.DateTimeField(blank=True, null=True)),
+                ("concluido_em", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-prioridade", "criado_em"],
+                "indexes": [
+                    models.Index(fields=["status", "-prioridade", "criado_em"], name="job_fila_idx"),
+                ],
+            },
+        ),
+    ]
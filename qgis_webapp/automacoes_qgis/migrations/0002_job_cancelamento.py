@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automacoes_qgis", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="job",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pendente", "Pendente"),
+                    ("executando", "Executando"),
+                    ("concluido", "Concluído"),
+                    ("falhou", "Falhou"),
+                    ("cancelado", "Cancelado"),
+                ],
+                default="pendente",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="etapa_interrompida",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automacoes_qgis", "0002_job_cancelamento"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="metricas",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
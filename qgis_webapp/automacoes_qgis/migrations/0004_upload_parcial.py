@@ -0,0 +1,31 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automacoes_qgis", "0003_job_metricas"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadParcial",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("tipo", models.CharField(max_length=16)),
+                ("status", models.CharField(choices=[("recebendo", "Recebendo"), ("concluido", "Concluído"), ("falhou", "Falhou")], default="recebendo", max_length=16)),
+                ("session_key", models.CharField(blank=True, max_length=40)),
+                ("upload_dir", models.CharField(max_length=500)),
+                ("destino", models.CharField(max_length=500)),
+                ("tamanho", models.BigIntegerField()),
+                ("tamanho_parte", models.BigIntegerField()),
+                ("soma", models.CharField(max_length=64)),
+                ("recebido", models.BigIntegerField(default=0)),
+                ("partes", models.JSONField(blank=True, default=list)),
+                ("criado_em", models.DateTimeField(auto_now_add=True)),
+                ("atualizado_em", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
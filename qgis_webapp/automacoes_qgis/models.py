@@ -1,3 +1,87 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class Job(models.Model):
+    """
+    Processamento enfileirado para os workers QGIS (manage.py qgis_worker).
+    A ordem de execução é por prioridade (maior primeiro) e, dentro dela, FIFO.
+    """
+
+    class Status(models.TextChoices):
+        PENDENTE = "pendente", "Pendente"
+        EXECUTANDO = "executando", "Executando"
+        CONCLUIDO = "concluido", "Concluído"
+        FALHOU = "falhou", "Falhou"
+        CANCELADO = "cancelado", "Cancelado"
+
+    TIPO_PIPELINE = "pipeline"
+    TIPO_OVERPASS = "overpass"
+    # envio ao QFieldCloud: só rede, mas fora da thread do request
+    TIPO_QFIELDCLOUD = "qfieldcloud"
+
+    tipo = models.CharField(max_length=32, default=TIPO_PIPELINE)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDENTE)
+    prioridade = models.IntegerField(default=0)
+
+    session_key = models.CharField(max_length=40, blank=True)
+    upload_dir = models.CharField(max_length=500)
+    parametros = models.JSONField(default=dict, blank=True)
+
+    worker = models.CharField(max_length=100, blank=True)
+    erro = models.TextField(blank=True)
+    # etapa em que o job parou (cancelado pelo usuário ou por tempo esgotado)
+    etapa_interrompida = models.FloatField(null=True, blank=True)
+    # medições por etapa da execução (metricas.MedidorEtapas; o mesmo que run_metrics.json)
+    metricas = models.JSONField(default=dict, blank=True)
+
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-prioridade", "criado_em"]
+        indexes = [
+            models.Index(fields=["status", "-prioridade", "criado_em"], name="job_fila_idx"),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} ({self.tipo}, {self.status})"
+
+
+class UploadParcial(models.Model):
+    """
+    Arquivo do job recebido em partes (upload_parcial.py). `recebido` é o
+    offset confirmado: tudo antes dele já está gravado em `destino`.parcial.
+    """
+
+    class Status(models.TextChoices):
+        RECEBENDO = "recebendo", "Recebendo"
+        CONCLUIDO = "concluido", "Concluído"
+        FALHOU = "falhou", "Falhou"
+
+    TIPO_DXF = "dxf"
+    TIPO_ORTOFOTO = "ortofoto"
+
+    # o id vai na URL das partes: aleatório para não ser adivinhado
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tipo = models.CharField(max_length=16)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.RECEBENDO)
+    session_key = models.CharField(max_length=40, blank=True)
+    upload_dir = models.CharField(max_length=500)
+    destino = models.CharField(max_length=500)
+
+    tamanho = models.BigIntegerField()
+    tamanho_parte = models.BigIntegerField()
+    # sha256 (hex) da concatenação dos sha256 das partes, declarado pelo cliente
+    soma = models.CharField(max_length=64)
+    recebido = models.BigIntegerField(default=0)
+    # sha256 (hex) de cada parte já gravada, em ordem
+    partes = models.JSONField(default=list, blank=True)
+
+    criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.tipo}, {self.recebido}/{self.tamanho})"
@@ -2,37 +2,72 @@ import shutil
 import os
 from pathlib import Path
 
-def package_project_for_qfield(project_file: Path, export_folder: Path, include_data_folders: list = None):
+PASTAS_PACOTE = ["final", "ruas", "quadras", "ortofoto"]
+EXTENSOES_PACOTE = (".gpkg", ".qgs", ".tif", ".vrt")
+
+
+def arquivos_do_pacote(project_file: Path, include_data_folders: list = None, extensoes=EXTENSOES_PACOTE):
     """
-    Empacota o projeto QGIS para uso no QField / QField Cloud.
-    - project_file: caminho para o arquivo .qgz/.qgs
-    - export_folder: pasta onde o pacote será criado/copied
-    - include_data_folders: lista de pastas relativas (a partir de projeto) que devem ser incluídas
+    Lista (arquivo de origem, caminho dentro do pacote) do projeto QField,
+    sem copiar nada: o ZIP e o staging leem direto das pastas do projeto.
+    - project_file: vai na raiz do pacote
+    - include_data_folders: pastas relativas ao projeto; se a pasta não
+      existir, arquivos "<pasta> <nome>" entram como "<pasta>/<nome>"
+    - extensoes: só arquivos com essas extensões (None = todos)
     """
     if include_data_folders is None:
         include_data_folders = []
 
-    # 1) cria pasta de exportação limpa
-    if export_folder.exists():
-        shutil.rmtree(export_folder)
-    export_folder.mkdir(parents=True)
+    def aceito(nome):
+        return extensoes is None or nome.lower().endswith(extensoes)
 
-    # 2) copia o arquivo de projeto
-    shutil.copy2(str(project_file), str(export_folder / project_file.name))
+    if not project_file.is_file():
+        raise FileNotFoundError(f"Projeto não encontrado: {project_file}")
 
-    # 3) copia pastas de dados
+    base = project_file.parent
+    arquivos = [(project_file, project_file.name)] if aceito(project_file.name) else []
     for rel in include_data_folders:
-        src = project_file.parent / rel
-        dst = export_folder / rel
-        if src.exists():
-            shutil.copytree(str(src), str(dst))
+        src = base / rel
+        if src.is_dir():
+            for root, dirs, files in os.walk(src):
+                dirs.sort()
+                for fname in sorted(files):
+                    if aceito(fname):
+                        full = Path(root) / fname
+                        arquivos.append((full, full.relative_to(base).as_posix()))
         else:
-            print(f"⚠️ Pasta de dados não encontrada: {src}")
+            # 🔧 Tenta encontrar arquivos que comecem com o nome da pasta
+            for file in sorted(base.glob(f"{rel} *")):
+                if aceito(file.name):
+                    arquivos.append((file, f"{rel}/{file.name.replace(f'{rel} ', '')}"))
+    return arquivos
+
+
+def _vincular(src: Path, dst: Path):
+    """Hardlink (nenhum byte copiado); cópia só se o link não for possível (outro filesystem)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
-    # 4) (opcional) gerar arquivo .cpg ou metadata para encoding, conforme necessidade
-    print(f"📦 Projeto empacotado em: {export_folder}")
 
-    # 5) (Extra) você pode automatizar o upload via API do QField Cloud se tiver credenciais/endpoint
-    # Por enquanto: manual upload em https://cloud.qfield.org ou via plugin QFieldSync
-    
-    return export_folder
\ No newline at end of file
+def package_project_for_qfield(project_file: Path, export_folder: Path, include_data_folders: list = None):
+    """
+    Monta o pacote do projeto QGIS em export_folder para o QField / QField Cloud.
+    Os arquivos são hardlinks para os originais, então o staging não duplica
+    a ortofoto em disco (o pacote reflete os originais; não edite no lugar).
+    - project_file: caminho para o arquivo .qgz/.qgs
+    - export_folder: pasta onde o pacote será criado (recriada do zero)
+    - include_data_folders: lista de pastas relativas (a partir de projeto) que devem ser incluídas
+    """
+    if export_folder.exists():
+        shutil.rmtree(export_folder)
+    export_folder.mkdir(parents=True)
+
+    for src, arcname in arquivos_do_pacote(project_file, include_data_folders, extensoes=None):
+        dst = export_folder / arcname
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        _vincular(src, dst)
+
+    print(f"📦 Projeto empacotado em: {export_folder}")
+    return export_folder
@@ -0,0 +1,266 @@
+"""
+Pacote ZIP do projeto para o QField, guardado por job.
+
+A chave do pacote vem da assinatura (tamanho, mtime, inode) de cada arquivo,
+do caminho dentro do ZIP e do método de compressão: a requisição nunca lê o
+conteúdo (a ortofoto tem vários GB). Enquanto nada muda, todo download serve
+o mesmo arquivo (ETag = chave). Quando algo muda, o pacote é remontado enquanto
+é enviado, copiando do pacote anterior os membros comprimidos que não
+mudaram: só os arquivos alterados são recomprimidos.
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from .arquivo_utils import assinatura_arquivo
+from .zip_stream import BLOCO_LEITURA, ZipStream, comprimir_arquivo, inicio_dos_dados
+
+# Incrementar quando o formato do pacote mudar (invalida os pacotes guardados)
+VERSAO_PACOTE = 2
+
+DIR_CACHE = ".pacote_qfield"
+INDICE = "indice.json"
+
+THREADS_COMPRESSAO = min(4, os.cpu_count() or 1)
+
+# Formatos que já chegam comprimidos: deflate gastaria CPU sem diminuir o pacote
+EXTENSOES_COMPRIMIDAS = {".jpg", ".jpeg", ".png", ".ecw", ".jp2", ".zip", ".gz", ".docx"}
+
+
+def _tiff_comprimido(caminho: Path) -> bool:
+    """Lê a tag Compression (259) do primeiro IFD do TIFF/BigTIFF; 1 = sem compressão."""
+    try:
+        with open(caminho, "rb") as f:
+            cab = f.read(16)
+            ordem = {b"II": "<", b"MM": ">"}.get(cab[:2])
+            if ordem is None:
+                return False
+            versao = struct.unpack(ordem + "H", cab[2:4])[0]
+            if versao == 42:
+                f.seek(struct.unpack(ordem + "I", cab[4:8])[0])
+                n, tam, pos_valor = struct.unpack(ordem + "H", f.read(2))[0], 12, 8
+            elif versao == 43:
+                f.seek(struct.unpack(ordem + "Q", cab[8:16])[0])
+                n, tam, pos_valor = struct.unpack(ordem + "Q", f.read(8))[0], 20, 12
+            else:
+                return False
+            for _ in range(min(n, 1024)):
+                entrada = f.read(tam)
+                if struct.unpack(ordem + "H", entrada[:2])[0] == 259:
+                    return struct.unpack(ordem + "H", entrada[pos_valor:pos_valor + 2])[0] != 1
+    except (OSError, struct.error):
+        pass
+    return False
+
+
+def metodo_compressao(caminho: Path) -> int:
+    """
+    Armazena o que já é comprimido (a ortofoto sai do gdal_translate como
+    TIFF/JPEG) e aplica deflate em vetores e XML (.gpkg, .qgs, .vrt).
+    """
+    sufixo = caminho.suffix.lower()
+    if sufixo in EXTENSOES_COMPRIMIDAS or (sufixo in (".tif", ".tiff") and _tiff_comprimido(caminho)):
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def _ler_indice(cache: Path) -> dict:
+    try:
+        return json.loads((cache / INDICE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _gravar_indice(cache: Path, indice: dict):
+    fd, tmp = tempfile.mkstemp(dir=cache, prefix=".indice.", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(indice, f, ensure_ascii=False)
+    os.replace(tmp, cache / INDICE)
+
+
+@dataclass
+class Pacote:
+    upload_dir: Path
+    chave: str
+    # (caminho, nome no ZIP, método, assinatura do arquivo)
+    membros: list
+
+    @property
+    def cache(self) -> Path:
+        return self.upload_dir / DIR_CACHE
+
+    @property
+    def arquivo(self) -> Path:
+        return self.cache / f"pacote-{self.chave[:32]}.zip"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.chave[:32]}"'
+
+    @property
+    def pronto(self) -> bool:
+        return self.arquivo.is_file()
+
+    @property
+    def arquivos(self):
+        """(caminho, nome, método), como zip_stream.zip_de_arquivos espera."""
+        return [(c, n, m) for c, n, m, _ in self.membros]
+
+
+def preparar_pacote(upload_dir: Path, arquivos) -> Pacote:
+    """
+    Calcula a chave do pacote de (caminho, nome no ZIP, método) só com stat:
+    um arquivo regravado com o mesmo conteúdo apenas recomprime aquele membro.
+    """
+    cache = Path(upload_dir) / DIR_CACHE
+    cache.mkdir(parents=True, exist_ok=True)
+    membros = []
+    for caminho, nome, metodo in arquivos:
+        h = "-".join(map(str, assinatura_arquivo(caminho)))
+        membros.append((Path(caminho), nome, metodo, h))
+
+    soma = hashlib.sha256(f"v{VERSAO_PACOTE}".encode())
+    for _, nome, metodo, h in membros:
+        soma.update(f"\0{nome}\0{metodo}\0{h}".encode("utf-8"))
+    return Pacote(Path(upload_dir), soma.hexdigest(), membros)
+
+
+def _ler_trecho(arquivo, inicio: int, tamanho: int, bloco: int):
+    arquivo.seek(inicio)
+    while tamanho > 0:
+        pedaco = arquivo.read(min(bloco, tamanho))
+        if not pedaco:
+            raise EOFError("Pacote anterior truncado")
+        tamanho -= len(pedaco)
+        yield pedaco
+
+
+def _ler_arquivo(caminho: Path, bloco: int):
+    """Blocos de um membro já comprimido num temporário, que é apagado no fim."""
+    try:
+        with open(caminho, "rb") as f:
+            while pedaco := f.read(bloco):
+                yield pedaco
+    finally:
+        Path(caminho).unlink(missing_ok=True)
+
+
+def _comprimir_membro(caminho: Path, metodo, cache: Path):
+    fd, tmp = tempfile.mkstemp(dir=cache, prefix=".membro-", suffix=".tmp")
+    os.close(fd)
+    try:
+        return (*comprimir_arquivo(caminho, tmp, metodo), tmp)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def gerar_pacote(pacote: Pacote, bloco=BLOCO_LEITURA):
+    """
+    Gera o ZIP enquanto grava o pacote no cache. Se o cliente desconectar no
+    meio, o pacote é terminado mesmo assim, para o download ser retomado com
+    Range a partir do arquivo pronto; só um erro descarta o arquivo parcial.
+    """
+    partes = _montar(pacote, bloco)
+    try:
+        for parte in partes:
+            yield parte
+    except GeneratorExit:
+        try:
+            for _ in partes:
+                pass
+        except Exception as e:
+            print(f"⚠️ Pacote QField não terminado após desconexão: {e}")
+        raise
+
+
+def construir_pacote(pacote: Pacote) -> Path:
+    """Monta o pacote no cache sem enviar nada (para servir por Range/offload)."""
+    for _ in gerar_pacote(pacote):
+        pass
+    return pacote.arquivo
+
+
+def _montar(pacote: Pacote, bloco: int):
+    """
+    Membros comprimidos iguais aos do pacote anterior são copiados dele sem
+    recomprimir; os demais são comprimidos em paralelo (zlib libera o GIL) em
+    temporários e entram no ZIP na ordem. Membros armazenados são lidos
+    direto da origem (com o CRC no cabeçalho local, ver zip_stream).
+    """
+    cache = pacote.cache
+    indice = _ler_indice(cache)
+    anterior = indice.get("pacote") or {}
+    antigo = cache / anterior["arquivo"] if anterior.get("arquivo") else None
+    reaproveitaveis = anterior.get("membros", {})
+
+    fd, tmp = tempfile.mkstemp(dir=cache, prefix=".pacote-", suffix=".tmp")
+    zs = ZipStream()
+    membros = {}
+    reaproveitados = 0
+    fonte = open(antigo, "rb") if antigo and antigo.is_file() else None
+    executor = ThreadPoolExecutor(max_workers=THREADS_COMPRESSAO)
+    tarefas = []
+    try:
+        # (nome, método, chave, origem): trecho do pacote anterior, compressão
+        # em andamento (Future) ou o próprio arquivo
+        plano = []
+        for caminho, nome, metodo, h in pacote.membros:
+            chave = f"{h}:{metodo}"
+            info = reaproveitaveis.get(chave) if fonte and metodo != ZIP_STORED else None
+            inicio = inicio_dos_dados(fonte, info["offset"]) if info else None
+            if inicio is not None:
+                origem = dict(info, inicio=inicio)
+            elif metodo != ZIP_STORED:
+                origem = executor.submit(_comprimir_membro, caminho, metodo, cache)
+                tarefas.append(origem)
+            else:
+                origem = caminho
+            plano.append((nome, metodo, chave, origem))
+
+        with os.fdopen(fd, "wb") as saida:
+            for nome, metodo, chave, origem in plano:
+                if isinstance(origem, dict):
+                    partes = zs.adicionar_comprimido(nome, metodo, origem["crc"], origem["csize"], origem["tamanho"],
+                                                     _ler_trecho(fonte, origem["inicio"], origem["csize"], bloco))
+                    reaproveitados += 1
+                elif isinstance(origem, Future):
+                    crc, csize, usize, comprimido = origem.result()
+                    partes = zs.adicionar_comprimido(nome, metodo, crc, csize, usize, _ler_arquivo(comprimido, bloco))
+                else:
+                    # armazenado: o CRC do mesmo conteúdo no pacote anterior poupa uma leitura
+                    crc = reaproveitaveis.get(chave, {}).get("crc")
+                    partes = zs.adicionar_arquivo(origem, nome, metodo, bloco, crc=crc)
+                for parte in partes:
+                    saida.write(parte)
+                    yield parte
+                _, _, crc, csize, usize, offset = zs.membros[-1]
+                membros[chave] = {"crc": crc, "csize": csize, "tamanho": usize, "offset": offset}
+            fim = zs.finalizar()
+            saida.write(fim)
+            yield fim
+        os.replace(tmp, pacote.arquivo)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for tarefa in tarefas:
+            if tarefa.done() and not tarefa.cancelled() and tarefa.exception() is None:
+                Path(tarefa.result()[3]).unlink(missing_ok=True)
+        if fonte:
+            fonte.close()
+
+    indice = _ler_indice(cache)
+    indice["pacote"] = {"chave": pacote.chave, "arquivo": pacote.arquivo.name, "membros": membros}
+    _gravar_indice(cache, indice)
+    for velho in cache.glob("pacote-*.zip"):
+        if velho != pacote.arquivo:
+            velho.unlink(missing_ok=True)
+    print(f"📦 Pacote QField montado ({reaproveitados}/{len(pacote.membros)} membros reaproveitados)")
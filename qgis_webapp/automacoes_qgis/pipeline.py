@@ -1,12 +1,11 @@
 from qgis.core import (
     QgsApplication, QgsVectorLayer, QgsVectorFileWriter, QgsField,
     QgsProject, QgsCoordinateReferenceSystem, QgsCoordinateTransform,
-    QgsCoordinateTransformContext, QgsRasterLayer
+    QgsCoordinateTransformContext, QgsRasterLayer, QgsProcessingMultiStepFeedback
 )
 from qgis.PyQt.QtCore import QVariant
-from qgis.analysis import QgsNativeAlgorithms
-from processing.core.Processing import Processing
 import processing
+from processing.tools import dataobjects
 from pathlib import Path
 from collections import defaultdict
 from shapely.geometry import LineString, shape
@@ -18,19 +17,15 @@ import json
 import numpy as np
 import subprocess
 import os
+import time
+from .etapas import avancar
+from .memorial_docx import (
+    renderizar_memorial_lote, renderizar_memorial_quadra, renderizar_memoriais_lotes,
+    renderizar_memoriais_quadras
+)
 
 
-Processing.initialize()
-QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
-
-# ==================== BOOT ====================
-# def init_qgis():
-#     qgs = QgsApplication([], False)
-#     qgs.initQgis()
-#     Processing.initialize()
-#     if not any(isinstance(p, QgsNativeAlgorithms) for p in QgsApplication.processingRegistry().providers()):
-#         QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
-#     return qgs
+# QGIS e Processing são inicializados uma vez por worker (qgis_setup.init_qgis).
 
 
 # ==================== HELPERS ====================
@@ -41,8 +36,9 @@ def save_layer(layer: QgsVectorLayer, file_path: Path, driver="ESRI Shapefile",
     opts.fileEncoding = "UTF-8"
     if layer_name:
         opts.layerName = layer_name
-    ctx = QgsProject.instance().transformContext()
-    err, msg = QgsVectorFileWriter.writeAsVectorFormatV2(layer, str(file_path), ctx, opts)
+    err, msg = QgsVectorFileWriter.writeAsVectorFormatV2(
+        layer, str(file_path), QgsCoordinateTransformContext(), opts
+    )
     if err != QgsVectorFileWriter.NoError:
         raise RuntimeError(f"Falha ao salvar '{file_path}': {msg}")
     return file_path
@@ -56,77 +52,103 @@ def num_to_letters(n: int) -> str:
     return s
 
 
+def _passos(feedback, n):
+    """Divide o feedback de uma etapa entre n chamadas de algoritmo."""
+    return QgsProcessingMultiStepFeedback(n, feedback) if feedback is not None else None
+
+
+def _rodar(algoritmo: str, parametros: dict, feedback=None) -> dict:
+    """
+    processing.run com contexto próprio: sem QgsProject.instance() e com
+    transform context vazio, para que jobs simultâneos não compartilhem estado.
+    O feedback recebe progresso e log do algoritmo e pode cancelá-lo.
+    """
+    avancar(feedback)
+    context = dataobjects.createContext()
+    context.setProject(None)
+    context.setTransformContext(QgsCoordinateTransformContext())
+    resultado = processing.run(algoritmo, parametros, context=context, feedback=feedback)
+    # algoritmos nativos cancelados param no meio e devolvem a saída parcial
+    avancar(feedback)
+    return resultado
+
+
 # ==================== PIPELINE FUNCTIONS ====================
-def dxf_to_shp(dxf_path: Path, out_path: Path):
+def dxf_to_shp(dxf_path: Path, out_path: Path, feedback=None):
+    avancar(feedback, 0)
     uri_lines = f"{dxf_path}|layername=entities|geometrytype=LineString"
     layer = QgsVectorLayer(uri_lines, "lotes_linhas", "ogr")
     if not layer.isValid():
         raise Exception("❌ Camada de linhas inválida.")
     save_layer(layer, out_path)
+    avancar(feedback, 100)
     print("Linhas salvas:", out_path)
     return layer
 
 
-def corrigir_e_snap(linhas: QgsVectorLayer, paths):
-    res_fix_lines = processing.run("native:fixgeometries", {
+def corrigir_e_snap(linhas: QgsVectorLayer, paths, feedback=None):
+    passos = _passos(feedback, 2)
+    res_fix_lines = _rodar("native:fixgeometries", {
         "INPUT": linhas, "OUTPUT": str(paths["linhas_fix"])
-    })
+    }, passos)
     linhas_fix = QgsVectorLayer(res_fix_lines["OUTPUT"], "linhas_fix", "ogr")
 
-    res_snap = processing.run("native:snapgeometries", {
+    if passos:
+        passos.setCurrentStep(1)
+    res_snap = _rodar("native:snapgeometries", {
         "INPUT": linhas_fix, "REFERENCE_LAYER": linhas_fix,
         "TOLERANCE": 0.5, "BEHAVIOR": 0,
         "OUTPUT": str(paths["linhas_snap"])
-    })
+    }, passos)
     linhas_snap = QgsVectorLayer(res_snap["OUTPUT"], "linhas_snap", "ogr")
     print("Linhas corrigidas e ajustadas:", linhas_snap.featureCount())
     return linhas_snap
 
 
-def linhas_para_poligonos(linhas_snap, out_path):
-    res_poly = processing.run("qgis:linestopolygons", {
+def linhas_para_poligonos(linhas_snap, out_path, feedback=None):
+    res_poly = _rodar("qgis:linestopolygons", {
         "INPUT": linhas_snap, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     return QgsVectorLayer(res_poly["OUTPUT"], "lotes_poligonos", "ogr")
 
 
-def corrigir_geometrias(layer_in, out_path):
-    res_fix = processing.run("native:fixgeometries", {
+def corrigir_geometrias(layer_in, out_path, feedback=None):
+    res_fix = _rodar("native:fixgeometries", {
         "INPUT": layer_in, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     layer_out = QgsVectorLayer(res_fix["OUTPUT"], "corrigido", "ogr")
     print("Geometrias corrigidas:", layer_out.featureCount())
     return layer_out
 
 
-def buffer_lotes(lotes_fix, out_path):
-    res_buffer = processing.run("native:buffer", {
+def buffer_lotes(lotes_fix, out_path, feedback=None):
+    res_buffer = _rodar("native:buffer", {
         "INPUT": lotes_fix, "DISTANCE": 0.05,
         "SEGMENTS": 5, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     buffer_layer = QgsVectorLayer(res_buffer["OUTPUT"], "lotes_buffer", "ogr")
     print("Buffer aplicado:", buffer_layer.featureCount())
     return buffer_layer
 
 
-def dissolve_para_quadras(buffer_layer, out_path):
-    res_diss = processing.run("native:dissolve", {
+def dissolve_para_quadras(buffer_layer, out_path, feedback=None):
+    res_diss = _rodar("native:dissolve", {
         "INPUT": buffer_layer, "FIELD": [],
         "SEPARATE_DISJOINT": True, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     return QgsVectorLayer(res_diss["OUTPUT"], "quadras_raw", "ogr")
 
 
-def singlepart_quadras(quadras_raw, out_path):
-    res_single = processing.run("native:multiparttosingleparts", {
+def singlepart_quadras(quadras_raw, out_path, feedback=None):
+    res_single = _rodar("native:multiparttosingleparts", {
         "INPUT": quadras_raw, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     quadras = QgsVectorLayer(res_single["OUTPUT"], "quadras", "ogr")
     print("Quadras criadas:", quadras.featureCount())
     return quadras
 
 
-def atribuir_letras_quadras(quadras, out_path):
+def atribuir_letras_quadras(quadras, out_path, feedback=None):
     pr = quadras.dataProvider()
     if "quadra" not in [f.name() for f in quadras.fields()]:
         pr.addAttributes([QgsField("quadra", QVariant.String, len=8)])
@@ -138,32 +160,34 @@ def atribuir_letras_quadras(quadras, out_path):
     feats.sort(key=lambda f: f.geometry().centroid().asPoint().x())
     for i, ft in enumerate(feats, start=1):
         quadras.changeAttributeValue(ft.id(), idx, i)
+        if i % 100 == 0:
+            avancar(feedback, 90 * i / len(feats))
     quadras.commitChanges()
     save_layer(quadras, out_path)
     print("Letras atribuídas às quadras:", out_path)
     return quadras
 
 
-def gerar_pontos_rotulo(quadras, out_path):
-    res_pt = processing.run("qgis:pointonsurface", {
+def gerar_pontos_rotulo(quadras, out_path, feedback=None):
+    res_pt = _rodar("qgis:pointonsurface", {
         "INPUT": quadras, "ALL_PARTS": False, "OUTPUT": str(out_path)
-    })
+    }, feedback)
     pts = QgsVectorLayer(res_pt["OUTPUT"], "quadras_rotulo_pt", "ogr")
     print("Pontos de rótulo:", pts.featureCount())
     return pts
 
 
-def join_lotes_quadras(lotes_fix, quadras, out_path):
-    res_join = processing.run("native:joinattributesbylocation", {
+def join_lotes_quadras(lotes_fix, quadras, out_path, feedback=None):
+    res_join = _rodar("native:joinattributesbylocation", {
         "INPUT": lotes_fix, "JOIN": quadras,
         "PREDICATE": [6, 0], "JOIN_FIELDS": ["quadra"],
         "METHOD": 0, "DISCARD_NONMATCHING": True,
         "OUTPUT": str(out_path)
-    })
+    }, feedback)
     return QgsVectorLayer(res_join["OUTPUT"], "lotes_com_quadra", "ogr")
 
 
-def numerar_lotes(lotes_join, out_path):
+def numerar_lotes(lotes_join, out_path, feedback=None):
     pr = lotes_join.dataProvider()
     if "lote_num" not in [f.name() for f in lotes_join.fields()]:
         pr.addAttributes([QgsField("lote_num", QVariant.Int)])
@@ -176,17 +200,24 @@ def numerar_lotes(lotes_join, out_path):
     for feat in lotes_join.getFeatures():
         grouped[feat["quadra"]].append(feat)
 
-    for quadra, feats in grouped.items():
+    avancar(feedback, 20)
+    for n, (quadra, feats) in enumerate(grouped.items(), start=1):
         feats.sort(key=lambda f: f.geometry().centroid().asPoint().y(), reverse=True)
         for i, f in enumerate(feats, start=1):
             lotes_join.changeAttributeValue(f.id(), idx_lote, i)
+        avancar(feedback, 20 + 70 * n / len(grouped))
 
     lotes_join.commitChanges()
     save_layer(lotes_join, out_path)
     print("Numeração dos lotes concluída:", out_path)
     return lotes_join
 
-def extrair_ruas_overpass(quadras, out_dir):
+def extrair_ruas_overpass(quadras, out_dir, feedback=None, prazo=None):
+    """
+    Baixa as ruas do OSM que cruzam as quadras. prazo (time.monotonic) limita
+    o tempo total das tentativas; esgotado, levanta RuntimeError como quando
+    todos os servidores falham.
+    """
     print("🌐 Baixando ruas do OSM com base no polígono das quadras...")
 
     if not quadras.crs().isValid():
@@ -194,7 +225,7 @@ def extrair_ruas_overpass(quadras, out_dir):
 
     crs_src = quadras.crs()
     crs_dest = QgsCoordinateReferenceSystem("EPSG:4326")
-    transformer = QgsCoordinateTransform(crs_src, crs_dest, QgsProject.instance().transformContext())
+    transformer = QgsCoordinateTransform(crs_src, crs_dest, QgsCoordinateTransformContext())
 
     geoms = []
     for f in quadras.getFeatures():
@@ -225,11 +256,15 @@ def extrair_ruas_overpass(quadras, out_dir):
     resp = None
     success = False
 
-    for url in overpass_servers:
+    for n_servidor, url in enumerate(overpass_servers):
         print(f"🔄 Tentando servidor: {url}")
         for attempt in range(3):  # tenta até 3 vezes por servidor
+            restante = prazo - time.monotonic() if prazo else 90
+            if restante <= 0:
+                raise RuntimeError("❌ Tempo limite da busca de ruas esgotado.")
+            avancar(feedback, 80 * (n_servidor * 3 + attempt) / (3 * len(overpass_servers)))
             try:
-                resp = requests.post(url, data={"data": query}, timeout=90)
+                resp = requests.post(url, data={"data": query}, timeout=min(90, restante))
                 if resp.status_code == 200:
                     success = True
                     break
@@ -248,6 +283,7 @@ def extrair_ruas_overpass(quadras, out_dir):
             "❌ Todos os servidores Overpass falharam. O serviço pode estar temporariamente indisponível."
         )
 
+    avancar(feedback, 80)
     data = resp.json()
     elements = data.get("elements", [])
     print(f"✅ Total de vias retornadas: {len(elements)}")
@@ -315,7 +351,8 @@ def atribuir_ruas_e_esquinas_precision(
         epsg_lotes=31983,
         base_buffer=9,
         min_testada=1.0,
-        min_delta_graus=30.0
+        min_delta_graus=30.0,
+        feedback=None
     ):
     """
     Atribui:
@@ -379,7 +416,9 @@ def atribuir_ruas_e_esquinas_precision(
     ruas_str_final = []
     esquina_final = []
 
-    for _, lote in lotes.iterrows():
+    for k, (_, lote) in enumerate(lotes.iterrows()):
+        if k % 200 == 0:
+            avancar(feedback, 95 * k / len(lotes))
         lote_geom = lote.geometry
 
         # candidatos pelo bbox
@@ -552,8 +591,8 @@ def create_final_gpkg(layer_path: Path) -> Path:
 
     return gpkg_path
 
-def adicionar_ortofoto(ortho_path: Path, layer_name: str, crs_alvo=None):
-    """Adiciona uma ortofoto (ECW, TIFF, etc.) ao projeto QGIS."""
+def adicionar_ortofoto(ortho_path: Path, layer_name: str, crs_alvo=None, project: QgsProject = None):
+    """Carrega uma ortofoto (ECW, TIFF, etc.) e, se informado, a adiciona ao projeto do job."""
     if not ortho_path.exists():
         print(f"⚠️ Ortofoto não encontrada: {ortho_path}")
         return None
@@ -566,7 +605,8 @@ def adicionar_ortofoto(ortho_path: Path, layer_name: str, crs_alvo=None):
     if crs_alvo:
         rlayer.setCrs(QgsCoordinateReferenceSystem(crs_alvo))
 
-    QgsProject.instance().addMapLayer(rlayer, False)
+    if project is not None:
+        project.addMapLayer(rlayer, False)
     print(f"🖼️ Ortofoto adicionada: {layer_name} ({ortho_path.name})")
     return rlayer
 
@@ -645,133 +685,8 @@ def gerar_memorial_lote(row,
                         uf: str = "MG",
                         promotor: str = "Instituto Cidade Legal"):
 
-    doc = Document()
-
-    quadra = row.get("quadra")
-    lote_num = row.get("lote_num")
-
-    _add_cabecalho_memorial(
-        doc,
-        titulo="MEMORIAL DESCRITIVO",
-        quadra=quadra,
-        nucleo=nucleo,
-        municipio=municipio,
-        uf=uf,
-        promotor=promotor
-    )
-
-    geom = row.geometry
-    area_m2 = geom.area if geom is not None else None
-    perimetro_m = geom.length if geom is not None else None
-
-    # Bloco identificador do lote
-    p_info = doc.add_paragraph()
-    p_info.add_run(f"Quadra: {quadra}\n")
-    p_info.add_run(f"Lote: {lote_num}\n")
-    if area_m2 is not None:
-        p_info.add_run(f"Área: {_fmt_num_br(area_m2, 2)} m²\n")
-    if perimetro_m is not None:
-        p_info.add_run(f"Perímetro: {_fmt_num_br(perimetro_m, 2)} m\n")
-
-    doc.add_paragraph()
-
-    # Centroide como referência (não é obrigatório, mas ajuda)
-    if geom is not None:
-        c = geom.centroid
-        x = c.x
-        y = c.y
-    else:
-        x = y = None
-
-    rua_frente = row.get("Conf_Frente")
-    comp_frente = row.get("Comp_Frente")
-    rumo_frente = row.get("Rumo_Frente")
-
-    comp_dir = row.get("Comp_Direita")
-    rumo_dir = row.get("Rumo_Direita")
-    conf_dir = row.get("Conf_Direita")
-
-    comp_fundo = row.get("Comp_Fundos")
-    rumo_fundo = row.get("Rumo_Fundos")
-    conf_fundo = row.get("Conf_Fundos")
-
-    comp_esq = row.get("Comp_Esquerda")
-    rumo_esq = row.get("Rumo_Esquerda")
-    conf_esq = row.get("Conf_Esquerda")
-
-    # Parágrafo principal de descrição – estilo REURB, mas simplificado
-    texto = []
-
-    # Introdução
-    intro = (
-        f"O lote de terreno sob nº {lote_num} da Quadra {quadra}, "
-        f"do Núcleo denominado “{nucleo}”, no município de {municipio} - {uf}, "
-        f"apresenta área de {_fmt_num_br(area_m2, 2)} m²"
-    )
-    if perimetro_m is not None:
-        intro += f" e um perímetro de {_fmt_num_br(perimetro_m, 2)} m."
-    else:
-        intro += "."
-
-    texto.append(intro)
-
-    if x is not None and y is not None:
-        texto.append(
-            f"Para fins de localização, toma-se como referência um ponto interno do lote, "
-            f"com coordenadas aproximadas E = {_fmt_coord(x)} m e N = {_fmt_coord(y)} m, "
-            f"no sistema de referência do projeto."
-        )
-
-    # Frente
-    if rua_frente and comp_frente and rumo_frente:
-        texto.append(
-            f"Para quem de dentro do lote {lote_num} olha para {rua_frente}, "
-            f"inicia-se a descrição pela frente, com rumo {rumo_frente} "
-            f"e distância de {_fmt_num_br(comp_frente, 2)} m, "
-            f"confrontando com {rua_frente}."
-        )
-
-    # Lado direito
-    if comp_dir and rumo_dir and conf_dir:
-        texto.append(
-            f"Deste ponto, deflete à direita, seguindo com rumo {rumo_dir} "
-            f"e distância de {_fmt_num_br(comp_dir, 2)} m, "
-            f"confrontando com {conf_dir}."
-        )
-
-    # Fundos
-    if comp_fundo and rumo_fundo and conf_fundo:
-        texto.append(
-            f"Em seguida, deflete novamente, seguindo pelos fundos com rumo {rumo_fundo} "
-            f"e distância de {_fmt_num_br(comp_fundo, 2)} m, "
-            f"confrontando com {conf_fundo}."
-        )
-
-    # Lado esquerdo
-    if comp_esq and rumo_esq and conf_esq:
-        texto.append(
-            f"Por fim, deflete à esquerda, seguindo com rumo {rumo_esq} "
-            f"e distância de {_fmt_num_br(comp_esq, 2)} m, "
-            f"confrontando com {conf_esq}, "
-            f"retornando ao ponto inicial da descrição do perímetro do lote."
-        )
-
-    p_desc = doc.add_paragraph()
-    p_desc.paragraph_format.first_line_indent = Pt(12)
-    p_desc.add_run(" ".join(texto))
-
-    # Rodapé técnico básico
-    doc.add_paragraph()
-    rod = doc.add_paragraph()
-    rod.add_run(
-        "Todas as medidas lineares, áreas e rumos foram calculados no sistema de projeção "
-        "e datum adotados no projeto (ex.: SIRGAS2000 / UTM)."
-    )
-
-    # Salvar
-    docx_path.parent.mkdir(parents=True, exist_ok=True)
-    doc.save(str(docx_path))
-    print(f"✅ Memorial do lote {lote_num} - quadra {quadra} salvo em: {docx_path}")
+    renderizar_memorial_lote(row, docx_path, nucleo=nucleo, municipio=municipio, uf=uf, promotor=promotor)
+    print(f"✅ Memorial do lote {row.get('lote_num')} - quadra {row.get('quadra')} salvo em: {docx_path}")
 
 def gerar_memorial_quadra(upload_dir: Path,
                           arquivo_final_nome: str,
@@ -794,128 +709,24 @@ def gerar_memorial_quadra(upload_dir: Path,
         print(f"⚠ Nenhum lote encontrado para a quadra {quadra_str}.")
         return None
 
-    lotes_quadra = lotes_quadra.sort_values(by="lote_num")
-
     if saida_dir is None:
         saida_dir = upload_dir / "memoriais"
     saida_dir.mkdir(parents=True, exist_ok=True)
 
-    doc_name = f"memorial_quadra_{quadra_str}.docx"
-    docx_path = saida_dir / doc_name
-
-    doc = Document()
-
-    _add_cabecalho_memorial(
-        doc,
-        titulo="MEMORIAL DESCRITIVO",
-        quadra=quadra_str,
-        nucleo=nucleo,
-        municipio=municipio,
-        uf=uf,
-        promotor=promotor
-    )
-
-    for _, row in lotes_quadra.iterrows():
-        quadra = row.get("quadra")
-        lote_num = row.get("lote_num")
-        geom = row.geometry
-        area_m2 = geom.area if geom is not None else None
-        perimetro_m = geom.length if geom is not None else None
-
-        # Título do lote dentro da quadra
-        p_header_lote = doc.add_paragraph()
-        run = p_header_lote.add_run(f"Quadra: {quadra} - Lote: {lote_num}")
-        run.bold = True
-
-        p_info = doc.add_paragraph()
-        if area_m2 is not None:
-            p_info.add_run(f"Área: {_fmt_num_br(area_m2, 2)} m²\n")
-        if perimetro_m is not None:
-            p_info.add_run(f"Perímetro: {_fmt_num_br(perimetro_m, 2)} m\n")
-
-        doc.add_paragraph()
-
-        # Reutiliza a mesma lógica do memorial de lote, mas inline
-        rua_frente = row.get("Conf_Frente")
-        comp_frente = row.get("Comp_Frente")
-        rumo_frente = row.get("Rumo_Frente")
-
-        comp_dir = row.get("Comp_Direita")
-        rumo_dir = row.get("Rumo_Direita")
-        conf_dir = row.get("Conf_Direita")
-
-        comp_fundo = row.get("Comp_Fundos")
-        rumo_fundo = row.get("Rumo_Fundos")
-        conf_fundo = row.get("Conf_Fundos")
-
-        comp_esq = row.get("Comp_Esquerda")
-        rumo_esq = row.get("Rumo_Esquerda")
-        conf_esq = row.get("Conf_Esquerda")
-
-        texto = []
-
-        intro = (
-            f"O lote de terreno sob nº {lote_num} da Quadra {quadra}, "
-            f"do Núcleo denominado “{nucleo}”, no município de {municipio} - {uf}, "
-            f"apresenta área de {_fmt_num_br(area_m2, 2)} m²"
-        )
-        if perimetro_m is not None:
-            intro += f" e um perímetro de {_fmt_num_br(perimetro_m, 2)} m."
-        else:
-            intro += "."
-        texto.append(intro)
-
-        if rua_frente and comp_frente and rumo_frente:
-            texto.append(
-                f"Para quem de dentro do lote {lote_num} olha para {rua_frente}, "
-                f"inicia-se a descrição pela frente, com rumo {rumo_frente} "
-                f"e distância de {_fmt_num_br(comp_frente, 2)} m, "
-                f"confrontando com {rua_frente}."
-            )
-        if comp_dir and rumo_dir and conf_dir:
-            texto.append(
-                f"Deste ponto, deflete à direita, seguindo com rumo {rumo_dir} "
-                f"e distância de {_fmt_num_br(comp_dir, 2)} m, "
-                f"confrontando com {conf_dir}."
-            )
-        if comp_fundo and rumo_fundo and conf_fundo:
-            texto.append(
-                f"Em seguida, deflete, seguindo pelos fundos com rumo {rumo_fundo} "
-                f"e distância de {_fmt_num_br(comp_fundo, 2)} m, "
-                f"confrontando com {conf_fundo}."
-            )
-        if comp_esq and rumo_esq and conf_esq:
-            texto.append(
-                f"Por fim, deflete à esquerda, seguindo com rumo {rumo_esq} "
-                f"e distância de {_fmt_num_br(comp_esq, 2)} m, "
-                f"confrontando com {conf_esq}, retornando ao ponto inicial."
-            )
-
-        p_desc = doc.add_paragraph()
-        p_desc.paragraph_format.first_line_indent = Pt(12)
-        p_desc.add_run(" ".join(texto))
-
-        doc.add_paragraph()  # espaço entre lotes
-
-    # Rodapé geral
-    doc.add_paragraph()
-    rod = doc.add_paragraph()
-    rod.add_run(
-        "Todas as medidas lineares, áreas e rumos foram calculados no sistema de projeção "
-        "e datum adotados no projeto (ex.: SIRGAS2000 / UTM)."
+    docx_path = saida_dir / f"memorial_quadra_{quadra_str}.docx"
+    return renderizar_memorial_quadra(
+        lotes_quadra, quadra_str, docx_path,
+        nucleo=nucleo, municipio=municipio, uf=uf, promotor=promotor
     )
 
-    doc.save(str(docx_path))
-    print(f"✅ Memorial da quadra {quadra_str} salvo em: {docx_path}")
-    return docx_path
-
 def gerar_memoriais_em_lote(upload_dir: Path,
                             arquivo_final_nome: str = "final_medidas_azimutes.gpkg",
                             nucleo: str = "Centro",
                             municipio: str = "Condeúba",
                             uf: str = "BA",
                             promotor: str = "Instituto Cidade Legal",
-                            saida_dir: Path | None = None):
+                            saida_dir: Path | None = None,
+                            max_workers: int | None = None):
 
     final_path = upload_dir / "final" / arquivo_final_nome
     gdf = gpd.read_file(final_path)
@@ -925,25 +736,12 @@ def gerar_memoriais_em_lote(upload_dir: Path,
 
     if saida_dir is None:
         saida_dir = upload_dir / "memoriais"
-    saida_dir.mkdir(parents=True, exist_ok=True)
-
-    quadras_unicas = sorted(gdf["quadra"].unique(), key=lambda x: str(x))
 
-    paths_gerados = []
-
-    for q in quadras_unicas:
-        path_q = gerar_memorial_quadra(
-            upload_dir=upload_dir,
-            arquivo_final_nome=arquivo_final_nome,
-            quadra_alvo=q,
-            nucleo=nucleo,
-            municipio=municipio,
-            uf=uf,
-            promotor=promotor,
-            saida_dir=saida_dir
-        )
-        if path_q:
-            paths_gerados.append(path_q)
+    # Lê o GPKG uma única vez; cada quadra vira um .docx independente
+    paths_gerados = renderizar_memoriais_quadras(
+        gdf, saida_dir, nucleo=nucleo, municipio=municipio, uf=uf, promotor=promotor,
+        max_workers=max_workers
+    )
 
     print("✅ Geração de memoriais concluída.")
     print("Arquivos gerados:")
@@ -951,3 +749,24 @@ def gerar_memoriais_em_lote(upload_dir: Path,
         print("  -", p)
 
     return paths_gerados
+
+def gerar_memoriais_lotes_em_lote(upload_dir: Path,
+                                  arquivo_final_nome: str = "final_medidas_azimutes.gpkg",
+                                  nucleo: str = "Centro",
+                                  municipio: str = "Condeúba",
+                                  uf: str = "BA",
+                                  promotor: str = "Instituto Cidade Legal",
+                                  saida_dir: Path | None = None):
+    """Gera um memorial .docx por lote, em uma única passada sobre o GPKG final."""
+    final_path = upload_dir / "final" / arquivo_final_nome
+    gdf = gpd.read_file(final_path)
+
+    if "quadra" not in gdf.columns:
+        raise ValueError("Coluna 'quadra' não encontrada no GPKG final.")
+
+    if saida_dir is None:
+        saida_dir = upload_dir / "memoriais" / "lotes"
+
+    return renderizar_memoriais_lotes(
+        gdf, saida_dir, nucleo=nucleo, municipio=municipio, uf=uf, promotor=promotor
+    )
@@ -0,0 +1,108 @@
+"""
+Barramento de progresso por job.
+
+Cada canal ("job-<id>", "qfield-<id>") é um arquivo JSON em PROGRESSO_DIR,
+substituído atomicamente a cada publicação. O worker publica sem tocar no
+banco e o endpoint SSE só acompanha o mtime do arquivo; canais de jobs
+diferentes não se misturam.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+PROGRESSO_INICIAL = {"etapa": 0, "mensagem": "Aguardando início"}
+
+_RE_CANAL = re.compile(r"^[a-z]+-[0-9A-Za-z_]{1,64}$")
+
+
+def canal_job(job_id) -> str:
+    return f"job-{job_id}"
+
+
+def canal_qfield(job_id) -> str:
+    return f"qfield-{job_id}"
+
+
+def _arquivo(canal: str) -> Path:
+    if not _RE_CANAL.match(canal or ""):
+        raise ValueError(f"Canal de progresso inválido: {canal!r}")
+    return Path(settings.PROGRESSO_DIR) / f"{canal}.json"
+
+
+def publicar(canal: str, etapa, mensagem: str, percentual: float = None, final: bool = False, **extra) -> dict:
+    """
+    Grava o estado atual do canal (substitui o anterior).
+    percentual é o avanço dentro da etapa (0–100); final encerra as assinaturas.
+    """
+    estado = {
+        "etapa": etapa,
+        "mensagem": mensagem,
+        "percentual": None if percentual is None else round(max(0.0, min(100.0, percentual)), 1),
+        "final": final,
+        "versao": time.time_ns(),
+        **extra,
+    }
+    destino = _arquivo(canal)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=destino.parent, prefix=f".{canal}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(tmp, destino)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+    print(f"📊 [{etapa}] {mensagem}" + (f" ({estado['percentual']:.0f}%)" if percentual is not None else ""))
+    return estado
+
+
+def ler(canal: str) -> dict | None:
+    """Último estado publicado no canal (None se nada foi publicado)."""
+    try:
+        return json.loads(_arquivo(canal).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def assinar(canal: str, desde: str = None, intervalo: float = 0.3, pulsacao: float = 5.0,
+            duracao: float = 25.0, ignorar_final_anterior: bool = False):
+    """
+    Gera cada novo estado do canal; gera None a cada `pulsacao` segundos sem
+    novidade (para keep-alive). Termina num estado final ou depois de `duracao`
+    segundos (o EventSource reconecta sozinho, mandando o último id em `desde`).
+    ignorar_final_anterior pula um estado final que já estava lá ao assinar.
+    """
+    caminho = _arquivo(canal)
+    ultima_versao = str(desde) if desde else None
+    ultimo_mtime = None
+    primeiro = True
+    inicio = ultimo_envio = time.monotonic()
+
+    while time.monotonic() - inicio < duracao:
+        try:
+            mtime = caminho.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is not None and mtime != ultimo_mtime:
+            ultimo_mtime = mtime
+            estado = ler(canal)
+            if estado and str(estado.get("versao")) != ultima_versao:
+                ultima_versao = str(estado.get("versao"))
+                if not (primeiro and ignorar_final_anterior and estado.get("final")):
+                    ultimo_envio = time.monotonic()
+                    yield estado
+                    if estado.get("final"):
+                        return
+        primeiro = False
+
+        if time.monotonic() - ultimo_envio >= pulsacao:
+            ultimo_envio = time.monotonic()
+            yield None
+        time.sleep(intervalo)
@@ -0,0 +1,367 @@
+"""
+Geração do project_cloud.qgs sem QGIS.
+
+O primeiro job de uma dada combinação de camadas (campos, tipo de geometria,
+CRS e ortofoto) ainda passa pelo create_final_project com QGIS; o .qgs
+resultante é capturado como template (string.Template) em
+settings.QGIS_TEMPLATES_DIR.
+Dali em diante o projeto é só renderizado: troca-se ids das camadas, extents,
+fonte da ortofoto e data de gravação. Nada de QgsApplication por job.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+from string import Template
+
+from django.conf import settings
+
+# Incrementar quando o pós-processamento do .qgs mudar (invalida os templates)
+VERSAO_TEMPLATE = 2
+
+NOME_PROJETO = "project_cloud.qgs"
+NOME_ORTOFOTO = "Ortofoto de Base"
+
+# (arquivo relativo ao job, grupo na árvore de camadas) — na ordem do projeto
+CAMADAS_PROJETO = [
+    ("final/final_gpkg.gpkg", "Lotes/Quadras - Polígonos"),
+    ("quadras/quadras_rotulo_pt.gpkg", "Quadras"),
+    ("ruas/ruas_osm_detalhadas.gpkg", "Ruas"),
+]
+
+# Campos que o projeto espera na camada de lotes (nome, tipo OGR)
+CAMPOS_LOTES = [
+    ("Nome", "String"),
+    ("Telefone", "String"),
+    ("Endereco", "String"),
+    ("Nº Casa", "Integer"),
+    ("STATUS", "String"),
+    ("quadra", "String"),
+    ("lote_num", "String"),
+]
+
+_TIPO_SQLITE = {"String": "TEXT", "Integer": "MEDIUMINT"}
+_RE_ID = re.compile(r"^(.*)_[0-9a-f]{8}(?:_[0-9a-f]{4}){3}_[0-9a-f]{12}$")
+_EXTENT = ("xmin", "ymin", "xmax", "ymax")
+
+
+# ==================== DADOS DAS CAMADAS ====================
+def garantir_campos_gpkg(gpkg_path: Path, campos=CAMPOS_LOTES):
+    """
+    Cria (via sqlite) os campos ausentes na tabela de feições do GeoPackage.
+    Etapa própria do pipeline, antes do projeto: os campos do formulário
+    fazem parte da assinatura do template.
+    """
+    con = sqlite3.connect(gpkg_path)
+    try:
+        tabela = con.execute(
+            "SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1"
+        ).fetchone()[0]
+        existentes = {r[1].lower() for r in con.execute(f'PRAGMA table_info("{tabela}")')}
+        for nome, tipo in campos:
+            if nome.lower() not in existentes:
+                print(f"➕ Criando campo ausente: {nome}")
+                con.execute(f'ALTER TABLE "{tabela}" ADD COLUMN "{nome}" {_TIPO_SQLITE[tipo]}')
+        con.commit()
+    finally:
+        con.close()
+
+
+def _info_vetor(caminho: Path) -> dict:
+    from pyogrio import read_info
+
+    info = read_info(caminho, force_total_bounds=True)
+    return {
+        "geometria": info["geometry_type"],
+        "campos": [str(c) for c in info["fields"]],
+        "extent": [float(v) for v in info["total_bounds"]],
+    }
+
+
+def _abrir_raster(caminho: Path, overview: int | None = None):
+    from osgeo import gdal
+
+    gdal.UseExceptions()
+    opcoes = [f"OVERVIEW_LEVEL={overview}"] if overview is not None else []
+    return gdal.OpenEx(str(caminho), gdal.OF_RASTER, open_options=opcoes)
+
+
+def _info_raster(caminho: Path) -> dict:
+    from osgeo import gdal
+
+    ds = _abrir_raster(caminho)
+    x0, dx, rx, y0, ry, dy = ds.GetGeoTransform()
+    cantos = [(x0 + c * dx + l * rx, y0 + c * ry + l * dy)
+              for c in (0, ds.RasterXSize) for l in (0, ds.RasterYSize)]
+    xs = [c[0] for c in cantos]
+    ys = [c[1] for c in cantos]
+    banda = ds.GetRasterBand(1) if ds.RasterCount else None
+    return {
+        "bandas": ds.RasterCount,
+        "tipo": gdal.GetDataTypeName(banda.DataType) if banda else "",
+        "overviews": banda.GetOverviewCount() if banda else 0,
+        "extent": [min(xs), min(ys), max(xs), max(ys)],
+    }
+
+
+def _limites_bandas(caminho: Path, overviews: int, corte: tuple) -> dict:
+    """
+    Min/max de realce por banda a partir do histograma padrão do GDAL
+    (no menor overview, como a amostragem "Estimated" do QGIS).
+    corte=None → MinMax; corte=(inf, sup) → CumulativeCut.
+    """
+    ds = _abrir_raster(caminho, overviews - 1 if overviews else None)
+    limites = {}
+    for numero in range(1, ds.RasterCount + 1):
+        hist_min, hist_max, contagem, baldes = ds.GetRasterBand(numero).GetDefaultHistogram(force=True)
+        if not baldes or not sum(baldes):
+            continue
+        largura = (hist_max - hist_min) / contagem
+        centro = lambda i: hist_min + (i + 0.5) * largura
+        total = sum(baldes)
+        acum = 0
+        ocupados = [i for i, b in enumerate(baldes) if b]
+        lo, hi = ocupados[0], ocupados[-1]
+        if corte:
+            lo = hi = None
+            for i, b in enumerate(baldes):
+                acum += b
+                if lo is None and acum >= corte[0] * total:
+                    lo = i
+                if hi is None and acum >= corte[1] * total:
+                    hi = i
+        limites[numero] = (centro(lo), centro(hi))
+    return limites
+
+
+def _wgs84(extent, crs):
+    from pyproj import Transformer
+
+    t = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+    return list(t.transform_bounds(*extent))
+
+
+def _levantar_camadas(base_dir: Path, ortho_path: Path | None) -> list:
+    """Camadas presentes no job, na ordem do projeto, com esquema e extent."""
+    camadas = []
+    for rel_path, grupo in CAMADAS_PROJETO:
+        caminho = base_dir / rel_path
+        if not caminho.exists():
+            continue
+        camadas.append({"nome": caminho.stem, "fonte": rel_path, "tipo": "vector", **_info_vetor(caminho)})
+    if ortho_path and ortho_path.exists():
+        camadas.append({"nome": NOME_ORTOFOTO, "fonte": str(ortho_path), "tipo": "raster", **_info_raster(ortho_path)})
+    return camadas
+
+
+def _chave_template(camadas: list, crs: str) -> str:
+    assinatura = [VERSAO_TEMPLATE, crs]
+    for c in camadas:
+        if c["tipo"] == "vector":
+            assinatura.append([c["fonte"], c["geometria"], c["campos"]])
+        else:
+            assinatura.append([c["nome"], c["bandas"], c["tipo"]])
+    return hashlib.sha1(json.dumps(assinatura, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _fontes_ortofoto(ortho_path: Path, project_path: Path):
+    """Como o QGIS grava a fonte da ortofoto: absoluta e relativa ao projeto."""
+    absoluta = str(ortho_path.resolve()).replace("\\", "/")
+    relativa = os.path.relpath(ortho_path.resolve(), project_path.resolve().parent).replace("\\", "/")
+    if not relativa.startswith("."):
+        relativa = "./" + relativa
+    return absoluta, relativa
+
+
+def _separar_doctype(texto: str):
+    if texto.lstrip().startswith("<!DOCTYPE"):
+        nl = texto.find("\n")
+        return texto[:nl], texto[nl + 1:]
+    return "", texto
+
+
+# ==================== CAPTURA ====================
+def capturar_template(base_dir: Path, ortho_path: Path = None, crs="EPSG:31983", dir_templates=None):
+    """
+    Converte o project_cloud.qgs gerado pelo QGIS para este job em template
+    reutilizável. Valores que mudam de job para job viram placeholders.
+    """
+    project_path = base_dir / NOME_PROJETO
+    dir_templates = Path(dir_templates or settings.QGIS_TEMPLATES_DIR)
+    camadas = _levantar_camadas(base_dir, ortho_path)
+    chave = _chave_template(camadas, crs)
+
+    doctype, xml_str = _separar_doctype(project_path.read_text(encoding="utf-8"))
+    root = ET.fromstring(xml_str.replace("$", "$$"))
+
+    ids = {}
+    realces = {}
+    por_nome = {c["nome"]: i for i, c in enumerate(camadas)}
+    projectlayers = root.find("projectlayers")
+    for ml in projectlayers.findall("maplayer") if projectlayers is not None else []:
+        i = por_nome.get(ml.findtext("layername") or "")
+        lid = ml.findtext("id") or ""
+        m = _RE_ID.match(lid)
+        if i is None or not m:
+            continue
+        camadas[i]["prefixo_id"] = m.group(1)
+        ids[lid] = f"${{camada_{i}_id}}"
+
+        for tag, sufixo in (("extent", ""), ("wgs84extent", "wgs_")):
+            ext = ml.find(tag)
+            if ext is None:
+                continue
+            for lado in _EXTENT:
+                el = ext.find(lado)
+                if el is not None:
+                    el.text = f"${{camada_{i}_{sufixo}{lado}}}"
+
+        if camadas[i]["tipo"] != "raster":
+            continue
+        ds = ml.find("datasource")
+        if ds is not None and ds.text:
+            ds.text = ds.text.replace(Path(ds.text).name, "${ortho_arquivo}")
+        realces[i] = _capturar_realce(ml, i)
+
+    # Extent do mapa: união das camadas
+    canvas_ext = root.find("mapcanvas/extent")
+    if canvas_ext is not None:
+        for lado in _EXTENT:
+            el = canvas_ext.find(lado)
+            if el is not None:
+                el.text = f"${{{lado}}}"
+    vista = root.find("ProjectViewSettings/DefaultViewExtent")
+    if vista is not None:
+        for lado in _EXTENT:
+            if lado in vista.attrib:
+                vista.set(lado, f"${{{lado}}}")
+
+    if "saveDateTime" in root.attrib:
+        root.set("saveDateTime", "${salvo_em}")
+    criacao = root.find("projectMetadata/creation")
+    if criacao is not None:
+        criacao.text = "${criado_em}"
+
+    texto = ET.tostring(root, encoding="unicode")
+    for lid, marcador in ids.items():
+        texto = texto.replace(lid, marcador)
+    if ortho_path:
+        absoluta, relativa = _fontes_ortofoto(ortho_path, project_path)
+        texto = texto.replace(absoluta, "${ortho_absoluta}").replace(relativa, "${ortho_relativa}")
+    texto = texto.replace(str(base_dir.resolve()).replace("\\", "/"), "${base_dir}")
+    if doctype:
+        texto = doctype.replace("$", "$$") + "\n" + texto
+
+    manifesto = {
+        "versao": VERSAO_TEMPLATE,
+        "crs": crs,
+        "camadas": [
+            {k: c[k] for k in ("nome", "tipo", "prefixo_id") if k in c} | {"realce": realces.get(i)}
+            for i, c in enumerate(camadas)
+        ],
+    }
+    dir_templates.mkdir(parents=True, exist_ok=True)
+    destino = dir_templates / f"{chave}.qgs.tpl"
+    _gravar_atomico(destino, texto)
+    _gravar_atomico(dir_templates / f"{chave}.json", json.dumps(manifesto, ensure_ascii=False, indent=2))
+    print(f"📐 Template de projeto capturado: {destino.name}")
+    return destino
+
+
+def _capturar_realce(ml, i):
+    """Placeholders para o min/max de realce de contraste das bandas da ortofoto."""
+    rr = ml.find("pipe/rasterrenderer")
+    if rr is None:
+        return None
+    origem = rr.find("minMaxOrigin")
+    limites = origem.findtext("limits") if origem is not None else None
+    if limites == "CumulativeCut":
+        corte = [float(origem.findtext("cumulativeCutLower")), float(origem.findtext("cumulativeCutUpper"))]
+    elif limites == "MinMax":
+        corte = None
+    else:
+        return None
+
+    bandas = []
+    for prefixo in ("red", "green", "blue", "gray"):
+        tag = "contrastEnhancement" if prefixo == "gray" else f"{prefixo}ContrastEnhancement"
+        realce = rr.find(tag)
+        banda = rr.get(f"{prefixo}Band")
+        if realce is None or banda is None:
+            continue
+        for tag, lado in (("minValue", "min"), ("maxValue", "max")):
+            el = realce.find(tag)
+            if el is not None:
+                el.text = f"${{camada_{i}_banda_{banda}_{lado}}}"
+        bandas.append(int(banda))
+    return {"corte": corte, "bandas": bandas}
+
+
+def _gravar_atomico(destino: Path, texto: str):
+    tmp = destino.with_name(f".{destino.name}.{os.getpid()}.tmp")
+    tmp.write_text(texto, encoding="utf-8")
+    os.replace(tmp, destino)
+
+
+# ==================== RENDERIZAÇÃO ====================
+def _novo_id(prefixo: str) -> str:
+    return f"{prefixo}_{uuid.uuid4()}".replace("-", "_")
+
+
+def renderizar_projeto(base_dir: Path, ortho_path: Path = None, crs="EPSG:31983", dir_templates=None):
+    """
+    Gera base_dir/project_cloud.qgs a partir do template desta combinação de
+    camadas. Retorna o caminho, ou None se ainda não houver template.
+    """
+    dir_templates = Path(dir_templates or settings.QGIS_TEMPLATES_DIR)
+    camadas = _levantar_camadas(base_dir, ortho_path)
+    chave = _chave_template(camadas, crs)
+    tpl_path = dir_templates / f"{chave}.qgs.tpl"
+    man_path = dir_templates / f"{chave}.json"
+    if not tpl_path.exists() or not man_path.exists():
+        return None
+
+    manifesto = json.loads(man_path.read_text(encoding="utf-8"))
+    project_path = base_dir / NOME_PROJETO
+    agora = datetime.now()
+    valores = {
+        "salvo_em": agora.isoformat(timespec="seconds"),
+        "criado_em": agora.isoformat(timespec="seconds"),
+        "base_dir": str(base_dir.resolve()).replace("\\", "/"),
+    }
+
+    uniao = None
+    for i, (c, m) in enumerate(zip(camadas, manifesto["camadas"])):
+        ext = c["extent"]
+        uniao = ext if uniao is None else [
+            min(uniao[0], ext[0]), min(uniao[1], ext[1]), max(uniao[2], ext[2]), max(uniao[3], ext[3])
+        ]
+        valores[f"camada_{i}_id"] = _novo_id(m.get("prefixo_id", c["nome"].replace(" ", "_")))
+        for lado, v, w in zip(_EXTENT, ext, _wgs84(ext, crs)):
+            valores[f"camada_{i}_{lado}"] = repr(v)
+            valores[f"camada_{i}_wgs_{lado}"] = repr(w)
+
+        if c["tipo"] == "raster":
+            valores["ortho_arquivo"] = ortho_path.name
+            valores["ortho_absoluta"], valores["ortho_relativa"] = _fontes_ortofoto(ortho_path, project_path)
+            realce = m.get("realce")
+            if realce:
+                corte = tuple(realce["corte"]) if realce["corte"] else None
+                limites = _limites_bandas(ortho_path, c["overviews"], corte)
+                for banda in realce["bandas"]:
+                    lo, hi = limites.get(banda, (0, 255))
+                    valores[f"camada_{i}_banda_{banda}_min"] = repr(lo)
+                    valores[f"camada_{i}_banda_{banda}_max"] = repr(hi)
+
+    if uniao is not None:
+        valores.update(dict(zip(_EXTENT, map(repr, uniao))))
+
+    texto = Template(tpl_path.read_text(encoding="utf-8")).substitute(valores)
+    project_path.write_text(texto, encoding="utf-8")
+    print(f"🎉 Projeto gerado do template {tpl_path.name} em {project_path}")
+    return project_path
@@ -46,7 +46,10 @@ def setup_qgis_env():
 
 
 def init_qgis():
-    """Inicializa o QGIS após o ambiente estar configurado"""
+    """
+    Inicializa o QGIS e o Processing uma única vez por processo.
+    Chamadas seguintes devolvem a mesma instância (custo ~zero por job).
+    """
     try:
         from qgis.core import QgsApplication
     except ImportError as e:
@@ -54,10 +57,21 @@ def init_qgis():
         print("Verifique se setup_qgis_env() foi chamado ANTES do Django iniciar.")
         raise
 
-    QgsApplication.setPrefixPath(os.environ["QGIS_PREFIX_PATH"], True)
+    qgs = QgsApplication.instance()
+    if qgs is not None:
+        return qgs
+
+    if os.environ.get("QGIS_PREFIX_PATH"):
+        QgsApplication.setPrefixPath(os.environ["QGIS_PREFIX_PATH"], True)
     qgs = QgsApplication([], False)
     qgs.initQgis()
 
+    from qgis.analysis import QgsNativeAlgorithms
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    if not any(isinstance(p, QgsNativeAlgorithms) for p in QgsApplication.processingRegistry().providers()):
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+
     print("✅ QGIS inicializado com sucesso!")
 
     @atexit.register
@@ -65,3 +79,12 @@ def init_qgis():
         QgsApplication.exitQgis()
 
     return qgs
+
+
+def resetar_estado_qgis():
+    """Limpa o que um job pode ter deixado no processo antes do próximo."""
+    from qgis.core import QgsProject
+
+    projeto = QgsProject.instance()
+    projeto.removeAllMapLayers()
+    projeto.clear()
@@ -11,8 +11,10 @@ const resetBtn = document.getElementById("resetBtn");
 const viewBtn = document.getElementById("viewBtn");
 const btnExportQField = document.getElementById("btnExportQField");
 const btnBaixarEnviar = document.getElementById("btnBaixarEnviar");
+const btnMemoriais = document.getElementById("btnMemoriais");
 const toast = document.getElementById("toast");
 let projetoPath = null;
+let fonteProgresso = null;
 
 let selectedDXF = null;
 let selectedOrtho = null;
@@ -59,7 +61,9 @@ function checkReadyToStart() {
   // DEBUG: Loga o estado das variáveis
   console.log(`[DEBUG] Verificando: DXF=${!!selectedDXF}, Ortho=${!!selectedOrtho}`);
 
-  if (selectedDXF && selectedOrtho) {
+  // um .zip pode trazer o DXF e a ortofoto juntos
+  const pacoteZip = selectedDXF && /\.zip$/i.test(selectedDXF.name);
+  if (selectedDXF && (selectedOrtho || pacoteZip)) {
     // DEBUG: Condição atendida
     console.log("[DEBUG] ✅ Ambos selecionados! Mostrando botão E ÁREA.");
     progressArea.style.display = "grid"; // <-- ❗ AQUI ESTÁ A CORREÇÃO
@@ -141,7 +145,144 @@ function getCSRFToken() {
 // ---------------------------------------------------------
 // 🔹 Envio de arquivos
 // ---------------------------------------------------------
+const TAMANHO_PARTE = 8 * 1024 * 1024;
+const TENTATIVAS_PARTE = 8;
+
+function hexDe(buffer) {
+  return Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+function base64De(buffer) {
+  return btoa(String.fromCharCode(...new Uint8Array(buffer)));
+}
+
+// sha256 de cada parte e a soma do arquivo (sha256 das somas concatenadas), que o servidor confere no fim
+async function somasDoArquivo(arquivo) {
+  const partes = [];
+  for (let inicio = 0; inicio < arquivo.size; inicio += TAMANHO_PARTE) {
+    const dados = await arquivo.slice(inicio, inicio + TAMANHO_PARTE).arrayBuffer();
+    partes.push(await crypto.subtle.digest("SHA-256", dados));
+  }
+  const juntas = new Uint8Array(partes.length * 32);
+  partes.forEach((parte, i) => juntas.set(new Uint8Array(parte), i * 32));
+  return { partes, soma: hexDe(await crypto.subtle.digest("SHA-256", juntas)) };
+}
+
+// Manda as partes a partir do offset do servidor; queda de rede ou 5xx espera e retoma de onde parou
+async function enviarEmPartes(arquivo, upload, partes, aoProgredir) {
+  let offset = upload.offset || 0;
+  let tentativa = 0;
+  let resultado = {};
+  while (offset < arquivo.size) {
+    let res = null;
+    let data = {};
+    try {
+      res = await fetch(`/uploads/${upload.id}/`, {
+        method: "PATCH",
+        headers: {
+          "X-CSRFToken": getCSRFToken(),
+          "Content-Type": "application/offset+octet-stream",
+          "Upload-Offset": String(offset),
+          "Upload-Checksum": "sha256 " + base64De(partes[Math.floor(offset / TAMANHO_PARTE)])
+        },
+        body: arquivo.slice(offset, offset + TAMANHO_PARTE),
+        credentials: "include"
+      });
+      data = await res.json();
+    } catch (err) {
+      console.warn("[DEBUG] Parte não enviada:", err);
+      res = null;
+    }
+
+    if (res && res.ok) {
+      offset = data.offset;
+      tentativa = 0;
+      resultado = data;
+      aoProgredir(offset);
+      continue;
+    }
+    if (res && res.status < 500 && res.status !== 409 && res.status !== 460) {
+      throw new Error(data.mensagem || "Falha no envio.");
+    }
+    if (++tentativa > TENTATIVAS_PARTE) throw new Error("Conexão instável demais; tente de novo.");
+    if (res && data.offset != null) {
+      offset = data.offset;  // 409/460: segue da posição que o servidor confirmou
+      continue;
+    }
+    await new Promise(r => setTimeout(r, Math.min(30000, 1000 * 2 ** tentativa)));
+    try {
+      const situacao = await fetch(`/uploads/${upload.id}/`, { credentials: "include" });
+      if (situacao.ok) offset = (await situacao.json()).offset;
+    } catch (err) {
+      console.warn("[DEBUG] Servidor ainda inacessível:", err);
+    }
+  }
+  return resultado;
+}
+
+// Upload em partes: o processamento começa quando o DXF termina; a ortofoto continua subindo
 async function enviarArquivosParaServidor() {
+  if (!selectedDXF) {
+    showToast("❌ Selecione ao menos o arquivo DXF!");
+    return false;
+  }
+  // crypto.subtle só existe em HTTPS/localhost; fora disso vai tudo num POST só
+  if (!window.crypto || !crypto.subtle) return enviarArquivosFormulario();
+
+  showToast("⏳ Preparando o envio...");
+  setLoading(startBtn, "Enviando...");
+  const detailLine = document.getElementById("detailLine");
+
+  try {
+    const somasDXF = await somasDoArquivo(selectedDXF);
+    const somasOrtho = selectedOrtho ? await somasDoArquivo(selectedOrtho) : null;
+    const descrever = (arquivo, somas) => ({
+      nome: arquivo.name, tamanho: arquivo.size, tamanho_parte: TAMANHO_PARTE, soma: somas.soma
+    });
+
+    const res = await fetch("/uploads/", {
+      method: "POST",
+      headers: { "X-CSRFToken": getCSRFToken(), "Content-Type": "application/json" },
+      body: JSON.stringify({
+        arquivo: descrever(selectedDXF, somasDXF),
+        ortofoto: selectedOrtho ? descrever(selectedOrtho, somasOrtho) : null
+      }),
+      credentials: "include"
+    });
+    const data = await res.json();
+    if (data.status !== "sucesso") {
+      showToast("❌ " + data.mensagem);
+      clearLoading(startBtn);
+      return false;
+    }
+
+    const fim = await enviarEmPartes(selectedDXF, data.uploads.arquivo, somasDXF.partes, offset => {
+      detailLine.textContent = `⬆️ Enviando DXF: ${Math.round(100 * offset / selectedDXF.size)}%`;
+    });
+    projetoPath = fim.projeto_path;
+
+    if (selectedOrtho) {
+      const ortofoto = selectedOrtho;
+      enviarEmPartes(ortofoto, data.uploads.ortofoto, somasOrtho.partes, offset => {
+        console.log(`[DEBUG] Ortofoto: ${Math.round(100 * offset / ortofoto.size)}%`);
+      })
+        .then(() => showToast("✅ Ortofoto recebida pelo servidor."))
+        .catch(err => {
+          console.error(err);
+          showToast("⚠️ Falha ao enviar a ortofoto: " + err.message);
+        });
+    }
+    return true;
+  } catch (err) {
+    console.error(err);
+    showToast("❌ " + (err.message || "Erro inesperado durante o envio."));
+    clearLoading(startBtn);
+    return false;
+  }
+}
+
+// Envio antigo, num POST multipart só
+async function enviarArquivosFormulario() {
   if (!selectedDXF) {
     showToast("❌ Selecione ao menos o arquivo DXF!");
     return false;
@@ -185,65 +326,113 @@ async function enviarArquivosParaServidor() {
 // ---------------------------------------------------------
 // 🔹 Monitora progresso geral
 // ---------------------------------------------------------
-async function monitorarProgresso() {
-  const barFill = document.getElementById("barFill");
-  const stageTitle = document.getElementById("stageTitle");
-  const percentLabel = document.getElementById("percentLabel");
-  const detailLine = document.getElementById("detailLine");
-  const stageChip = document.getElementById("stageChip");
-
-  const etapasTotal = 17;
-  monitoramentoAtivo = true;
+function monitorarProgresso() {
+  const barFill = document.getElementById("barFill");
+  const stageTitle = document.getElementById("stageTitle");
+  const percentLabel = document.getElementById("percentLabel");
+  const detailLine = document.getElementById("detailLine");
+  const stageChip = document.getElementById("stageChip");
+
+  const etapasTotal = 17;
+  monitoramentoAtivo = true;
+
+  // Progresso empurrado pelo servidor (SSE); o navegador reconecta sozinho
+  if (fonteProgresso) fonteProgresso.close();
+  const fonte = new EventSource("/progresso/eventos/");
+  fonteProgresso = fonte;
+
+  function encerrar() {
+    monitoramentoAtivo = false;
+    fonte.close();
+    document.getElementById("cancelarBtn")?.remove();
+  }
+  exibirBotaoCancelar();
+
+  // Ainda na fila dos workers QGIS: mostra a posição
+  fonte.addEventListener("fila", (ev) => {
+    const job = JSON.parse(ev.data);
+    const mensagem = `⏳ Na fila de processamento (${job.na_frente} à frente)`;
+    stageTitle.textContent = mensagem;
+    detailLine.textContent = mensagem;
+  });
+
+  fonte.addEventListener("progresso", (ev) => {
+    if (!monitoramentoAtivo) return encerrar();
+    const data = JSON.parse(ev.data);
+
+    const etapa = data.etapa || 0;
+    const mensagem = data.mensagem || "Aguardando...";
+    // percentual = avanço dentro da etapa atual, quando a etapa informa
+    const fracao = data.percentual != null ? data.percentual / 100 : 0;
+    const porcentagem = Math.min(((Math.max(etapa - 1, 0) + fracao) / etapasTotal) * 100, 100);
+
+    if (etapa < 98) {
+      barFill.style.width = `${porcentagem}%`;
+      percentLabel.textContent = `${Math.round(porcentagem)}%`;
+      stageChip.textContent = `Etapa ${Math.min(Math.floor(etapa), etapasTotal)} de ${etapasTotal}`;
+    }
+    stageTitle.textContent = mensagem;
+    // detalhe: avanço da etapa, tempo decorrido e a última linha de log do algoritmo
+    const detalhes = [];
+    if (data.percentual != null) detalhes.push(`${Math.round(data.percentual)}%`);
+    if (data.decorrido != null) detalhes.push(`${Math.round(data.decorrido)} s`);
+    if (data.log && data.log.length) detalhes.push(data.log[data.log.length - 1]);
+    detailLine.textContent = detalhes.length ? `${mensagem} — ${detalhes.join(" · ")}` : mensagem;
+
+    if (etapa === 98) {
+      encerrar();
+      showToast("⚠️ Falha ao buscar ruas no OpenStreetMap.");
+      exibirBotaoRetryOverpass();
+    } else if (etapa === 99) {
+      encerrar();
+      showToast(data.etapa_interrompida != null || mensagem.startsWith("🛑") ? mensagem : "❌ Ocorreu um erro no backend!");
+      finalizarInterface(true);
+    } else if (etapa >= etapasTotal) {
+      encerrar();
+      barFill.style.width = "100%";
+      percentLabel.textContent = "100%";
+      showToast("✅ Projeto criado com sucesso!");
+      finalizarInterface();
+    }
+  });
 
-  async function atualizar() {
-    if (!monitoramentoAtivo) return;
+  fonte.onerror = () => {
+    console.warn("Conexão de progresso interrompida; reconectando...");
+  };
+}
 
-    try {
-      // Adicionando cache-busting para garantir que não haja cache
-      const cacheBuster = new Date().getTime();
-      const res = await fetch(`/progresso/?v=${cacheBuster}`, {
-        cache: "no-store",
-        headers: { "Cache-Control": "no-store", "Pragma": "no-cache" }
-      });
-      const data = await res.json();
+// ---------------------------------------------------------
+// 🔹 Cancelar processamento
+// ---------------------------------------------------------
+function exibirBotaoCancelar() {
+  const footer = document.querySelector(".footer");
+  if (document.getElementById("cancelarBtn")) return;
 
-      const etapa = data.etapa || 0;
-      const mensagem = data.mensagem || "Aguardando...";
-      const porcentagem = Math.min((etapa / etapasTotal) * 100, 100);
-
-      // Atualiza UI
-      barFill.style.width = `${porcentagem}%`;
-      percentLabel.textContent = `${Math.round(porcentagem)}%`;
-      stageTitle.textContent = mensagem;
-      detailLine.textContent = mensagem;
-      stageChip.textContent = `Etapa ${Math.min(etapa, etapasTotal)} de ${etapasTotal}`;
-
-      if (etapa === 98) {
-        showToast("⚠️ Falha ao buscar ruas no OpenStreetMap.");
-        exibirBotaoRetryOverpass();
-        monitoramentoAtivo = false;
-        return;
-      }
+  const cancelarBtn = document.createElement("button");
+  cancelarBtn.id = "cancelarBtn";
+  cancelarBtn.className = "btn ghost";
+  cancelarBtn.textContent = "🛑 Cancelar";
 
-      if (etapa < etapasTotal && etapa !== 99) {
-        setTimeout(atualizar, 700);
-      } else if (etapa >= etapasTotal) {
-        barFill.style.width = "100%";
-        percentLabel.textContent = "100%";
-        showToast("✅ Projeto criado com sucesso!");
-        monitoramentoAtivo = false;
-        finalizarInterface();
-      } else if (etapa === 99) {
-        showToast("❌ Ocorreu um erro no backend!");
-        monitoramentoAtivo = false;
-        finalizarInterface(true);
-      }
-    } catch (e) {
-      console.error("Erro ao obter progresso:", e);
-    }
-  }
+  cancelarBtn.onclick = async () => {
+    setLoading(cancelarBtn, "Cancelando...");
+    try {
+      const res = await fetch("/cancelar/", {
+        method: "POST",
+        headers: { "X-CSRFToken": getCSRFToken() },
+        credentials: "include"
+      });
+      const data = await res.json();
+      // o fim chega pelo canal de progresso (etapa 99)
+      showToast(data.mensagem || "🛑 Cancelamento solicitado.");
+      if (data.status !== "sucesso") clearLoading(cancelarBtn);
+    } catch (err) {
+      console.error(err);
+      showToast("❌ Erro ao comunicar com o servidor para cancelar.");
+      clearLoading(cancelarBtn);
+    }
+  };
 
-  atualizar();
+  footer.appendChild(cancelarBtn);
 }
 
 // ---------------------------------------------------------
@@ -270,7 +459,7 @@ function exibirBotaoRetryOverpass() {
       const data = await res.json();
 
       if (data.status === "sucesso") {
-        showToast("✅ Ruas extraídas com sucesso! Continuando...");
+        showToast("🔁 Nova busca de ruas enfileirada. Continuando...");
         retryBtn.remove();
         monitorarProgresso();
       } else {
@@ -298,6 +487,7 @@ function finalizarInterface(erro = false) {
     viewBtn.style.display = "inline-flex";
     btnBaixarEnviar.style.display = "inline-flex";
     btnExportQField.style.display = "inline-flex";
+    btnMemoriais.style.display = "inline-flex";
     resetBtn.style.display = "inline-flex";
   } else {
     resetBtn.style.display = "inline-flex";
@@ -366,55 +556,39 @@ window.addEventListener("load", async () => {
   viewBtn.style.display = "none";
   btnExportQField.style.display = "none";
   btnBaixarEnviar.style.display = "none";
+  btnMemoriais.style.display = "none";
   
   // Esta chamada agora cuida de esconder o startBtn E a progressArea
   checkReadyToStart(); 
 });
 
-async function monitorarProgressoQField() {
+function monitorarProgressoQField() {
   console.log("[DEBUG] Monitoramento de envio QField iniciado...");
-  let tentativasSemResposta = 0;
-  const maxTentativas = 10; // evita loop infinito se backend parar de responder
-
-  const interval = setInterval(async () => {
-    try {
-      const cacheBuster = new Date().getTime();
-      const res = await fetch(`/progresso_qfield/?v=${cacheBuster}`, {
-        cache: "no-store",
-        headers: { "Cache-Control": "no-store", "Pragma": "no-cache" },
-        credentials: "include"
-      });
-
-      if (!res.ok) {
-        console.warn("[DEBUG] Falha na requisição de progresso:", res.status);
-        tentativasSemResposta++;
-        if (tentativasSemResposta >= maxTentativas) {
-          clearInterval(interval);
-          showToast("⚠️ Falha ao obter progresso do QField Cloud.");
-        }
-        return;
-      }
-
-      const data = await res.json();
-      if (data.mensagem) {
-        console.log(`[QField] ${data.mensagem}`);
-        showToast(data.mensagem);
-      }
-
-      if (data.mensagem?.includes("✅ Upload concluído")) {
-        clearInterval(interval);
-        showToast("✅ Upload completo no QField Cloud!");
-        clearLoading(btnExportQField);
-        console.log("[DEBUG] Monitoramento QField encerrado com sucesso.");
-      }
+  const fonte = new EventSource("/progresso_qfield/eventos/");
+  let ultimaMensagem = "";
+
+  fonte.addEventListener("progresso", (ev) => {
+    const data = JSON.parse(ev.data);
+    // o percentual chega várias vezes por segundo; o toast só muda com a mensagem
+    if (data.mensagem && data.mensagem !== ultimaMensagem && !data.final) {
+      ultimaMensagem = data.mensagem;
+      const pct = data.percentual != null ? ` — ${Math.round(data.percentual)}%` : "";
+      console.log(`[QField] ${data.mensagem}${pct}`);
+      showToast(data.mensagem);
+    }
 
-    } catch (err) {
-      console.error("[DEBUG] Erro no monitoramento QField:", err);
-      clearInterval(interval);
+    if (data.final) {
+      fonte.close();
+      showToast(data.mensagem || "✅ Upload completo no QField Cloud!");
       clearLoading(btnExportQField);
-      showToast("❌ Erro ao monitorar progresso do QField.");
+      console.log("[DEBUG] Monitoramento QField encerrado com sucesso.");
     }
-  }, 1500); // intervalo levemente maior para evitar sobrecarga no servidor
+  });
+
+  fonte.onerror = () => {
+    console.warn("[DEBUG] Conexão de progresso do QField interrompida; reconectando...");
+  };
+  return fonte;
 }
 
 btnExportQField.addEventListener("click", async () => {
@@ -426,9 +600,10 @@ btnExportQField.addEventListener("click", async () => {
   setLoading(btnExportQField, "Enviando...");
   showToast("⏳ Enviando projeto para QField Cloud...");
 
+  // inicia monitoramento em paralelo
+  const fonteQField = monitorarProgressoQField();
+
   try {
-    // inicia monitoramento em paralelo
-    monitorarProgressoQField();
 
     const res = await fetch("/exportar-qfield/", {
       method: "POST",
@@ -443,11 +618,13 @@ btnExportQField.addEventListener("click", async () => {
     const data = await res.json();
 
     if (data.status === "sucesso") {
-      showToast("✅ Exportação iniciada no servidor!");
+      showToast("✅ Envio ao QField Cloud enfileirado!");
     } else {
+      fonteQField.close();
       showToast("❌ Falha ao exportar: " + (data.mensagem || "Erro desconhecido."));
     }
   } catch (err) {
+    fonteQField.close();
     console.error("[DEBUG] Erro de conexão ao exportar:", err);
     showToast("❌ Erro de conexão ao exportar para QField.");
   } finally {
@@ -505,13 +682,15 @@ btnBaixarEnviar.addEventListener("click", async () => {
   setLoading(btnBaixarEnviar, "Processando...");
   showToast("⏳ Gerando pacote e enviando para QField Cloud...");
 
+  // Dispara o monitoramento de progresso do upload
+  const fonteQField = monitorarProgressoQField();
+
   try {
-    // Dispara o monitoramento de progresso do upload
-    monitorarProgressoQField();
 
     // Faz a requisição ao endpoint combinado
     const response = await fetch("/baixar_e_enviar_qfieldcloud/", {
-      method: "GET",
+      method: "POST",
+      headers: { "X-CSRFToken": getCSRFToken() },
       credentials: "include"
     });
 
@@ -528,11 +707,21 @@ btnBaixarEnviar.addEventListener("click", async () => {
     a.remove();
     window.URL.revokeObjectURL(url);
 
-    showToast("✅ Projeto baixado e enviado para o QField Cloud com sucesso!");
+    // o envio segue no worker; o monitoramento fecha sozinho no evento final
+    showToast("✅ Projeto baixado! Envio para o QField Cloud em andamento...");
   } catch (err) {
+    fonteQField.close();
     console.error("[DEBUG] Erro ao baixar e enviar:", err);
     showToast("❌ Falha ao executar a operação combinada.");
   } finally {
     clearLoading(btnBaixarEnviar);
   }
 });
+
+// ---------------------------------------------------------
+// 🔹 Memoriais: download direto (o navegador grava o ZIP conforme chega)
+// ---------------------------------------------------------
+btnMemoriais.addEventListener("click", () => {
+  showToast("📄 Gerando memoriais... o download começa em instantes.");
+  window.location.href = "/memoriais/download/";
+});
@@ -0,0 +1,338 @@
+"""
+Execução dos jobs no worker (manage.py qgis_worker).
+
+Este módulo puxa QGIS, Processing e geopandas; só os workers o importam,
+para que o processo web suba sem a pilha GIS.
+"""
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from qgis.core import QgsProcessingFeedback, QgsProcessingMultiStepFeedback, QgsVectorLayer
+
+from .criar_projeto_qgis import create_final_project
+from .descompactar import descompactar_arquivo
+from .jobs import JobInterrompido, limite_etapa, pedido_de_cancelamento
+from .metricas import MedidorEtapas
+from .models import UploadParcial
+from .progresso_bus import publicar
+from .projeto_template import garantir_campos_gpkg
+from .etapas import ProcessamentoCancelado
+from .medidas_lotes import calcular_medidas_azimutes, construir_adjacencia
+from .pipeline import (
+    dxf_to_shp, corrigir_e_snap, linhas_para_poligonos, dissolve_para_quadras,
+    singlepart_quadras, atribuir_letras_quadras, gerar_pontos_rotulo, join_lotes_quadras,
+    numerar_lotes, corrigir_geometrias, buffer_lotes, extrair_ruas_overpass,
+    converter_ecw_para_tif_reduzido, atribuir_ruas_e_esquinas_precision
+)
+
+
+class FeedbackJob(QgsProcessingFeedback):
+    """
+    Feedback de um job: repassa ao canal de progresso o percentual da etapa
+    atual, as últimas linhas de log dos algoritmos e o tempo de cada etapa.
+    As publicações de percentual/log são limitadas a uma a cada `intervalo` s.
+    Com vigiar(), uma thread cancela o feedback quando o usuário pede o
+    cancelamento do job ou a etapa passa do limite (QGIS_LIMITE_ETAPAS).
+    Com um medidor (metricas.MedidorEtapas), cada etapa também é medida.
+    """
+
+    def __init__(self, canal, job_id=None, medidor=None, intervalo=0.5, linhas_log=5):
+        super().__init__()
+        self.canal = canal
+        self.job_id = job_id
+        self.medidor = medidor
+        self.motivo = ""
+        self.intervalo = intervalo
+        self.log = deque(maxlen=linhas_log)
+        self.tempos = {}
+        self._etapa = None
+        self._mensagem = ""
+        self._inicio = time.monotonic()
+        self._inicio_epoch = time.time()
+        self._ultimo_envio = 0.0
+        self._parar = threading.Event()
+        self.progressChanged.connect(lambda _: self._publicar())
+
+    def etapa(self, etapa, mensagem, final=False, **extra):
+        """Fecha o tempo da etapa anterior e começa a próxima (percentual zerado)."""
+        agora = time.monotonic()
+        if self._etapa is not None:
+            self.tempos[str(self._etapa)] = round(agora - self._inicio, 2)
+            print(f"⏱️ Etapa {self._etapa}: {agora - self._inicio:.1f} s")
+        self._etapa, self._mensagem, self._inicio = etapa, mensagem, agora
+        self._inicio_epoch = time.time()
+        self._ultimo_envio = agora  # o setProgress(0) abaixo não republica
+        self.log.clear()
+        self.setProgress(0)
+        extra = {"tempos": self.tempos, **extra} if final else extra
+        if self.medidor is not None:
+            if final:
+                self.medidor.encerrar(self._status_final(etapa, extra))
+            else:
+                self.medidor.iniciar(etapa, mensagem)
+        publicar(self.canal, etapa, mensagem, final=final, inicio_etapa=self._inicio_epoch, **extra)
+
+    @staticmethod
+    def _status_final(etapa, extra):
+        if etapa == 98:
+            return "aguardando_ruas"
+        if etapa == 99:
+            return "cancelado" if "etapa_interrompida" in extra else "falhou"
+        return "concluido"
+
+    def contar(self, entrada=None, saida=None):
+        """Feições de entrada/saída da etapa atual, para as métricas."""
+        if self.medidor is not None:
+            self.medidor.contar(entrada, saida)
+
+    @property
+    def etapa_atual(self):
+        return self._etapa
+
+    def prazo_etapa(self):
+        """Instante (time.monotonic) em que a etapa atual estoura o limite, com 1 s de folga."""
+        return self._inicio + limite_etapa(self._etapa) - 1.0
+
+    def vigiar(self):
+        threading.Thread(target=self._vigiar, name=f"vigia-{self.canal}", daemon=True).start()
+
+    def encerrar(self):
+        self._parar.set()
+
+    def _vigiar(self):
+        while not self._parar.wait(self.intervalo):
+            if self.isCanceled() or self._etapa is None:
+                continue
+            if self.job_id and pedido_de_cancelamento(self.job_id):
+                self.motivo = "Cancelado pelo usuário."
+            elif time.monotonic() - self._inicio > limite_etapa(self._etapa):
+                self.motivo = f"Tempo esgotado na etapa {self._etapa} (limite {limite_etapa(self._etapa):.0f} s)."
+            else:
+                continue
+            print(f"🛑 {self.motivo}")
+            self.cancel()
+
+    def interrompido(self, **extra) -> JobInterrompido:
+        """Publica a parada (etapa 99) e devolve a exceção que o worker registra no Job."""
+        etapa, motivo = self._etapa, self.motivo or "Processamento cancelado."
+        self.etapa(99, f"🛑 {motivo}", final=True, etapa_interrompida=etapa, **extra)
+        return JobInterrompido(etapa, motivo)
+
+    def _publicar(self):
+        agora = time.monotonic()
+        if self._etapa is None or agora - self._ultimo_envio < self.intervalo:
+            return
+        self._ultimo_envio = agora
+        publicar(self.canal, self._etapa, self._mensagem, percentual=self.progress(),
+                 decorrido=round(agora - self._inicio, 1), log=list(self.log), inicio_etapa=self._inicio_epoch)
+
+    def _registrar(self, texto):
+        self.log.append(texto.strip())
+        self._publicar()
+
+    def pushInfo(self, info):
+        super().pushInfo(info)
+        self._registrar(info)
+
+    def pushWarning(self, warning):
+        super().pushWarning(warning)
+        self._registrar(f"⚠️ {warning}")
+
+    def reportError(self, error, fatalError=False):
+        super().reportError(error, fatalError)
+        self._registrar(f"❌ {error}")
+
+
+def converter_ortofoto(ortho_path, feedback, etapa=2.5):
+    """Converte a ortofoto ECW para TIFF reduzido; devolve o caminho a usar daqui em diante."""
+    if ortho_path and ortho_path.suffix.lower() == ".ecw":
+        try:
+            feedback.etapa(etapa, "🧩 Convertendo ortofoto ECW para TIFF reduzido (pode demorar)...")
+            # ortho_path = converter_ecw_para_tif_reduzido(ortho_path, escala=96)
+            ortho_path = converter_ecw_para_tif_reduzido(ortho_path, escala=2)
+            print(f"✅ Ortofoto convertida automaticamente: {ortho_path.name}")
+        except Exception as e:
+            print(f"⚠️ Erro ao converter ECW: {e}")
+    return ortho_path
+
+def aguardar_ortofoto(upload_id, feedback, intervalo=1.0):
+    """
+    Etapa 13.5: espera o upload em partes da ortofoto terminar. Devolve o
+    caminho dela, ou None (o projeto segue sem ortofoto) se o upload falhou
+    ou ficou QGIS_UPLOAD_ESPERA_ORTOFOTO segundos sem receber partes.
+    """
+    feedback.etapa(13.5, "⏳ Aguardando o envio da ortofoto terminar...")
+    while True:
+        if feedback.isCanceled():
+            raise ProcessamentoCancelado("Processamento cancelado.")
+        upload = UploadParcial.objects.filter(pk=upload_id).first()
+        if upload is not None and upload.status == UploadParcial.Status.CONCLUIDO:
+            return Path(upload.destino)
+        if upload is None or upload.status == UploadParcial.Status.FALHOU:
+            print("⚠️ Upload da ortofoto falhou; seguindo sem ortofoto")
+            return None
+        if (timezone.now() - upload.atualizado_em).total_seconds() > settings.QGIS_UPLOAD_ESPERA_ORTOFOTO:
+            print("⚠️ Upload da ortofoto parado; seguindo sem ortofoto")
+            return None
+        feedback.setProgress(100 * upload.recebido / upload.tamanho)
+        time.sleep(intervalo)
+
+def extrair_ruas_ou_aguardar(quadras, upload_dir, ortho_path, feedback):
+    """
+    Baixa as ruas do Overpass. Se falhar, publica o canal como "aguardando_ruas"
+    (com a ortofoto já convertida) para o retry e retorna False.
+    """
+    try:
+        extrair_ruas_overpass(quadras, upload_dir, feedback, prazo=feedback.prazo_etapa())
+    except RuntimeError as e:
+        feedback.etapa(98, f"⚠️ Falha no Overpass API: {e}", final=True,
+                       aguardando_ruas=True, ortho_path=str(ortho_path) if ortho_path else None)
+        return False
+    return True
+
+def executar_pos_ruas(upload_dir, ortho_path, feedback):
+    """Etapas 15–17, comuns ao pipeline e ao retry do Overpass."""
+    feedback.etapa(15, "🏷️ Atribuindo ruas e detectando lotes de esquina...")
+    atribuir_ruas_e_esquinas_precision(upload_dir, feedback=feedback)
+
+    feedback.etapa(15.5, "📐 Calculando medidas, rumos e confrontantes dos lotes...")
+    passos = QgsProcessingMultiStepFeedback(2, feedback)
+    try:
+        construir_adjacencia(upload_dir, feedback=passos)
+        passos.setCurrentStep(1)
+        calcular_medidas_azimutes(upload_dir, feedback=passos)
+    except ProcessamentoCancelado:
+        raise
+    except Exception as e:
+        # Só os memoriais dependem disso; o projeto QGIS segue sem esses campos
+        print(f"⚠️ Falha ao calcular medidas/rumos dos lotes: {e}")
+
+    feedback.etapa(15.8, "🧾 Criando os campos do formulário na camada de lotes...")
+    garantir_campos_gpkg(upload_dir / "final" / "final_gpkg.gpkg")
+
+    feedback.etapa(16, "🗺️ Criando projeto QGIS final...")
+    create_final_project(upload_dir, ortho_path=ortho_path, medidor=feedback.medidor)
+
+    feedback.etapa(17, "✅ Projeto QGIS criado com sucesso!", final=True)
+
+def executar_retry_overpass(upload_dir, ortho_path, canal, job_id=None):
+    """Job de nova tentativa do Overpass: reaproveita as quadras e segue o pipeline."""
+    medidor = MedidorEtapas(upload_dir, job_id, settings.QGIS_METRICAS_TRACEMALLOC)
+    feedback = FeedbackJob(canal, job_id, medidor)
+    feedback.vigiar()
+    try:
+        feedback.etapa(14, "🔁 Tentando novamente extrair ruas...")
+        quadras = QgsVectorLayer(str(upload_dir / "quadras" / "quadras.shp"), "quadras", "ogr")
+        if not extrair_ruas_ou_aguardar(quadras, upload_dir, ortho_path, feedback):
+            return
+        executar_pos_ruas(upload_dir, ortho_path, feedback)
+    except ProcessamentoCancelado:
+        # as quadras continuam lá: o canal volta a aceitar uma nova tentativa
+        raise feedback.interrompido(aguardando_ruas=True, ortho_path=str(ortho_path) if ortho_path else None)
+    except Exception as e:
+        feedback.etapa(99, f"❌ Erro inesperado ao repetir Overpass: {e}", final=True)
+        raise
+    finally:
+        feedback.encerrar()
+
+def executar_pipeline(upload_dir, dxf_path, ortho_path, canal, job_id=None, ortho_upload=None, compactado=None):
+    """
+    ortho_upload: id do UploadParcial da ortofoto, se ela ainda estava chegando quando o job foi criado.
+    compactado: .zip/.dxf.gz recebido em partes, extraído aqui (o DXF e a ortofoto saem dele).
+    """
+    medidor = MedidorEtapas(upload_dir, job_id, settings.QGIS_METRICAS_TRACEMALLOC)
+    feedback = FeedbackJob(canal, job_id, medidor)
+    feedback.vigiar()
+    try:
+        if compactado:
+            feedback.etapa(2, "📦 Descompactando o arquivo enviado...")
+            dxf_path, ortho_no_pacote = descompactar_arquivo(
+                compactado, upload_dir, com_ortofoto=not (ortho_path or ortho_upload))
+            ortho_path = ortho_path or ortho_no_pacote
+
+        paths = {
+            "linhas": upload_dir / "lotes_linhas" / "lotes_linhas.shp",
+            "linhas_fix": upload_dir / "temp" / "linhas_fix.shp",
+            "linhas_snap": upload_dir / "temp" / "linhas_snap.shp",
+            "lotes_poly": upload_dir / "lotes_poligonos" / "lotes_poligonos.shp",
+            "lotes_fix": upload_dir / "lotes_poligonos" / "lotes_poligonos_fix.shp",
+            "lotes_buffer": upload_dir / "lotes_poligonos" / "lotes_buffer.shp",
+            "quadras_raw": upload_dir / "quadras" / "quadras_dissolve.shp",
+            "quadras_single": upload_dir / "quadras" / "quadras.shp",
+            "quadras_single2": upload_dir / "quadras" / "quadras_m2s.shp",
+            "quadras_pts": upload_dir / "quadras" / "quadras_rotulo_pt.gpkg",
+            "lotes_join": upload_dir / "lotes_poligonos" / "lotes_com_quadra.shp",
+            "arquivo_final": upload_dir / "final" / "final.shp"
+        }
+
+        for p in paths.values():
+            p.parent.mkdir(parents=True, exist_ok=True)
+
+        if not ortho_upload:
+            ortho_path = converter_ortofoto(ortho_path, feedback)
+
+        feedback.etapa(3, "🔧 Convertendo DXF em camadas vetoriais...")
+        linhas = dxf_to_shp(dxf_path, paths["linhas"], feedback)
+        feedback.contar(saida=linhas)
+
+        feedback.etapa(4, "🧩 Corrigindo e aplicando snap...")
+        linhas_fix = corrigir_e_snap(linhas, paths, feedback)
+        feedback.contar(entrada=linhas, saida=linhas_fix)
+
+        feedback.etapa(5, "🏠 Gerando polígonos de lotes...")
+        lotes_poly = linhas_para_poligonos(linhas_fix, paths["lotes_poly"], feedback)
+        feedback.contar(entrada=linhas_fix, saida=lotes_poly)
+
+        feedback.etapa(6, "🧼 Corrigindo geometrias dos lotes...")
+        lotes_fix = corrigir_geometrias(lotes_poly, paths["lotes_fix"], feedback)
+        feedback.contar(entrada=lotes_poly, saida=lotes_fix)
+
+        feedback.etapa(7, "🗂️ Gerando buffers dos lotes...")
+        lotes_buffer = buffer_lotes(lotes_fix, paths["lotes_buffer"], feedback)
+        feedback.contar(entrada=lotes_fix, saida=lotes_buffer)
+
+        feedback.etapa(8, "🧩 Dissolvendo lotes para criar polígonos das quadras...")
+        quadras_raw = dissolve_para_quadras(lotes_buffer, paths["quadras_raw"], feedback)
+        feedback.contar(entrada=lotes_buffer, saida=quadras_raw)
+
+        feedback.etapa(9, "🧩 Criando polígonos das quadras...")
+        quadras = singlepart_quadras(quadras_raw, paths["quadras_single2"], feedback)
+        feedback.contar(entrada=quadras_raw, saida=quadras)
+
+        feedback.etapa(10, "🧩 Atribuindo letras às quadras...")
+        quadras = atribuir_letras_quadras(quadras, paths["quadras_single"], feedback)
+        feedback.contar(entrada=quadras, saida=quadras)
+
+        feedback.etapa(11, "🗂️ Gerando pontos de rótulo das quadras...")
+        pontos = gerar_pontos_rotulo(quadras, paths["quadras_pts"], feedback)
+        feedback.contar(entrada=quadras, saida=pontos)
+
+        feedback.etapa(12, "🏠 Juntando lotes e quadras...")
+        lotes_join = join_lotes_quadras(lotes_fix, quadras, paths["lotes_join"], feedback)
+        feedback.contar(entrada=lotes_fix, saida=lotes_join)
+
+        feedback.etapa(13, "🧩 Numerando lotes...")
+        lotes_final = numerar_lotes(lotes_join, paths["arquivo_final"], feedback)
+        feedback.contar(entrada=lotes_join, saida=lotes_final)
+
+        if ortho_upload:
+            # o DXF chegou antes: a ortofoto só é necessária daqui em diante
+            ortho_path = converter_ortofoto(aguardar_ortofoto(ortho_upload, feedback), feedback, etapa=13.6)
+
+        feedback.etapa(14, "🧩 Extraindo ruas do OpenStreetMap...")
+        if not extrair_ruas_ou_aguardar(quadras, upload_dir, ortho_path, feedback):
+            return  # aguardando nova tentativa (tentar_overpass)
+
+        executar_pos_ruas(upload_dir, ortho_path, feedback)
+
+    except ProcessamentoCancelado:
+        raise feedback.interrompido()  # o worker apaga as saídas parciais
+    except Exception as e:
+        feedback.etapa(99, f"❌ Erro geral: {e}", final=True)
+        raise  # o worker registra a falha no Job
+    finally:
+        feedback.encerrar()
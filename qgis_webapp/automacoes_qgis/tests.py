@@ -1,3 +1,1618 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (descompactar, envio_qfieldcloud, jobs, metricas, organize_files_for_qfield, pacote_qfield,
+               progresso_bus, projeto_template, upload_parcial, views, zip_stream)
+from .models import Job, UploadParcial
+
+TEM_GEO = all(importlib.util.find_spec(m) for m in ("geopandas", "pyogrio", "pyproj"))
+TEM_QGIS = importlib.util.find_spec("qgis") is not None
+
+_RE_UUID = re.compile(r"_[0-9a-f]{8}(?:_[0-9a-f]{4}){3}_[0-9a-f]{12}")
+_RE_NUMERO = re.compile(r"-?\d+\.\d+")
+
+
+def _criar_job(base_dir: Path, deslocamento=0.0):
+    """Job mínimo: dois lotes, um ponto de quadra e uma rua (EPSG:31983)."""
+    import geopandas as gpd
+    from shapely.geometry import LineString, Point, box
+
+    x0 = 500000 + deslocamento
+    for sub in ("final", "quadras", "ruas"):
+        (base_dir / sub).mkdir(parents=True, exist_ok=True)
+    gpd.GeoDataFrame(
+        {"quadra": ["A", "A"], "lote_num": ["1", "2"]},
+        geometry=[box(x0, 7000000, x0 + 10, 7000030), box(x0 + 10, 7000000, x0 + 20, 7000030)],
+        crs="EPSG:31983",
+    ).to_file(base_dir / "final" / "final_gpkg.gpkg", driver="GPKG")
+    gpd.GeoDataFrame(
+        {"quadra": ["A"]}, geometry=[Point(x0 + 10, 7000015)], crs="EPSG:31983"
+    ).to_file(base_dir / "quadras" / "quadras_rotulo_pt.gpkg", driver="GPKG")
+    gpd.GeoDataFrame(
+        {"name": ["Rua Um"]}, geometry=[LineString([(x0 - 5, 6999995), (x0 + 25, 6999995)])], crs="EPSG:31983"
+    ).to_file(base_dir / "ruas" / "ruas_osm_detalhadas.gpkg", driver="GPKG")
+
+
+def _normalizar(texto: str) -> str:
+    texto = _RE_UUID.sub("_ID", texto)
+    texto = re.sub(r' saveDateTime="[^"]*"', "", texto)
+    texto = re.sub(r"<creation>[^<]*</creation>", "", texto)
+    return _RE_NUMERO.sub(lambda m: f"{float(m.group()):.4f}", texto)
+
+
+@unittest.skipUnless(TEM_GEO, "geopandas/pyogrio/pyproj indisponíveis")
+class ProjetoTemplateTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.templates = self.tmp / "templates"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_sem_template_retorna_none(self):
+        _criar_job(self.tmp / "job")
+        self.assertIsNone(projeto_template.renderizar_projeto(self.tmp / "job", dir_templates=self.templates))
+
+    def test_renderiza_ids_e_extents_do_job(self):
+        origem, destino = self.tmp / "a", self.tmp / "b"
+        _criar_job(origem)
+        _criar_job(destino, deslocamento=1000)
+        lid = "final_gpkg_0a1b2c3d_1111_2222_3333_444455556666"
+        (origem / "project_cloud.qgs").write_text(
+            '<qgis saveDateTime="2026-01-01T00:00:00"><projectlayers><maplayer type="vector">'
+            "<extent><xmin>1</xmin><ymin>2</ymin><xmax>3</xmax><ymax>4</ymax></extent>"
+            f"<id>{lid}</id><layername>final_gpkg</layername>"
+            "<expression>$area</expression></maplayer></projectlayers>"
+            f'<ProjectGpsSettings destinationLayer="{lid}"/></qgis>',
+            encoding="utf-8",
+        )
+        projeto_template.capturar_template(origem, dir_templates=self.templates)
+
+        texto = projeto_template.renderizar_projeto(destino, dir_templates=self.templates).read_text(encoding="utf-8")
+        self.assertNotIn(lid, texto)
+        self.assertIn("<xmin>501000.0</xmin>", texto)
+        self.assertIn("<xmax>501020.0</xmax>", texto)
+        self.assertIn("<expression>$area</expression>", texto)
+        novo_id = re.search(r"<id>([^<]+)</id>", texto).group(1)
+        self.assertIn(f'destinationLayer="{novo_id}"', texto)
+
+    def test_templates_no_diretorio_configurado_sem_alterar_o_gpkg(self):
+        import pyogrio
+
+        origem, destino = self.tmp / "a", self.tmp / "b"
+        _criar_job(origem)
+        _criar_job(destino)
+        (origem / "project_cloud.qgs").write_text("<qgis><projectlayers/></qgis>", encoding="utf-8")
+        gpkg = destino / "final" / "final_gpkg.gpkg"
+        antes = gpkg.read_bytes()
+
+        with override_settings(QGIS_TEMPLATES_DIR=self.templates):
+            projeto_template.capturar_template(origem)
+            self.assertTrue(list(self.templates.glob("*.qgs.tpl")))
+            self.assertIsNotNone(projeto_template.renderizar_projeto(destino))
+        # renderizar não cria campos: isso é a etapa garantir_campos_gpkg
+        self.assertEqual(gpkg.read_bytes(), antes)
+
+        projeto_template.garantir_campos_gpkg(gpkg)
+        campos = list(pyogrio.read_info(gpkg)["fields"])
+        self.assertEqual(campos[:2], ["quadra", "lote_num"])
+        self.assertEqual(set(campos), {nome for nome, _ in projeto_template.CAMPOS_LOTES})
+        with override_settings(QGIS_TEMPLATES_DIR=self.templates):
+            # outra assinatura de camadas: ainda sem template
+            self.assertIsNone(projeto_template.renderizar_projeto(destino))
+
+    @unittest.skipUnless(TEM_QGIS, "QGIS indisponível")
+    def test_template_igual_ao_projeto_do_qgis(self):
+        from .criar_projeto_qgis import _criar_projeto_com_qgis
+
+        origem, destino = self.tmp / "a", self.tmp / "b"
+        _criar_job(origem)
+        _criar_job(destino)
+        esperado = _criar_projeto_com_qgis(origem).read_text(encoding="utf-8")
+        projeto_template.capturar_template(origem, dir_templates=self.templates)
+        # etapa do pipeline que cria os campos do formulário antes do projeto
+        projeto_template.garantir_campos_gpkg(destino / "final" / "final_gpkg.gpkg")
+
+        gerado = projeto_template.renderizar_projeto(destino, dir_templates=self.templates)
+        self.assertEqual(_normalizar(gerado.read_text(encoding="utf-8")), _normalizar(esperado))
+
+
+
+@unittest.skipUnless(TEM_GEO, "geopandas/pyogrio/pyproj indisponíveis")
+class MedidasLotesTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_medidas_rumos_e_confrontantes(self):
+        """Dois lotes 10x30 lado a lado, com a rua ao sul: frente para o sul, direita a oeste."""
+        import geopandas as gpd
+        from .medidas_lotes import calcular_medidas_azimutes
+
+        _criar_job(self.tmp)
+        lotes = gpd.read_file(calcular_medidas_azimutes(self.tmp)).set_index("lote_num")
+
+        for lote in ("1", "2"):
+            linha = lotes.loc[lote]
+            self.assertEqual(
+                [linha[f"Comp_{lado}"] for lado in ("Frente", "Direita", "Fundos", "Esquerda")],
+                [10.0, 30.0, 10.0, 30.0],
+            )
+            self.assertEqual(
+                [linha[f"Rumo_{lado}"] for lado in ("Frente", "Direita", "Fundos", "Esquerda")],
+                ['90°00\'00" W', '0°00\'00" N', '90°00\'00" E', '0°00\'00" S'],
+            )
+            self.assertEqual(linha["Conf_Frente"], "Rua Um")
+            self.assertEqual(linha["Conf_Fundos"], "área não identificada")
+        self.assertEqual(lotes.loc["1", "Conf_Esquerda"], "Lote 2 da Quadra A")
+        self.assertEqual(lotes.loc["1", "Conf_Direita"], "área não identificada")
+        self.assertEqual(lotes.loc["2", "Conf_Direita"], "Lote 1 da Quadra A")
+        self.assertEqual(lotes.loc["2", "Conf_Esquerda"], "área não identificada")
+
+    def _quatro_lotes(self, deslocamento_lote_4=0.0):
+        """Quadra 2x2 de lotes 10x30 com a rua ao sul, encostada na fileira de baixo."""
+        import geopandas as gpd
+        from shapely.geometry import LineString, box
+
+        (self.tmp / "final").mkdir(exist_ok=True)
+        (self.tmp / "ruas").mkdir(exist_ok=True)
+        x4 = 10 + deslocamento_lote_4
+        gpd.GeoDataFrame(
+            {"quadra": ["A"] * 4, "lote_num": [1, 2, 3, 4]},
+            geometry=[box(0, 0, 10, 30), box(10, 0, 20, 30), box(0, 30, 10, 60), box(x4, 30, x4 + 10, 60)],
+            crs="EPSG:31983",
+        ).to_file(self.tmp / "final" / "final_gpkg.gpkg", driver="GPKG")
+        gpd.GeoDataFrame(
+            {"name": ["Rua Um"]}, geometry=[LineString([(-5, -5), (25, -5)])], crs="EPSG:31983"
+        ).to_file(self.tmp / "ruas" / "ruas_osm_detalhadas.gpkg", driver="GPKG")
+
+    def _vizinhos(self, adj):
+        """{nó: {vizinho: comprimento}} a partir do CSR."""
+        indptr, indices, comp = adj["indptr"], adj["indices"], adj["comprimento"]
+        return {
+            no: {int(j): round(float(c), 1) for j, c in zip(indices[indptr[no]:indptr[no + 1]],
+                                                             comp[indptr[no]:indptr[no + 1]])}
+            for no in range(len(indptr) - 1)
+        }
+
+    def test_adjacencia_csr(self):
+        from .medidas_lotes import obter_adjacencia, rotulos_nos
+
+        self._quatro_lotes()
+        adj = obter_adjacencia(self.tmp)
+        self.assertEqual(int(adj["n_lotes"]), 4)
+        self.assertEqual(list(adj["nomes_ruas"]), ["Rua Um"])
+        self.assertEqual(list(rotulos_nos(adj)), [
+            "Lote 1 da Quadra A", "Lote 2 da Quadra A", "Lote 3 da Quadra A", "Lote 4 da Quadra A", "Rua Um",
+        ])
+        # divisas com a folga de 0,1 m nas pontas; o canto dos lotes em diagonal não conta;
+        # testada: a frente de 10 m mais 4 m de cada lateral dentro da faixa de 9 m da rua
+        self.assertEqual(self._vizinhos(adj), {
+            0: {1: 30.2, 2: 10.2, 4: 18.0},
+            1: {0: 30.2, 3: 10.2, 4: 18.0},
+            2: {0: 10.2, 3: 30.2},
+            3: {1: 10.2, 2: 30.2},
+            4: {0: 18.0, 1: 18.0},
+        })
+
+    def test_adjacencia_refeita_quando_o_gpkg_muda(self):
+        from unittest import mock
+        from . import medidas_lotes
+
+        self._quatro_lotes()
+        # _lotes_e_ruas_nomeadas só é chamada quando o grafo é (re)construído
+        with mock.patch.object(medidas_lotes, "_lotes_e_ruas_nomeadas",
+                               wraps=medidas_lotes._lotes_e_ruas_nomeadas) as construir:
+            medidas_lotes.obter_adjacencia(self.tmp)
+            medidas_lotes.obter_adjacencia(self.tmp)
+            self.assertEqual(construir.call_count, 1)
+
+            # mesmo conteúdo com outro mtime: confere o sha256 e reaproveita
+            gpkg = self.tmp / "final" / "final_gpkg.gpkg"
+            os.utime(gpkg, ns=(time.time_ns(), time.time_ns() + 10**9))
+            medidas_lotes.obter_adjacencia(self.tmp)
+            self.assertEqual(construir.call_count, 1)
+
+            # nada mudou: nenhuma entrada é relida; só as ruas mudaram de mtime: só elas são relidas
+            with mock.patch.object(medidas_lotes, "hash_arquivo", wraps=medidas_lotes.hash_arquivo) as somar:
+                medidas_lotes.obter_adjacencia(self.tmp)
+                self.assertEqual(somar.call_count, 0)
+                ruas = self.tmp / "ruas" / "ruas_osm_detalhadas.gpkg"
+                os.utime(ruas, ns=(time.time_ns(), time.time_ns() + 2 * 10**9))
+                medidas_lotes.obter_adjacencia(self.tmp)
+                self.assertEqual([c.args[0] for c in somar.call_args_list], [ruas])
+            self.assertEqual(construir.call_count, 1)
+
+            # mesmo número de lotes, geometria diferente: o grafo antigo não serve
+            self._quatro_lotes(deslocamento_lote_4=50)
+            adj = medidas_lotes.obter_adjacencia(self.tmp)
+            self.assertEqual(construir.call_count, 2)
+            self.assertEqual(self._vizinhos(adj)[3], {})
+
+            medidas_lotes.obter_adjacencia(self.tmp, buffer_rua=3)
+            self.assertEqual(construir.call_count, 3)
+
+    def test_rumos_fora_dos_eixos(self):
+        from .medidas_lotes import _formatar_rumos
+
+        self.assertEqual(
+            _formatar_rumos([1, 1, -1, -1, 0], [1, -1, -1, 1, 0]),
+            ['45°00\'00" NE', '45°00\'00" SE', '45°00\'00" SW', '45°00\'00" NW', None],
+        )
+
+
+@unittest.skipUnless(TEM_QGIS and TEM_GEO, "QGIS indisponível")
+class ProjetoQFieldSyncTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        _criar_job(self.tmp)
+
+    def test_write_project_recebe_ajustes_do_qfieldsync(self):
+        import xml.etree.ElementTree as ET
+        from .criar_projeto_qgis import _criar_projeto_com_qgis
+
+        projeto = _criar_projeto_com_qgis(self.tmp)
+        root = ET.parse(projeto).getroot()
+        maplayers = root.find("projectlayers").findall("maplayer")
+        camadas = {ml.findtext("layername"): ml for ml in maplayers}
+        self.assertEqual(set(camadas), {"final_gpkg", "quadras_rotulo_pt", "ruas_osm_detalhadas"})
+        ids = [ml.findtext("id") for ml in maplayers]
+
+        # propriedades do QFieldSync gravadas em cada camada
+        for nome, ml in camadas.items():
+            propriedades = {
+                (o.get("name") or o.get("key")): o.get("value")
+                for o in ml.find("customproperties").iter() if o.get("name") or o.get("key")
+            }
+            self.assertIn(propriedades.get("QFieldSync/cloud_action"), ("offline", "offline_editing"), nome)
+
+        # ajustes feitos no DOM pelo sinal writeProject
+        self.assertEqual([el.get("id") for el in root.find("layerorder")], ids)
+        ordem = root.find("layer-tree-group/custom-order")
+        self.assertEqual(ordem.get("enabled"), "1")
+        self.assertEqual(sorted(el.text for el in ordem), sorted(ids))
+        for tag in ("relations", "polymorphicRelations", "mapcanvas", "projectModels", "mapViewDocks"):
+            self.assertIsNotNone(root.find(tag), tag)
+        self.assertEqual(root.findtext("properties/Legend/filterByMap"), "false")
+
+        gps = root.findall("ProjectGpsSettings")
+        self.assertEqual(len(gps), 1)
+        self.assertEqual(gps[0].get("destinationLayer"), camadas["final_gpkg"].findtext("id"))
+        self.assertEqual(gps[0].get("destinationLayerSource"), camadas["final_gpkg"].findtext("datasource"))
+
+
+class _FeedbackFalso:
+    """Feedback mínimo do pipeline: cancela quando cancelar_em chamadas de isCanceled() passarem."""
+
+    def __init__(self, cancelar_em=None):
+        self.consultas = 0
+        self.cancelar_em = cancelar_em
+
+    def isCanceled(self):
+        self.consultas += 1
+        return self.cancelar_em is not None and self.consultas >= self.cancelar_em
+
+    def setProgress(self, percentual):
+        pass
+
+
+@unittest.skipUnless(TEM_QGIS, "QGIS indisponível")
+class RodarAlgoritmoTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .qgis_setup import init_qgis
+
+        init_qgis()
+
+    def test_contexto_proprio_por_chamada(self):
+        from unittest import mock
+        from . import pipeline
+
+        with mock.patch.object(pipeline.processing, "run", return_value={"OUTPUT": "x"}) as run:
+            self.assertEqual(pipeline._rodar("native:fixgeometries", {"INPUT": "a"}), {"OUTPUT": "x"})
+            pipeline._rodar("native:fixgeometries", {"INPUT": "b"}, _FeedbackFalso())
+        (_, k1), (_, k2) = [(c.args, c.kwargs) for c in run.call_args_list]
+        self.assertIsNot(k1["context"], k2["context"])
+        for k in (k1, k2):
+            self.assertIsNone(k["context"].project())
+        self.assertIsNone(k1["feedback"])
+
+    def test_erros_e_cancelamento_propagam(self):
+        from unittest import mock
+        from qgis.core import QgsProcessingException
+        from . import pipeline
+        from .etapas import ProcessamentoCancelado
+
+        with self.assertRaises(QgsProcessingException):
+            pipeline._rodar("native:algoritmo_que_nao_existe", {})
+
+        with mock.patch.object(pipeline.processing, "run") as run:
+            # cancelado antes: o algoritmo nem roda
+            with self.assertRaises(ProcessamentoCancelado):
+                pipeline._rodar("native:fixgeometries", {}, _FeedbackFalso(cancelar_em=1))
+            run.assert_not_called()
+            # cancelado durante: a saída parcial não é devolvida
+            with self.assertRaises(ProcessamentoCancelado):
+                pipeline._rodar("native:fixgeometries", {}, _FeedbackFalso(cancelar_em=2))
+            run.assert_called_once()
+
+
+class ImportacaoLeveTests(SimpleTestCase):
+    def test_views_nao_carregam_pilha_gis(self):
+        """O processo web sobe sem importar QGIS, geopandas, python-docx nem o SDK do QFieldCloud."""
+        codigo = (
+            "import sys, django; django.setup(); import automacoes_qgis.urls; "
+            "print('carregados=' + ','.join(m for m in ('qgis', 'geopandas', 'docx', 'qfieldcloud_sdk') if m in sys.modules))"
+        )
+        saida = subprocess.run(
+            [sys.executable, "-c", codigo], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent.parent,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "qgis_webapp.settings"},
+        )
+        self.assertIn("carregados=\n", saida.stdout + "\n")
+
+
+class ProgressoBusTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        ajuste = override_settings(PROGRESSO_DIR=self.tmp)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def test_canais_isolados_e_assinatura_termina_no_final(self):
+        progresso_bus.publicar("job-1", 3, "DXF", percentual=40)
+        progresso_bus.publicar("job-2", 17, "Pronto", final=True)
+        self.assertEqual(progresso_bus.ler("job-1")["percentual"], 40)
+        self.assertIsNone(progresso_bus.ler("qfield-1"))
+
+        estados = list(progresso_bus.assinar("job-2", intervalo=0.01, duracao=1))
+        self.assertEqual([e["etapa"] for e in estados], [17])
+        self.assertEqual(list(progresso_bus.assinar("job-2", intervalo=0.01, duracao=0.1, pulsacao=10,
+                                                     ignorar_final_anterior=True)), [])
+        with self.assertRaises(ValueError):
+            progresso_bus.publicar("../job-1", 1, "x")
+
+    def test_sse_do_job_da_sessao(self):
+        sessao = self.client.session
+        sessao["job_id_canal"] = 7
+        sessao.save()
+        progresso_bus.publicar(progresso_bus.canal_job(7), 17, "✅ Pronto", final=True)
+
+        resp = self.client.get("/progresso/eventos/")
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        corpo = b"".join(resp.streaming_content).decode()
+        self.assertIn("event: progresso", corpo)
+        self.assertIn('"etapa": 17', corpo)
+
+    @override_settings(QGIS_SSE_JANELA=0.3)
+    def test_sse_fecha_na_janela_e_retoma_pelo_last_event_id(self):
+        sessao = self.client.session
+        sessao["job_id_canal"] = 8
+        sessao.save()
+        estado = progresso_bus.publicar(progresso_bus.canal_job(8), 5, "Processando")
+
+        corpo = b"".join(self.client.get("/progresso/eventos/").streaming_content).decode()
+        self.assertIn(f"id: {estado['versao']}", corpo)
+        # reconexão com o último id visto: a conexão fecha na janela sem repetir o estado
+        resp = self.client.get("/progresso/eventos/", HTTP_LAST_EVENT_ID=str(estado["versao"]))
+        corpo = b"".join(resp.streaming_content).decode()
+        self.assertIn("retry:", corpo)
+        self.assertNotIn("event: progresso", corpo)
+
+
+class FilaJobsTests(TestCase):
+    def test_dois_workers_nao_pegam_o_mesmo_job(self):
+        from unittest import mock
+        from django.db.models import QuerySet
+
+        antigo = jobs.enfileirar_job("/tmp/a")
+        novo = jobs.enfileirar_job("/tmp/b")
+        update = QuerySet.update
+        concorrente = []
+
+        def update_com_concorrente(qs, **campos):
+            # entre o SELECT e o UPDATE do teste:1, o teste:2 reivindica o mesmo job
+            if not concorrente:
+                concorrente.append(None)  # antes: o UPDATE do teste:2 também passa por aqui
+                concorrente[0] = jobs.reivindicar_job("teste:2")
+            return update(qs, **campos)
+
+        with mock.patch.object(QuerySet, "update", update_com_concorrente):
+            primeiro = jobs.reivindicar_job("teste:1")
+
+        self.assertEqual((concorrente[0].pk, concorrente[0].worker), (antigo.pk, "teste:2"))
+        self.assertEqual((primeiro.pk, primeiro.worker), (novo.pk, "teste:1"))
+        self.assertIsNone(jobs.reivindicar_job("teste:3"))
+        self.assertEqual(
+            dict(Job.objects.values_list("pk", "worker")), {antigo.pk: "teste:2", novo.pk: "teste:1"}
+        )
+
+    def test_job_orfao_volta_para_a_fila(self):
+        job = jobs.enfileirar_job("/tmp/a")
+        outro_host = jobs.enfileirar_job("/tmp/b")
+        jobs.reivindicar_job("maquina:111")
+        jobs.reivindicar_job("outra:222")
+
+        self.assertEqual(jobs.recuperar_jobs_orfaos("maquina"), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.iniciado_em), (Job.Status.PENDENTE, "", None))
+        outro_host.refresh_from_db()
+        self.assertEqual(outro_host.status, Job.Status.EXECUTANDO)
+
+        retomado = jobs.reivindicar_job("maquina:333")
+        self.assertEqual((retomado.pk, retomado.worker), (job.pk, "maquina:333"))
+
+        # worker morto pelo supervisor: falha, sem voltar para a fila
+        jobs.marcar_falha_do_worker("maquina:333", "Worker encerrado.")
+        retomado.refresh_from_db()
+        self.assertEqual((retomado.status, retomado.erro), (Job.Status.FALHOU, "Worker encerrado."))
+        self.assertEqual(jobs.recuperar_jobs_orfaos("maquina"), 0)
+
+
+class ReciclagemWorkerTests(SimpleTestCase):
+    def test_motivo_reciclagem(self):
+        self.assertIsNone(jobs.motivo_reciclagem(3, 900.0, max_jobs=5, max_rss_mb=1000))
+        self.assertEqual(jobs.motivo_reciclagem(5, 900.0, max_jobs=5, max_rss_mb=1000), "atingiu 5 jobs")
+        self.assertEqual(jobs.motivo_reciclagem(1, 1500.4, max_jobs=5, max_rss_mb=1000),
+                         "com 1500 MB (> 1000 MB)")
+        # 0 desliga cada limite; sem medição de memória só conta o número de jobs
+        self.assertIsNone(jobs.motivo_reciclagem(500, 9000.0, max_jobs=0, max_rss_mb=0))
+        self.assertIsNone(jobs.motivo_reciclagem(1, None, max_jobs=5, max_rss_mb=1000))
+        self.assertEqual(jobs.motivo_reciclagem(5, None, max_jobs=5, max_rss_mb=1000), "atingiu 5 jobs")
+
+
+class CancelamentoJobTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        ajuste = override_settings(PROGRESSO_DIR=self.tmp / "progresso", QGIS_TOLERANCIA_CANCELAMENTO=0,
+                                   QGIS_LIMITE_ETAPAS={"5": 10}, QGIS_LIMITE_ETAPA_PADRAO=1000)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def test_status_so_do_job_da_sessao(self):
+        sessao = self.client.session
+        sessao.save()
+        meu = jobs.enfileirar_job(self.tmp, sessao.session_key, dxf_path=self.tmp / "a.dxf")
+        outro = jobs.enfileirar_job(self.tmp, "outra-sessao", dxf_path=self.tmp / "b.dxf")
+
+        self.assertEqual(self.client.get(reverse("status_job", args=[meu.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse("status_job", args=[outro.pk])).status_code, 404)
+
+    def test_pendente_sai_da_fila(self):
+        job = jobs.enfileirar_job(self.tmp, dxf_path=self.tmp / "a.dxf")
+        self.assertEqual(jobs.cancelar_job(job), Job.Status.CANCELADO)
+        self.assertIsNone(jobs.reivindicar_job("teste:1"))
+        self.assertTrue(progresso_bus.ler(progresso_bus.canal_job(job.pk))["final"])
+
+    def test_executando_travado_e_interrompido(self):
+        upload = self.tmp / "upload"
+        for pasta in ("ortofoto", "quadras", "final"):
+            (upload / pasta).mkdir(parents=True)
+        (upload / "lotes.dxf").write_text("0\nEOF\n")
+        job = jobs.enfileirar_job(upload, dxf_path=upload / "lotes.dxf")
+        job = jobs.reivindicar_job("teste:1")
+        self.assertIsNone(jobs.verificar_worker_travado("teste:1"))
+
+        # etapa 5 começou há 20 s com limite de 10 s
+        progresso_bus.publicar(progresso_bus.canal_job(job.pk), 5, "Polígonos", inicio_etapa=time.time() - 20)
+        _, etapa, motivo = jobs.verificar_worker_travado("teste:1")
+        self.assertEqual(etapa, 5)
+        self.assertIn("Tempo esgotado", motivo)
+
+        self.assertEqual(jobs.cancelar_job(job), Job.Status.EXECUTANDO)
+        self.assertIsNotNone(jobs.pedido_de_cancelamento(job.pk))
+        jobs.interromper_job(job, etapa, motivo)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.etapa_interrompida), (Job.Status.CANCELADO, 5))
+        self.assertIsNone(jobs.pedido_de_cancelamento(job.pk))
+        self.assertEqual(sorted(p.name for p in upload.iterdir()), ["lotes.dxf", "ortofoto"])
+
+    def test_retry_do_overpass_interrompido_preserva_o_pipeline(self):
+        upload = self.tmp / "upload"
+        pipeline = ["lotes.dxf", "quadras/quadras.shp", "quadras/quadras.dbf", "final/final.shp", "final/final.dbf"]
+        retry = ["ruas/ruas_osm_detalhadas.gpkg", "final/final_gpkg.gpkg", "final/adjacencia.npz", "project_cloud.qgs"]
+        for nome in pipeline + retry:
+            (upload / nome).parent.mkdir(parents=True, exist_ok=True)
+            (upload / nome).write_bytes(b"x")
+        sessao = self.client.session
+        sessao["base_dir"] = str(upload)
+        sessao["job_id_canal"] = 7
+        sessao.save()
+        canal = progresso_bus.canal_job(7)
+        progresso_bus.publicar(canal, 98, "Falha no Overpass", final=True, aguardando_ruas=True, ortho_path=None)
+
+        # na fila: sai sem apagar nada e a busca continua pendente
+        job = Job.objects.get(pk=self.client.post(reverse("tentar_overpass")).json()["job_id"])
+        self.assertEqual(jobs.cancelar_job(job), Job.Status.CANCELADO)
+        self.assertTrue(progresso_bus.ler(canal)["aguardando_ruas"])
+
+        # em execução: apaga só o que o retry gera
+        self.assertEqual(self.client.post(reverse("tentar_overpass")).json()["status"], "sucesso")
+        job = jobs.reivindicar_job("teste:1")
+        self.assertEqual(job.tipo, Job.TIPO_OVERPASS)
+        self.assertEqual(jobs.cancelar_job(job), Job.Status.EXECUTANDO)
+        jobs.interromper_job(job, 15, "Cancelado pelo usuário.")
+        progresso_bus.publicar(canal, 99, "Cancelado", final=True, **jobs.extras_da_interrupcao(job))
+
+        self.assertEqual([n for n in pipeline + retry if (upload / n).exists()], pipeline)
+        self.assertEqual(self.client.post(reverse("tentar_overpass")).json()["status"], "sucesso")
+
+    def test_envio_ao_qfieldcloud_tem_limite_proprio(self):
+        job = jobs.enfileirar_job(self.tmp, tipo=Job.TIPO_QFIELDCLOUD)
+        job = jobs.reivindicar_job("teste:1")
+        # 20 s no arquivo 5: acima do limite da etapa 5, mas o envio é medido pelo seu próprio
+        progresso_bus.publicar(jobs.canal_do_job(job), 5, "Enviando", inicio_etapa=time.time() - 20)
+        with self.settings(QGIS_LIMITE_ETAPAS={"5": 10, "qfieldcloud": 60}):
+            self.assertIsNone(jobs.verificar_worker_travado("teste:1"))
+        with self.settings(QGIS_LIMITE_ETAPAS={"5": 10, "qfieldcloud": 15}):
+            _, etapa, motivo = jobs.verificar_worker_travado("teste:1")
+        self.assertEqual(etapa, 5)
+        self.assertIn("limite 15 s", motivo)
+
+    @unittest.skipUnless(TEM_QGIS, "QGIS indisponível")
+    def test_vigia_cancela_o_feedback_e_termina(self):
+        from .qgis_setup import init_qgis
+        from .tarefas import FeedbackJob
+
+        init_qgis()
+        job = jobs.enfileirar_job(self.tmp, dxf_path=self.tmp / "a.dxf")
+        job = jobs.reivindicar_job("teste:1")
+        feedback = FeedbackJob(progresso_bus.canal_job(job.pk), job_id=job.pk, intervalo=0.02)
+        feedback.etapa(3, "DXF")
+        feedback.vigiar()
+        vigia = next(t for t in threading.enumerate() if t.name == f"vigia-{feedback.canal}")
+        time.sleep(0.1)
+        self.assertFalse(feedback.isCanceled())
+
+        self.assertEqual(jobs.cancelar_job(job), Job.Status.EXECUTANDO)
+        for _ in range(100):
+            if feedback.isCanceled():
+                break
+            time.sleep(0.02)
+        self.assertTrue(feedback.isCanceled())
+        self.assertEqual(feedback.motivo, "Cancelado pelo usuário.")
+
+        feedback.encerrar()
+        vigia.join(timeout=2)
+        self.assertFalse(vigia.is_alive())
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_manifesto_por_execucao_e_prometheus(self):
+        medidor = metricas.MedidorEtapas(self.tmp, job_id=1, usar_tracemalloc=True)
+        medidor.iniciar(3, "DXF")
+        (self.tmp / "linhas.shp").write_bytes(b"x" * 1000)
+        medidor.contar(saida=42)
+        medidor.iniciar(14, "Ruas")
+        with metricas.subetapa(medidor, "overpass"):
+            pass
+        medidor.registrar_cache("template_projeto", False)
+        medidor.encerrar("aguardando_ruas")
+
+        # retry no mesmo upload: outra execução, etapas consolidadas no arquivo
+        retry = metricas.MedidorEtapas(self.tmp, job_id=2, usar_tracemalloc=False)
+        retry.iniciar(14, "Ruas de novo")
+        retry.registrar_cache("template_projeto", True)
+        retry.encerrar("concluido")
+
+        manifesto = metricas.carregar_manifesto(self.tmp)
+        self.assertEqual(sorted(manifesto["etapas"]), ["14", "3"])
+        self.assertEqual(manifesto["etapas"]["14"]["nome"], "Ruas de novo")
+        job1 = metricas.metricas_do_job(self.tmp, 1)
+        self.assertEqual(job1["etapas"]["3"]["saida"], 42)
+        self.assertGreaterEqual(job1["etapas"]["3"]["bytes_escritos"], 1000)
+        self.assertIn("pico_tracemalloc_mb", job1["etapas"]["3"])
+        self.assertNotIn("pico_tracemalloc_mb", metricas.metricas_do_job(self.tmp, 2)["etapas"]["14"])
+
+        agora = timezone.now()
+        Job.objects.create(upload_dir=str(self.tmp), status=Job.Status.CONCLUIDO, metricas=job1, concluido_em=agora)
+        Job.objects.create(upload_dir=str(self.tmp), metricas=metricas.metricas_do_job(self.tmp, 2),
+                           concluido_em=agora)
+        # fora da janela de QGIS_METRICAS_JANELA_HORAS: não entra na agregação
+        Job.objects.create(upload_dir=str(self.tmp), status=Job.Status.CONCLUIDO, metricas=job1,
+                           concluido_em=agora - timedelta(days=30))
+        texto = self.client.get("/metrics").content.decode()
+        self.assertIn('qgis_fila_jobs{status="pendente"} 1', texto)
+        self.assertIn('qgis_etapa_execucoes{etapa="14"} 2', texto)
+        self.assertIn('qgis_etapa_execucoes_ate{etapa="3",le="3600"} 1', texto)
+        self.assertIn('qgis_cache_taxa_acerto{cache="template_projeto"} 0.5000', texto)
+        # a janela faz os valores caírem: nada declarado como counter ou histogram
+        tipos = set(re.findall(r"^# TYPE \S+ (\S+)$", texto, re.M))
+        self.assertEqual(tipos, {"gauge"})
+        self.assertFalse(re.search(r"^\S+_(total|bucket|count|sum)[{ ]", texto, re.M))
+
+    @unittest.skipUnless(Path("/proc/self/clear_refs").exists(), "sem /proc/self/clear_refs")
+    def test_pico_de_rss_e_da_propria_etapa(self):
+        medidor = metricas.MedidorEtapas(self.tmp, job_id=1)
+        medidor.iniciar(1, "Grande")
+        bloco = bytearray(200 * 2**20)
+        bloco[:: 4096] = b"x" * len(bloco[:: 4096])  # toca as páginas
+        del bloco
+        medidor.iniciar(2, "Pequena")
+        medidor.encerrar("concluido")
+
+        etapas = metricas.metricas_do_job(self.tmp, 1)["etapas"]
+        self.assertGreater(etapas["1"]["pico_rss_mb"] - etapas["2"]["pico_rss_mb"], 150)
+        self.assertIn("rss_delta_mb", etapas["2"])
+
+
+class ZipStreamArquivosTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        (self.tmp / "ortofoto").mkdir()
+        (self.tmp / "ortofoto" / "orto.tif").write_bytes(os.urandom(300_000))
+        (self.tmp / "project.qgs").write_text("<qgis>" + "camada " * 5000 + "</qgis>", encoding="utf-8")
+
+    def _zip(self, arquivos):
+        dados = b"".join(zip_stream.zip_de_arquivos(arquivos, bloco=64 * 1024))
+        with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+            self.assertIsNone(zf.testzip())
+            conteudo = {n: zf.read(n) for n in zf.namelist()}
+        return dados, conteudo
+
+    def test_membros_lidos_em_blocos(self):
+        arquivos = [
+            (self.tmp / "project.qgs", "project.qgs", zipfile.ZIP_DEFLATED),
+            (self.tmp / "ortofoto" / "orto.tif", "ortofoto/orto.tif", zipfile.ZIP_STORED),
+        ]
+        _, conteudo = self._zip(arquivos)
+        self.assertEqual(conteudo["ortofoto/orto.tif"], (self.tmp / "ortofoto" / "orto.tif").read_bytes())
+        self.assertEqual(conteudo["project.qgs"], (self.tmp / "project.qgs").read_bytes())
+        self.assertIsNone(zip_stream.tamanho_previsto(arquivos))
+
+    def test_armazenado_tem_crc_no_cabecalho_local_sem_descritor(self):
+        """O ZipInputStream do Java só aceita descritor de dados em membros com deflate."""
+        orto = self.tmp / "ortofoto" / "orto.tif"
+        arquivos = [(orto, "ortofoto/orto.tif", zipfile.ZIP_STORED),
+                    (self.tmp / "project.qgs", "project.qgs", zipfile.ZIP_DEFLATED)]
+        dados, _ = self._zip(arquivos)
+
+        flags, metodo, crc, csize, usize = struct.unpack("<HHxxxxIII", dados[6:26])
+        self.assertEqual((flags & 0x08, metodo), (0, zipfile.ZIP_STORED))
+        self.assertEqual((crc, csize, usize), (zlib.crc32(orto.read_bytes()), 300_000, 300_000))
+        inicio = 30 + len("ortofoto/orto.tif")
+        # logo depois dos dados vem o próximo cabeçalho local, não um descritor
+        self.assertEqual(dados[inicio + 300_000:inicio + 300_004], struct.pack("<I", 0x04034B50))
+        self.assertTrue(struct.unpack("<H", dados[inicio + 300_006:inicio + 300_008])[0] & 0x08)
+
+        # com o CRC já conhecido, o arquivo é lido uma vez só
+        from unittest import mock
+        zs = zip_stream.ZipStream()
+        with mock.patch.object(zip_stream, "_crc_arquivo") as calcular:
+            b"".join(zs.adicionar_arquivo(orto, "orto.tif", zipfile.ZIP_STORED, crc=crc))
+        calcular.assert_not_called()
+        self.assertEqual(zs.membros[-1][2], crc)
+
+    def test_tamanho_previsto_com_membros_armazenados(self):
+        arquivos = [
+            (self.tmp / "project.qgs", "project.qgs", zipfile.ZIP_STORED),
+            (self.tmp / "ortofoto" / "orto.tif", "ortofoto/órto.tif", zipfile.ZIP_STORED),
+        ]
+        dados, _ = self._zip(arquivos)
+        self.assertEqual(zip_stream.tamanho_previsto(arquivos), len(dados))
+
+    def test_entradas_e_membros_ja_comprimidos(self):
+        origem = io.BytesIO()
+        with zipfile.ZipFile(origem, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("dados.csv", "a;b\n" * 1000)
+        with zipfile.ZipFile(origem) as zf:
+            info = zf.getinfo("dados.csv")
+            inicio = zip_stream.inicio_dos_dados(origem, info.header_offset)
+        origem.seek(inicio)
+        bruto = origem.read(info.compress_size)
+
+        zs = zip_stream.ZipStream()
+        partes = list(zs.adicionar_comprimido(
+            "copia.csv", info.compress_type, info.CRC, info.compress_size, info.file_size, [bruto]
+        ))
+        partes.append(zs.finalizar())
+        with zipfile.ZipFile(io.BytesIO(b"".join(partes))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("copia.csv"), b"a;b\n" * 1000)
+
+        entradas = [("a.txt", b"um"), ("b/ç.txt", iter([b"do", b"is"]))]
+        with zipfile.ZipFile(io.BytesIO(b"".join(zip_stream.zip_de_entradas(entradas)))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual([(i.filename, i.compress_type) for i in zf.infolist()],
+                             [("a.txt", zipfile.ZIP_STORED), ("b/ç.txt", zipfile.ZIP_STORED)])
+            self.assertEqual(zf.read("b/ç.txt"), b"dois")
+
+    def test_zip64_com_tamanhos_sinteticos(self):
+        """Membro de 5 GiB declarado sem os dados: o arquivo esparso só tem cabeçalhos e diretório."""
+        grande = 5 * 2**30
+        zs = zip_stream.ZipStream()
+        cabecalho, = zs.adicionar_comprimido("orto.tif", zipfile.ZIP_STORED, 0, grande, grande, [])
+        self.assertEqual(struct.unpack("<II", cabecalho[18:26]), (0xFFFFFFFF, 0xFFFFFFFF))
+        self.assertEqual(struct.unpack("<HHQQ", cabecalho[-20:]), (0x0001, 16, grande, grande))
+
+        caminho = self.tmp / "grande.zip"
+        with open(caminho, "wb") as f:
+            f.write(cabecalho)
+            f.seek(zs.offset)
+            f.write(zs.adicionar_bytes("leia.txt", b"ola"))
+            fim = zs.finalizar()
+            f.write(fim)
+        self.assertIn(struct.pack("<I", 0x06064B50), fim)
+        self.assertEqual(caminho.stat().st_size, zs.offset)
+
+        with zipfile.ZipFile(caminho) as zf:
+            orto, leia = zf.infolist()
+            self.assertEqual((orto.file_size, orto.compress_size), (grande, grande))
+            self.assertGreater(leia.header_offset, 0xFFFFFFFF)
+            self.assertEqual(zf.read("leia.txt"), b"ola")
+
+
+def _lotes_memorial():
+    """Três quadras de lotes 10x30 com medidas, rumos e confrontantes preenchidos."""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    linhas, geoms = [], []
+    for i, (quadra, lote) in enumerate([("A", 2), ("A", 1), ("B", 1), ("C", 1), ("C", 2)]):
+        x0 = 500000 + 20 * i
+        geoms.append(box(x0, 7000000, x0 + 10, 7000030))
+        linhas.append({
+            "quadra": quadra, "lote_num": lote,
+            "Conf_Frente": "Rua Um", "Comp_Frente": 10.0, "Rumo_Frente": "90°00'00\" SE",
+            "Conf_Direita": f"Lote {lote + 1}", "Comp_Direita": 30.0, "Rumo_Direita": "00°00'00\" NE",
+            "Conf_Fundos": "Rua Dois", "Comp_Fundos": 10.0, "Rumo_Fundos": "90°00'00\" NO",
+            "Conf_Esquerda": f"Lote {lote - 1}", "Comp_Esquerda": 30.0, "Rumo_Esquerda": "00°00'00\" SO",
+        })
+    return gpd.GeoDataFrame(linhas, geometry=geoms, crs="EPSG:31983")
+
+
+def _documento_xml(caminho) -> bytes:
+    with zipfile.ZipFile(caminho) as zf:
+        return zf.read("word/document.xml")
+
+
+def _memorial_python_docx(lotes, quadra, individual=False, nucleo="Centro", municipio="Condeúba", uf="BA"):
+    """Memorial montado parágrafo a parágrafo com python-docx, como era gerado antes do template."""
+    from docx import Document
+    from docx.shared import Pt
+    from .docx_utils import _add_cabecalho_memorial, _fmt_coord, _fmt_num_br
+
+    doc = Document()
+    _add_cabecalho_memorial(doc, titulo="MEMORIAL DESCRITIVO", quadra=quadra, nucleo=nucleo,
+                            municipio=municipio, uf=uf, promotor="Instituto Cidade Legal")
+    for _, row in lotes.iterrows():
+        geom = row.geometry
+        if individual:
+            p_info = doc.add_paragraph()
+            p_info.add_run(f"Quadra: {row['quadra']}\n")
+            p_info.add_run(f"Lote: {row['lote_num']}\n")
+        else:
+            doc.add_paragraph().add_run(f"Quadra: {row['quadra']} - Lote: {row['lote_num']}").bold = True
+            p_info = doc.add_paragraph()
+        p_info.add_run(f"Área: {_fmt_num_br(geom.area, 2)} m²\n")
+        p_info.add_run(f"Perímetro: {_fmt_num_br(geom.length, 2)} m\n")
+        doc.add_paragraph()
+
+        texto = [
+            f"O lote de terreno sob nº {row['lote_num']} da Quadra {row['quadra']}, "
+            f"do Núcleo denominado “{nucleo}”, no município de {municipio} - {uf}, "
+            f"apresenta área de {_fmt_num_br(geom.area, 2)} m² e um perímetro de {_fmt_num_br(geom.length, 2)} m."
+        ]
+        if individual:
+            c = geom.centroid
+            texto.append(
+                f"Para fins de localização, toma-se como referência um ponto interno do lote, "
+                f"com coordenadas aproximadas E = {_fmt_coord(c.x)} m e N = {_fmt_coord(c.y)} m, "
+                f"no sistema de referência do projeto."
+            )
+        texto += [
+            f"Para quem de dentro do lote {row['lote_num']} olha para {row['Conf_Frente']}, "
+            f"inicia-se a descrição pela frente, com rumo {row['Rumo_Frente']} "
+            f"e distância de {_fmt_num_br(row['Comp_Frente'], 2)} m, confrontando com {row['Conf_Frente']}.",
+            f"Deste ponto, deflete à direita, seguindo com rumo {row['Rumo_Direita']} "
+            f"e distância de {_fmt_num_br(row['Comp_Direita'], 2)} m, confrontando com {row['Conf_Direita']}.",
+            f"Em seguida, {'deflete novamente' if individual else 'deflete'}, seguindo pelos fundos com rumo "
+            f"{row['Rumo_Fundos']} e distância de {_fmt_num_br(row['Comp_Fundos'], 2)} m, "
+            f"confrontando com {row['Conf_Fundos']}.",
+            f"Por fim, deflete à esquerda, seguindo com rumo {row['Rumo_Esquerda']} "
+            f"e distância de {_fmt_num_br(row['Comp_Esquerda'], 2)} m, confrontando com {row['Conf_Esquerda']}, "
+            + ("retornando ao ponto inicial da descrição do perímetro do lote." if individual
+               else "retornando ao ponto inicial."),
+        ]
+        p_desc = doc.add_paragraph()
+        p_desc.paragraph_format.first_line_indent = Pt(12)
+        p_desc.add_run(" ".join(texto))
+        if not individual:
+            doc.add_paragraph()
+    doc.add_paragraph()
+    doc.add_paragraph().add_run(
+        "Todas as medidas lineares, áreas e rumos foram calculados no sistema de projeção "
+        "e datum adotados no projeto (ex.: SIRGAS2000 / UTM)."
+    )
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _conteudo_docx(dados: bytes):
+    """Texto, negrito e recuo de cada parágrafo, mais o texto das tabelas."""
+    from docx import Document
+
+    with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+        assert zf.testzip() is None
+    doc = Document(io.BytesIO(dados))
+    paragrafos = [
+        (p.text, [bool(r.bold) for r in p.runs], p.paragraph_format.first_line_indent, p.alignment)
+        for p in doc.paragraphs
+    ]
+    tabelas = [[[c.text for c in linha.cells] for linha in t.rows] for t in doc.tables]
+    return paragrafos, tabelas
+
+
+@unittest.skipUnless(TEM_GEO and importlib.util.find_spec("docx"), "geopandas/python-docx indisponíveis")
+class MemorialDocxTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def test_quadras_em_paralelo_iguais_ao_serial(self):
+        from .memorial_docx import renderizar_memoriais_quadras
+
+        gdf = _lotes_memorial()
+        serial = renderizar_memoriais_quadras(gdf, self.tmp / "serial", "Centro", "Condeúba", "BA", max_workers=1)
+        paralelo = renderizar_memoriais_quadras(gdf, self.tmp / "paralelo", "Centro", "Condeúba", "BA", max_workers=2)
+
+        self.assertEqual([p.name for p in serial], [p.name for p in paralelo])
+        self.assertEqual(
+            [p.name for p in serial],
+            ["memorial_quadra_A.docx", "memorial_quadra_B.docx", "memorial_quadra_C.docx"],
+        )
+        for a, b in zip(serial, paralelo):
+            self.assertEqual(_documento_xml(a), _documento_xml(b))
+
+    def test_quadra_igual_ao_python_docx(self):
+        from .memorial_docx import iterar_memoriais_quadras
+
+        gdf = _lotes_memorial()
+        gerados = dict(iterar_memoriais_quadras(gdf, "Centro", "Condeúba", "BA"))
+        self.assertEqual(sorted(gerados), ["memorial_quadra_A.docx", "memorial_quadra_B.docx", "memorial_quadra_C.docx"])
+        dados = b"".join(gerados["memorial_quadra_A.docx"])
+        lotes_a = gdf[gdf["quadra"] == "A"].sort_values(by="lote_num")
+        self.assertEqual(_conteudo_docx(dados), _conteudo_docx(_memorial_python_docx(lotes_a, "A")))
+
+    def test_lote_igual_ao_python_docx(self):
+        from .memorial_docx import iterar_memoriais_lotes
+
+        gdf = _lotes_memorial()
+        gerados = dict(iterar_memoriais_lotes(gdf, "Centro", "Condeúba", "BA"))
+        self.assertEqual(len(gerados), 5)
+        dados = b"".join(gerados["memorial_quadra_C_lote_2.docx"])
+        lote = gdf[(gdf["quadra"] == "C") & (gdf["lote_num"] == 2)]
+        self.assertEqual(_conteudo_docx(dados), _conteudo_docx(_memorial_python_docx(lote, "C", individual=True)))
+
+    def test_lote_sem_quadra_nao_tem_linha_da_quadra(self):
+        from .memorial_docx import MemorialTemplate, iterar_memoriais_lotes
+
+        gdf = _lotes_memorial().iloc[[0]].copy()
+        gdf["quadra"] = None
+        (nome, partes), = iterar_memoriais_lotes(gdf, "Centro", "Condeúba", "BA")
+        dados = b"".join(partes)
+        self.assertNotIn(b"QUADRA", _documento_xml(io.BytesIO(dados)))
+        self.assertEqual(_conteudo_docx(dados), _conteudo_docx(_memorial_python_docx(gdf, None, individual=True)))
+
+        template = MemorialTemplate("N", "M", "BA")
+        self.assertIn(b"QUADRA 7 - ", template.documento_xml(7, ""))
+        self.assertNotIn(b"QUADRA", template.documento_xml(None, ""))
+
+    def test_texto_com_caracteres_de_xml(self):
+        from .memorial_docx import MemorialTemplate, iterar_memoriais_quadras
+
+        gdf = _lotes_memorial()
+        gdf["quadra"] = 'A&<"1">'
+        gdf["Conf_Frente"] = "Rua <Um> & Travessa 'Dois'"
+        dados = b"".join(dict(iterar_memoriais_quadras(gdf, "São João & Cia", "Condeúba", "BA"))[
+            'memorial_quadra_A&<"1">.docx'
+        ])
+        lotes = gdf.sort_values(by="lote_num")
+        esperado = _memorial_python_docx(lotes, 'A&<"1">', nucleo="São João & Cia")
+        self.assertEqual(_conteudo_docx(dados), _conteudo_docx(esperado))
+
+        # o template escapa a quadra do cabeçalho e o XML continua válido
+        template = MemorialTemplate("N", "M", "BA")
+        self.assertIn(b"QUADRA &lt;Q&gt;", template.documento_xml("<Q>", ""))
+
+    def test_celulas_vazias_nao_viram_nan(self):
+        from docx import Document
+        from .memorial_docx import iterar_memoriais_lotes, tabela_memorial
+
+        gdf = _lotes_memorial().iloc[:1].copy()
+        gdf["Comp_Direita"] = float("nan")
+        gdf["Conf_Fundos"] = None
+        tabela = tabela_memorial(gdf)
+        self.assertIsNone(tabela["Comp_Direita"][0])
+        self.assertIsNone(tabela["Conf_Fundos"][0])
+        self.assertEqual(tabela["Comp_Frente"], [10.0])
+
+        (_, chunks), = iterar_memoriais_lotes(gdf, "Centro", "Condeúba", "BA")
+        texto = "\n".join(p.text for p in Document(io.BytesIO(b"".join(chunks))).paragraphs)
+        self.assertNotRegex(texto.lower(), r"\bnan\b")
+        self.assertIn("pela frente", texto)
+        self.assertNotIn("deflete à direita", texto)
+        self.assertNotIn("pelos fundos", texto)
+        self.assertIn("deflete à esquerda", texto)
+
+
+@unittest.skipUnless(TEM_GEO and importlib.util.find_spec("docx"), "geopandas/python-docx indisponíveis")
+class DownloadMemoriaisTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        (self.tmp / "final").mkdir()
+        _lotes_memorial().to_file(self.tmp / "final" / "final_medidas_azimutes.gpkg", driver="GPKG")
+
+    def _baixar(self, base_dir=None, **params):
+        if base_dir is not None:
+            session = self.client.session
+            session["base_dir"] = str(base_dir)
+            session.save()
+        return self.client.get(reverse("download_memoriais_zip"), params)
+
+    def test_zip_das_quadras_pedidas(self):
+        response = self._baixar(self.tmp, quadra="A,C", tipo="quadra")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ["memorial_quadra_A.docx", "memorial_quadra_C.docx"])
+
+        response = self._baixar(quadra="B")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertEqual(zf.namelist(), ["memorial_quadra_B_lote_1.docx"])
+
+    def test_erros_com_status(self):
+        self.assertEqual(self._baixar().status_code, 404)
+        self.assertEqual(self._baixar(self.tmp, quadra="Z").status_code, 404)
+        self.assertEqual(self._baixar(self.tmp / "outro").status_code, 404)
+
+        sem_quadra = self.tmp / "sem_quadra"
+        (sem_quadra / "final").mkdir(parents=True)
+        _lotes_memorial().drop(columns="quadra").to_file(sem_quadra / "final" / "final_gpkg.gpkg", driver="GPKG")
+        self.assertEqual(self._baixar(sem_quadra).status_code, 409)
+
+
+class PacoteQFieldTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.projeto = self.tmp / "project_cloud.qgs"
+        self.projeto.write_text("<qgis/>", encoding="utf-8")
+        (self.tmp / "final").mkdir()
+        (self.tmp / "final" / "lotes.gpkg").write_bytes(b"gpkg")
+        (self.tmp / "final" / "lotes.gpkg-journal").write_bytes(b"x")
+        (self.tmp / "ortofoto").mkdir()
+        (self.tmp / "ortofoto" / "orto.tif").write_bytes(b"tif" * 1000)
+        (self.tmp / "ruas eixos.gpkg").write_bytes(b"ruas")
+
+    def test_arcnames_sem_copiar(self):
+        arquivos = organize_files_for_qfield.arquivos_do_pacote(self.projeto, ["final", "ruas", "quadras", "ortofoto"])
+        self.assertEqual(
+            [(str(c.relative_to(self.tmp)), a) for c, a in arquivos],
+            [("project_cloud.qgs", "project_cloud.qgs"), ("final/lotes.gpkg", "final/lotes.gpkg"),
+             ("ruas eixos.gpkg", "ruas/eixos.gpkg"), ("ortofoto/orto.tif", "ortofoto/orto.tif")],
+        )
+
+    def test_staging_com_hardlinks_pode_repetir(self):
+        destino = self.tmp / "qfield_export"
+        for _ in range(2):
+            organize_files_for_qfield.package_project_for_qfield(self.projeto, destino, ["final", "ortofoto"])
+        orto = destino / "ortofoto" / "orto.tif"
+        self.assertTrue(orto.samefile(self.tmp / "ortofoto" / "orto.tif"))
+        self.assertTrue((destino / "final" / "lotes.gpkg-journal").exists())
+
+
+class PacoteCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        (self.tmp / "project_cloud.qgs").write_text("<qgis>" + "x" * 5000 + "</qgis>", encoding="utf-8")
+        (self.tmp / "final").mkdir()
+        (self.tmp / "final" / "final_gpkg.gpkg").write_bytes(b"lotes " * 2000)
+        (self.tmp / "ortofoto").mkdir()
+        (self.tmp / "ortofoto" / "orto.tif").write_bytes(os.urandom(200_000))
+        session = self.client.session
+        session["base_dir"] = str(self.tmp)
+        session.save()
+
+    def _baixar(self, **headers):
+        response = self.client.get(reverse("download_pacote_zip"), headers=headers)
+        dados = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, dados
+
+    def _conteudo(self, dados):
+        with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+            self.assertIsNone(zf.testzip())
+            return {n: zf.read(n) for n in zf.namelist()}
+
+    def test_etag_e_reaproveitamento(self):
+        r1, z1 = self._baixar()
+        self.assertEqual(r1.status_code, 200)
+        self.assertNotIn("Content-Length", r1)
+        etag = r1["ETag"]
+
+        r2, z2 = self._baixar()
+        self.assertEqual((r2["ETag"], r2["Content-Length"]), (etag, str(len(z1))))
+        self.assertEqual(self._conteudo(z2), self._conteudo(z1))
+
+        self.assertEqual(self._baixar(If_None_Match=etag)[0].status_code, 304)
+
+        (self.tmp / "final" / "final_gpkg.gpkg").write_bytes(b"lotes alterados " * 2000)
+        r3, z3 = self._baixar(If_None_Match=etag)
+        self.assertEqual(r3.status_code, 200)
+        self.assertNotEqual(r3["ETag"], etag)
+        conteudo = self._conteudo(z3)
+        self.assertEqual(conteudo["final/final_gpkg.gpkg"], b"lotes alterados " * 2000)
+        self.assertEqual(conteudo["ortofoto/orto.tif"], (self.tmp / "ortofoto" / "orto.tif").read_bytes())
+        self.assertEqual(len(list((self.tmp / pacote_qfield.DIR_CACHE).glob("pacote-*.zip"))), 1)
+
+
+    def test_range_retoma_download(self):
+        from unittest import mock
+
+        _, completo = self._baixar()
+        r, parte = self._baixar(Range="bytes=10-99")
+        self.assertEqual((r.status_code, r["Content-Range"]), (206, f"bytes 10-99/{len(completo)}"))
+        self.assertEqual(parte, completo[10:100])
+        self.assertEqual(self._baixar(Range="bytes=-50", If_Range=r["ETag"])[1], completo[-50:])
+        self.assertEqual(self._baixar(Range="bytes=10-", If_Range='"outra-versao"')[1], completo)
+        self.assertEqual(self._baixar(Range=f"bytes={len(completo)}-")[0].status_code, 416)
+
+        # pacote desatualizado + Range: não espera montar; manda o ZIP inteiro em streaming
+        (self.tmp / "project_cloud.qgs").write_text("<qgis>novo</qgis>", encoding="utf-8")
+        with mock.patch.object(pacote_qfield, "construir_pacote") as construir:
+            r, novo = self._baixar(Range="bytes=0-3")
+        construir.assert_not_called()
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn("Content-Range", r)
+        self.assertEqual(self._conteudo(novo)["project_cloud.qgs"], b"<qgis>novo</qgis>")
+        r, parte = self._baixar(Range="bytes=0-3")
+        self.assertEqual((r.status_code, parte), (206, b"PK\x03\x04"))
+
+    def test_envio_delegado_ao_nginx(self):
+        with override_settings(QGIS_DOWNLOAD_OFFLOAD="x-accel", MEDIA_ROOT=self.tmp.parent):
+            # o primeiro download monta o pacote em streaming; os seguintes vão pelo nginx
+            primeiro, completo = self._baixar()
+            r, dados = self._baixar()
+        self.assertNotIn("X-Accel-Redirect", primeiro)
+        self.assertTrue(completo.startswith(b"PK"))
+        self.assertEqual(dados, b"")
+        self.assertRegex(r["X-Accel-Redirect"], rf"^/_media_interna/{self.tmp.name}/\.pacote_qfield/pacote-\w+\.zip$")
+
+    def test_chave_sem_ler_o_conteudo(self):
+        from unittest import mock
+
+        arquivos = views._arquivos_do_pacote(self.tmp)
+        # a chave sai só do stat: a ortofoto não é lida na requisição
+        with mock.patch("builtins.open", side_effect=AssertionError("arquivo lido")):
+            pacote = pacote_qfield.preparar_pacote(self.tmp, arquivos)
+        self.assertEqual(pacote_qfield.preparar_pacote(self.tmp, arquivos).chave, pacote.chave)
+
+        orto = self.tmp / "ortofoto" / "orto.tif"
+        os.utime(orto, ns=(orto.stat().st_atime_ns, orto.stat().st_mtime_ns + 10**9))
+        self.assertNotEqual(pacote_qfield.preparar_pacote(self.tmp, arquivos).chave, pacote.chave)
+
+    def test_desconexao_termina_o_pacote(self):
+        pacote = pacote_qfield.preparar_pacote(self.tmp, views._arquivos_do_pacote(self.tmp))
+        partes = pacote_qfield.gerar_pacote(pacote, bloco=1024)
+        next(partes)
+        partes.close()
+        self.assertTrue(pacote.pronto)
+        self.assertEqual(self._conteudo(pacote.arquivo.read_bytes())["ortofoto/orto.tif"],
+                         (self.tmp / "ortofoto" / "orto.tif").read_bytes())
+
+class PoliticaCompressaoTests(SimpleTestCase):
+    def _tiff(self, compressao, ordem="<", assinatura=b"II"):
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        caminho = tmp / "orto.tif"
+        ifd = struct.pack(ordem + "H", 1) + struct.pack(ordem + "HHIHH", 259, 3, 1, compressao, 0) + b"\0" * 4
+        caminho.write_bytes(assinatura + struct.pack(ordem + "HI", 42, 8) + ifd)
+        return caminho
+
+    def test_armazena_so_o_que_ja_e_comprimido(self):
+        self.assertEqual(pacote_qfield.metodo_compressao(self._tiff(7)), zipfile.ZIP_STORED)
+        self.assertEqual(pacote_qfield.metodo_compressao(self._tiff(7, ">", b"MM")), zipfile.ZIP_STORED)
+        self.assertEqual(pacote_qfield.metodo_compressao(self._tiff(1)), zipfile.ZIP_DEFLATED)
+        self.assertEqual(pacote_qfield.metodo_compressao(Path("final/final_gpkg.gpkg")), zipfile.ZIP_DEFLATED)
+        self.assertEqual(pacote_qfield.metodo_compressao(Path("project_cloud.qgs")), zipfile.ZIP_DEFLATED)
+
+
+class _ServidorQFieldCloud(ThreadingHTTPServer):
+    """Imitação local da API: login (um token novo a cada vez), criação de projeto e upload com respostas roteirizadas."""
+
+    def __init__(self, roteiro):
+        super().__init__(("127.0.0.1", 0), _TratadorQFieldCloud)
+        self.roteiro = roteiro  # caminho remoto → lista de (status, cabeçalhos) antes do 201
+        self.recebidos = {}
+        self.etags = {}  # caminho remoto → ETag listado no lugar do md5 (ex.: multipart)
+        self.apagados = []
+        self.autorizacoes = set()
+        self.ordem = []
+        self.projetos_criados = 0
+        self.logins = 0
+        self.token = None
+
+
+class _TratadorQFieldCloud(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo=b"{}", cabecalhos=None):
+        self.send_response(status)
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _autorizado(self):
+        return self.headers.get("Authorization") == f"token {self.server.token}"
+
+    def do_POST(self):
+        corpo = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/api/v1/auth/login/":
+            self.server.logins += 1
+            self.server.token = f"t{self.server.logins}"
+            return self._responder(200, json.dumps({"token": self.server.token}).encode())
+        if not self._autorizado():
+            return self._responder(401, b'{"detail": "Invalid token."}')
+        if self.path == "/api/v1/projects/":
+            self.server.projetos_criados += 1
+            return self._responder(201, b'{"id": "p1"}')
+        remoto = unquote(self.path.removeprefix("/api/v1/files/p1/").rstrip("/"))
+        self.server.autorizacoes.add(self.headers.get("Authorization"))
+        respostas = self.server.roteiro.get(remoto, [])
+        if respostas:
+            status, cabecalhos = respostas.pop(0)
+            return self._responder(status, b'{"detail": "erro"}', cabecalhos)
+        self.server.recebidos[remoto] = corpo.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+        self.server.ordem.append(remoto)
+        self._responder(201)
+
+    def do_GET(self):
+        if not self._autorizado():
+            return self._responder(401, b'{"detail": "Invalid token."}')
+        if self.path == "/api/v1/projects/p1/":
+            return self._responder(200, b'{"id": "p1"}') if self.server.projetos_criados else self._responder(404)
+        if self.path == "/api/v1/files/p1/":
+            arquivos = [{"name": n, "size": len(d), "md5sum": self.server.etags.get(n, hashlib.md5(d).hexdigest())}
+                        for n, d in self.server.recebidos.items()]
+            return self._responder(200, json.dumps(arquivos).encode())
+        self._responder(404)
+
+    def do_DELETE(self):
+        if not self._autorizado():
+            return self._responder(401, b'{"detail": "Invalid token."}')
+        remoto = unquote(self.path.removeprefix("/api/v1/files/p1/").rstrip("/"))
+        if self.server.recebidos.pop(remoto, None) is None:
+            return self._responder(404)
+        self.server.apagados.append(remoto)
+        self._responder(204, b"")
+
+
+class EnvioQFieldCloudTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.addCleanup(envio_qfieldcloud._clientes.clear)
+        self.arquivos = []
+        for remoto in ("final/lotes.gpkg", "ruas/ruas.gpkg", "ortofoto/orto 1.tif", "quadras/q.gpkg", "project_cloud.qgs"):
+            local = self.tmp / remoto
+            local.parent.mkdir(parents=True, exist_ok=True)
+            local.write_bytes(os.urandom(50_000))
+            self.arquivos.append((local, remoto))
+
+    def _servidor(self, roteiro):
+        servidor = _ServidorQFieldCloud(roteiro)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        return servidor
+
+    def test_paralelo_com_429_5xx_e_erro_definitivo(self):
+        servidor = self._servidor({
+            "final/lotes.gpkg": [(429, {"Retry-After": "1"})],
+            "ruas/ruas.gpkg": [(503, {}), (502, {})],
+            "quadras/q.gpkg": [(400, {})] * 5,
+        })
+        cliente = envio_qfieldcloud.ClienteQFieldCloud(url=f"http://127.0.0.1:{servidor.server_port}/api/v1")
+        cliente.login("u", "s")
+        self.assertEqual(cliente.criar_projeto("Teste", "org")["id"], "p1")
+
+        estados = []
+        inicio = time.monotonic()
+        resultado = envio_qfieldcloud.enviar_arquivos(cliente, "p1", self.arquivos, ao_progredir=estados.append,
+                                                      threads=3, tentativas=4, espera_base=0.01)
+        self.assertGreaterEqual(time.monotonic() - inicio, 1.0)  # respeitou o Retry-After
+
+        self.assertEqual(list(resultado.falhas), ["quadras/q.gpkg"])
+        self.assertEqual(len(servidor.roteiro["quadras/q.gpkg"]), 4)  # 400 não é repetido
+        self.assertEqual(sorted(resultado.enviados), sorted(r for _, r in self.arquivos if r != "quadras/q.gpkg"))
+        for local, remoto in self.arquivos:
+            if remoto in servidor.recebidos:
+                self.assertIn(local.read_bytes(), servidor.recebidos[remoto])
+        self.assertEqual(servidor.ordem[-1], "project_cloud.qgs")
+        self.assertEqual(servidor.autorizacoes, {"token t1"})
+        self.assertEqual((estados[-1]["concluidos"], estados[-1]["falhas"]), (5, 1))
+        self.assertEqual(resultado.bytes_enviados, 4 * 50_000)
+
+
+    def test_sincronizacao_so_envia_o_que_mudou(self):
+        servidor = self._servidor({})
+        cliente = envio_qfieldcloud.ClienteQFieldCloud(url=f"http://127.0.0.1:{servidor.server_port}/api/v1/",
+                                                       usuario="u", senha="s")
+
+        def sincronizar(**kwargs):
+            return envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org",
+                                                         **kwargs)
+
+        project_id, resultado = sincronizar()
+        self.assertEqual((project_id, len(resultado.enviados), resultado.ignorados), ("p1", 5, []))
+
+        (self.tmp / "final" / "lotes.gpkg").write_bytes(b"lote corrigido")
+        project_id, resultado = sincronizar()
+        self.assertEqual((project_id, resultado.enviados), ("p1", ["final/lotes.gpkg"]))
+        self.assertEqual(len(resultado.ignorados), 4)
+        self.assertEqual(servidor.recebidos["final/lotes.gpkg"], b"lote corrigido")
+        self.assertEqual(servidor.projetos_criados, 1)
+
+        _, resultado = sincronizar(novo=True)
+        self.assertEqual((servidor.projetos_criados, len(resultado.enviados)), (2, 5))
+
+    def test_sincronizacao_apaga_o_que_saiu_do_projeto(self):
+        servidor = self._servidor({})
+        cliente = envio_qfieldcloud.ClienteQFieldCloud(url=f"http://127.0.0.1:{servidor.server_port}/api/v1/",
+                                                       usuario="u", senha="s")
+        envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        servidor.recebidos["DCIM/foto.jpg"] = b"foto de campo"  # enviada pelo QField, não é do projeto
+
+        restantes = [(l, r) for l, r in self.arquivos if r != "quadras/q.gpkg"]
+        _, resultado = envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, restantes, "Teste", "org")
+        self.assertEqual((resultado.enviados, resultado.apagados), ([], ["quadras/q.gpkg"]))
+        self.assertEqual(servidor.apagados, ["quadras/q.gpkg"])
+        self.assertIn("DCIM/foto.jpg", servidor.recebidos)
+
+    def test_etag_multipart_diferente_nao_reenvia(self):
+        servidor = self._servidor({})
+        cliente = envio_qfieldcloud.ClienteQFieldCloud(url=f"http://127.0.0.1:{servidor.server_port}/api/v1/",
+                                                       usuario="u", senha="s")
+        envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        # o storage recalculou o ETag com partes de outro tamanho
+        servidor.etags["ortofoto/orto 1.tif"] = "0" * 32 + "-3"
+
+        _, resultado = envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        self.assertEqual(resultado.enviados, [])
+
+        (self.tmp / "ortofoto" / "orto 1.tif").write_bytes(os.urandom(50_000))
+        _, resultado = envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        self.assertEqual(resultado.enviados, ["ortofoto/orto 1.tif"])
+
+    def test_sha256_tem_preferencia_sobre_o_etag(self):
+        etag, sha = envio_qfieldcloud._somas_arquivo(self.arquivos[0][0])
+        igual = envio_qfieldcloud._igual_no_servidor
+        self.assertTrue(igual({"sha256": sha, "md5sum": "outro"}, etag, sha))
+        self.assertFalse(igual({"sha256": "0" * 64, "md5sum": etag}, etag, sha))
+        self.assertFalse(igual({"md5sum": "0" * 32}, etag, sha))
+        self.assertIsNone(igual({"md5sum": "0" * 32 + "-2"}, etag, sha))
+
+    def _configurar(self, servidor, **extra):
+        ajuste = override_settings(QFIELDCLOUD_URL=f"http://127.0.0.1:{servidor.server_port}/api/v1/",
+                                   QFIELDCLOUD_USUARIO="u", QFIELDCLOUD_SENHA="s", QFIELDCLOUD_TOKEN="",
+                                   PROGRESSO_DIR=self.tmp / "progresso", **extra)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def test_cliente_compartilhado_reaproveita_e_renova_token(self):
+        servidor = self._servidor({})
+        self._configurar(servidor, QFIELDCLOUD_TOKEN_VALIDADE=3600)
+        cliente = envio_qfieldcloud.cliente_compartilhado()
+        self.assertIs(envio_qfieldcloud.cliente_compartilhado(), cliente)
+
+        envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        (self.tmp / "final" / "lotes.gpkg").write_bytes(b"lote corrigido")
+        envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        self.assertEqual(servidor.logins, 1)
+
+        servidor.token = "revogado"  # o servidor passa a recusar o token guardado
+        (self.tmp / "ruas" / "ruas.gpkg").write_bytes(b"rua corrigida")
+        _, resultado = envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        self.assertEqual((servidor.logins, resultado.enviados, resultado.falhas), (2, ["ruas/ruas.gpkg"], {}))
+
+        with override_settings(QFIELDCLOUD_TOKEN_VALIDADE=0):
+            envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos, "Teste", "org")
+        self.assertGreaterEqual(servidor.logins, 3)
+
+    def test_envio_roda_como_job(self):
+        servidor = self._servidor({})
+        self._configurar(servidor)
+        session = self.client.session
+        session["base_dir"] = str(self.tmp)
+        session["job_id_canal"] = 7
+        session.save()
+
+        dados = self.client.post(reverse("exportar_qfield")).json()
+        self.assertEqual(dados["status"], "sucesso")
+        self.assertEqual(servidor.logins, 0)  # nada sobe durante o request
+        job = Job.objects.get(pk=dados["job_id"])
+        self.assertEqual(job.tipo, Job.TIPO_QFIELDCLOUD)
+        self.assertEqual(self.client.session["job_id_qfield"], job.pk)
+
+        jobs.executar_job(job)
+        estado = progresso_bus.ler(progresso_bus.canal_qfield(7))
+        self.assertTrue(estado["final"])
+        self.assertEqual(estado["projeto_id"], "p1")
+        self.assertEqual(sorted(servidor.recebidos), sorted(r for _, r in self.arquivos))
+
+    def test_envio_so_por_post(self):
+        servidor = self._servidor({})
+        self._configurar(servidor)
+        session = self.client.session
+        session["base_dir"] = str(self.tmp)
+        session["job_id_canal"] = 7
+        session.save()
+
+        # um GET (link, prefetch, crawler) não dispara envio nenhum
+        for rota in ("exportar_qfield", "baixar_e_enviar_qfieldcloud"):
+            self.assertEqual(self.client.get(reverse(rota)).status_code, 405)
+        self.assertFalse(Job.objects.exists())
+
+        response = self.client.post(reverse("baixar_e_enviar_qfieldcloud"))
+        self.assertEqual(response["Content-Type"], "application/zip")
+        b"".join(response.streaming_content)
+        job = Job.objects.get(tipo=Job.TIPO_QFIELDCLOUD)
+        self.assertEqual(self.client.session["job_id_qfield"], job.pk)
+
+    def test_envio_cancelado_para_entre_arquivos(self):
+        servidor = self._servidor({})
+        self._configurar(servidor)
+        cliente = envio_qfieldcloud.cliente_compartilhado()
+        envio_qfieldcloud.sincronizar_projeto(cliente, self.tmp, self.arquivos[:2], "Teste", "org")
+        servidor.recebidos["quadras/antigo.gpkg"] = b"fora do projeto"
+
+        job = jobs.enfileirar_job(self.tmp, tipo=Job.TIPO_QFIELDCLOUD, canal="qfield-teste")
+        job = jobs.reivindicar_job("teste:1")
+        enviar = envio_qfieldcloud.enviar_arquivos
+
+        def enviar_um_por_vez(*args, ao_progredir, **kwargs):
+            def progredir(estado):
+                ao_progredir(estado)
+                # o cancelamento (o arquivo que cancelar_job cria) chega depois do primeiro arquivo
+                if estado["concluidos"] == 1:
+                    pedido = jobs._arquivo_cancelamento(job.pk)
+                    pedido.parent.mkdir(parents=True, exist_ok=True)
+                    pedido.touch()
+            return enviar(*args, ao_progredir=progredir, **{**kwargs, "threads": 1})
+
+        from unittest import mock
+        with mock.patch.object(envio_qfieldcloud, "enviar_arquivos", enviar_um_por_vez):
+            with self.assertRaises(jobs.JobInterrompido) as erro:
+                jobs.executar_job(job)
+
+        self.assertEqual(erro.exception.motivo, "Cancelado pelo usuário.")
+        self.assertEqual(len(servidor.ordem), 2 + 1)  # os dois da primeira sincronização e um deste job
+        self.assertNotIn("project_cloud.qgs", servidor.recebidos)
+        self.assertEqual(servidor.apagados, [])  # o projeto remoto não perde nada no meio do envio
+        estado = progresso_bus.ler("qfield-teste")
+        self.assertTrue(estado["final"])
+        self.assertEqual(estado["etapa_interrompida"], 1)
+
+
+class UploadParcialTests(TestCase):
+    PARTE = 1000
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=self.tmp, PROGRESSO_DIR=self.tmp / "progresso")
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.dxf = os.urandom(2500)
+        self.orto = os.urandom(1500)
+
+    def _descrever(self, nome, dados):
+        partes = [hashlib.sha256(dados[i:i + self.PARTE]).hexdigest() for i in range(0, len(dados), self.PARTE)]
+        return {"nome": nome, "tamanho": len(dados), "tamanho_parte": self.PARTE,
+                "soma": upload_parcial.soma_das_partes(partes)}
+
+    def _iniciar(self, **arquivos):
+        resposta = self.client.post(reverse("iniciar_upload_partes"), json.dumps(arquivos),
+                                    content_type="application/json")
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        return resposta.json()["uploads"]
+
+    def _parte(self, upload_id, dados, offset, soma=None):
+        pedaco = dados[offset:offset + self.PARTE]
+        headers = {"Upload-Offset": str(offset)}
+        if soma is not False:
+            digest = hashlib.sha256(soma or pedaco).digest()
+            headers["Upload-Checksum"] = "sha256 " + base64.b64encode(digest).decode()
+        return self.client.patch(reverse("upload_parte", args=[upload_id]), pedaco,
+                                 content_type="application/offset+octet-stream", headers=headers)
+
+    def test_dxf_completo_enfileira_com_ortofoto_ainda_chegando(self):
+        uploads = self._iniciar(arquivo=self._descrever("../../obra.dxf", self.dxf),
+                                ortofoto=self._descrever("orto.ecw", self.orto))
+        dxf_id, orto_id = uploads["arquivo"]["id"], uploads["ortofoto"]["id"]
+
+        self.assertEqual(self._parte(dxf_id, self.dxf, 0).json()["offset"], 1000)
+        # parte repetida (a resposta anterior se perdeu): 409 com o offset confirmado
+        repetida = self._parte(dxf_id, self.dxf, 0)
+        self.assertEqual((repetida.status_code, repetida["Upload-Offset"]), (409, "1000"))
+        corrompida = self._parte(dxf_id, self.dxf, 1000, soma=b"outra coisa")
+        self.assertEqual((corrompida.status_code, corrompida.json()["offset"]), (460, 1000))
+        self.assertEqual(self.client.head(reverse("upload_parte", args=[dxf_id]))["Upload-Offset"], "1000")
+
+        self._parte(dxf_id, self.dxf, 1000)
+        self.assertFalse(Job.objects.exists())
+        self._parte(orto_id, self.orto, 0)
+        fim = self._parte(dxf_id, self.dxf, 2000, soma=False).json()
+
+        job = Job.objects.get(pk=fim["job_id"])
+        upload_dir = Path(self.client.session["base_dir"])
+        self.assertEqual(upload_dir.parent, self.tmp / "uploads")
+        self.assertEqual((upload_dir / "obra.dxf").read_bytes(), self.dxf)
+        self.assertEqual(job.parametros["dxf_path"], str(upload_dir / "obra.dxf"))
+        self.assertEqual(job.parametros["ortho_path"], str(upload_dir / "ortofoto" / "orto.ecw"))
+        self.assertEqual(job.parametros["ortho_upload"], orto_id)
+        self.assertEqual(self.client.session["job_id_canal"], job.pk)
+
+        self._parte(orto_id, self.orto, 1000)
+        orto = UploadParcial.objects.get(pk=orto_id)
+        self.assertEqual(orto.status, UploadParcial.Status.CONCLUIDO)
+        self.assertEqual(Path(orto.destino).read_bytes(), self.orto)
+        self.assertFalse(Path(orto.destino + ".parcial").exists())
+
+    def test_soma_final_errada_e_outra_sessao(self):
+        descricao = self._descrever("obra.dxf", self.dxf)
+        descricao["soma"] = hashlib.sha256(b"outro arquivo").hexdigest()
+        dxf_id = self._iniciar(arquivo=descricao)["arquivo"]["id"]
+
+        outro = self.client_class()
+        self.assertEqual(outro.head(reverse("upload_parte", args=[dxf_id])).status_code, 404)
+
+        for offset in (0, 1000):
+            self._parte(dxf_id, self.dxf, offset)
+        self.assertEqual(self._parte(dxf_id, self.dxf, 2000).status_code, 422)
+        self.assertEqual(UploadParcial.objects.get(pk=dxf_id).status, UploadParcial.Status.FALHOU)
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(list(Path(self.client.session["base_dir"]).iterdir()), [])
+
+
+class DescompactarTests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=self.tmp, PROGRESSO_DIR=self.tmp / "progresso")
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.dxf = b"0\nSECTION\n2\nENTITIES\n" + b"0\nLINE\n8\nLOTES\n10\n1.0\n20\n2.0\n" * 2000
+
+    def _zip(self, membros):
+        dados = io.BytesIO()
+        with zipfile.ZipFile(dados, "w", zipfile.ZIP_DEFLATED) as zf:
+            for nome, conteudo in membros.items():
+                zf.writestr(nome, conteudo)
+        return dados.getvalue()
+
+    def test_pacote_zip_com_dxf_e_ortofoto(self):
+        pacote = self._zip({"obra/Obra.dxf": self.dxf, "obra/orto.tif": b"II*\0tiff", "obra/orto.tfw": b"0.1\n",
+                            "obra/leiame.txt": b"x", "__MACOSX/obra/._Obra.dxf": b"lixo"})
+        arquivo = io.BytesIO(pacote)
+        arquivo.name = "obra.zip"
+        dados = self.client.post(reverse("criar_projeto_qgis"), {"arquivo": arquivo}).json()
+        self.assertEqual(dados["status"], "sucesso", dados)
+
+        upload_dir = Path(self.client.session["base_dir"])
+        self.assertTrue(upload_dir.name.startswith("obra_"))
+        parametros = Job.objects.get(pk=dados["job_id"]).parametros
+        self.assertEqual(parametros["dxf_path"], str(upload_dir / "Obra.dxf"))
+        self.assertEqual(parametros["ortho_path"], str(upload_dir / "ortofoto" / "orto.tif"))
+        self.assertEqual((upload_dir / "Obra.dxf").read_bytes(), self.dxf)
+        self.assertEqual(sorted(p.name for p in upload_dir.rglob("*") if p.is_file()),
+                         ["Obra.dxf", "orto.tfw", "orto.tif"])
+
+    def test_dxf_gz_em_partes(self):
+        comprimido = gzip.compress(self.dxf)
+        soma = upload_parcial.soma_das_partes([hashlib.sha256(comprimido).hexdigest()])
+        resposta = self.client.post(reverse("iniciar_upload_partes"), json.dumps({"arquivo": {
+            "nome": "obra.dxf.gz", "tamanho": len(comprimido), "tamanho_parte": len(comprimido), "soma": soma,
+        }}), content_type="application/json")
+        upload_id = resposta.json()["uploads"]["arquivo"]["id"]
+        fim = self.client.patch(reverse("upload_parte", args=[upload_id]), comprimido,
+                                content_type="application/offset+octet-stream", headers={"Upload-Offset": "0"}).json()
+
+        # o PATCH só enfileira; a extração é a primeira etapa do job
+        upload_dir = Path(self.client.session["base_dir"])
+        compactado = Job.objects.get(pk=fim["job_id"]).parametros["compactado"]
+        self.assertEqual(compactado, str(upload_dir / "obra.dxf.gz"))
+        self.assertFalse((upload_dir / "obra.dxf").exists())
+
+        dxf_path, ortho_path = descompactar.descompactar_arquivo(compactado, upload_dir)
+        self.assertEqual((dxf_path, ortho_path), (upload_dir / "obra.dxf", None))
+        self.assertEqual(dxf_path.read_bytes(), self.dxf)
+        self.assertFalse((upload_dir / "obra.dxf.gz").exists())
+
+    def test_arquivo_recusado_nao_deixa_diretorio(self):
+        uploads = self.tmp / "uploads"
+        for nome, dados in (("obra.zip", self._zip({"a.dxf": self.dxf, "b.dxf": self.dxf})),
+                            ("obra.zip", b"nao e zip"),
+                            ("obra.txt.gz", gzip.compress(b"texto"))):
+            arquivo = io.BytesIO(dados)
+            arquivo.name = nome
+            resposta = self.client.post(reverse("criar_projeto_qgis"), {"arquivo": arquivo}).json()
+            self.assertEqual(resposta["status"], "erro", nome)
+            self.assertIsNone(self.client.session["base_dir"])
+            self.assertEqual(list(uploads.iterdir()), [], nome)
+
+        # upload em partes recusado já na declaração
+        resposta = self.client.post(reverse("iniciar_upload_partes"), json.dumps({"arquivo": {
+            "nome": "obra.zip", "tamanho": 10, "tamanho_parte": 10, "soma": "x",
+        }}), content_type="application/json")
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(list(uploads.iterdir()), [])
+        self.assertFalse(Job.objects.exists())
+
+    def test_caminhos_do_zip_nao_escapam_do_diretorio(self):
+        destino = self.tmp / "job"
+        destino.mkdir()
+        pacote = io.BytesIO(self._zip({"../../fora.dxf": self.dxf, "..\\..\\orto.ecw": b"ecw"}))
+        dxf_path, ortho_path = descompactar.descompactar_upload(pacote, "p.zip", destino)
+        self.assertEqual((dxf_path, ortho_path), (destino / "fora.dxf", destino / "ortofoto" / "orto.ecw"))
+        self.assertEqual(sorted(p.relative_to(self.tmp).as_posix() for p in self.tmp.rglob("*") if p.is_file()),
+                         ["job/fora.dxf", "job/ortofoto/orto.ecw"])
+
+        for membros in ({"a.dxf": b"1", "b.dxf": b"2"}, {"leiame.txt": b"x"}):
+            with self.assertRaises(upload_parcial.ErroUpload):
+                descompactar.descompactar_upload(io.BytesIO(self._zip(membros)), "p.zip", self.tmp / "outro")
+
+    def test_limites_durante_a_descompactacao(self):
+        destino = self.tmp / "job"
+        destino.mkdir()
+        bomba = io.BytesIO(gzip.compress(b"\0" * (40 * 2**20)))
+        with override_settings(QGIS_TAXA_COMPRESSAO_MAXIMA=50):
+            with self.assertRaises(upload_parcial.ErroUpload) as erro:
+                descompactar.descompactar_upload(bomba, "bomba.dxf.gz", destino)
+        self.assertEqual(erro.exception.status, 413)
+
+        with override_settings(QGIS_DESCOMPACTADO_MAXIMO=1000):
+            with self.assertRaises(upload_parcial.ErroUpload):
+                descompactar.descompactar_upload(io.BytesIO(self._zip({"obra.dxf": self.dxf})), "obra.zip", destino)
+        self.assertEqual(list(destino.iterdir()), [])  # nada parcial fica para trás
@@ -0,0 +1,137 @@
+"""
+Upload em partes (protocolo de offset no estilo do tus) direto para o
+diretório do job.
+
+O cliente declara cada arquivo (nome, tamanho, tamanho da parte e a soma:
+sha256 da concatenação dos sha256 das partes) e manda as partes em ordem,
+com o offset de cada uma. A parte é gravada na posição dela no arquivo de
+destino, sem passar pelo temporário do Django; o offset só avança depois da
+gravação, então uma parte interrompida é simplesmente reenviada. Quando a
+última parte chega, as somas das partes são conferidas com a soma declarada
+e o arquivo ganha o nome final.
+"""
+import hashlib
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import UploadParcial
+
+BLOCO_GRAVACAO = 1 << 20
+_RE_SOMA = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ErroUpload(Exception):
+    """Pedido de upload recusado; status é o código HTTP da resposta."""
+
+    def __init__(self, mensagem, status=400, offset=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.offset = offset
+
+
+def soma_das_partes(somas) -> str:
+    """sha256 da concatenação dos sha256 (hex) das partes, como o cliente calcula."""
+    return hashlib.sha256(b"".join(bytes.fromhex(s) for s in somas)).hexdigest()
+
+
+def _parcial(upload: UploadParcial) -> Path:
+    return Path(upload.destino + ".parcial")
+
+
+def iniciar_upload(upload_dir: Path, tipo: str, nome: str, tamanho: int, tamanho_parte: int, soma: str,
+                   session_key: str = "") -> UploadParcial:
+    """Registra o arquivo e cria o destino parcial vazio. A ortofoto vai para ortofoto/, como no upload simples."""
+    nome = Path(str(nome)).name  # só o nome: nada de caminhos vindos do cliente
+    if not nome or nome in (".", ".."):
+        raise ErroUpload("Nome de arquivo inválido.")
+    if tipo not in (UploadParcial.TIPO_DXF, UploadParcial.TIPO_ORTOFOTO):
+        raise ErroUpload(f"Tipo de arquivo desconhecido: {tipo}")
+    try:
+        tamanho, tamanho_parte = int(tamanho), int(tamanho_parte)
+    except (TypeError, ValueError):
+        raise ErroUpload("Tamanho inválido.")
+    if not 0 < tamanho <= settings.QGIS_UPLOAD_TAMANHO_MAXIMO:
+        raise ErroUpload(f"Arquivo maior que o permitido ({settings.QGIS_UPLOAD_TAMANHO_MAXIMO} bytes).", 413)
+    if not 0 < tamanho_parte <= settings.QGIS_UPLOAD_PARTE_MAXIMA:
+        raise ErroUpload(f"Parte maior que o permitido ({settings.QGIS_UPLOAD_PARTE_MAXIMA} bytes).")
+    if not _RE_SOMA.match(str(soma or "").lower()):
+        raise ErroUpload("Soma (sha256) ausente ou inválida.")
+
+    pasta = Path(upload_dir) / ("ortofoto" if tipo == UploadParcial.TIPO_ORTOFOTO else "")
+    pasta.mkdir(parents=True, exist_ok=True)
+    upload = UploadParcial.objects.create(
+        tipo=tipo,
+        session_key=session_key or "",
+        upload_dir=str(upload_dir),
+        destino=str(pasta / nome),
+        tamanho=tamanho,
+        tamanho_parte=tamanho_parte,
+        soma=soma.lower(),
+    )
+    _parcial(upload).touch()
+    print(f"📥 Upload {upload.id} iniciado: {nome} ({tamanho} bytes)")
+    return upload
+
+
+def gravar_parte(upload: UploadParcial, offset: int, corpo, tamanho: int, soma_parte: str = None) -> UploadParcial:
+    """
+    Grava a parte que começa em offset, lida de corpo (com .read(n)). Só a
+    parte esperada é aceita (409 com o offset atual, senão); soma_parte, se
+    vier, é o sha256 (hex) que o cliente calculou (460 se não bater). Na
+    última parte, confere a soma do arquivo e o move para o destino.
+    """
+    if upload.status != UploadParcial.Status.RECEBENDO:
+        raise ErroUpload("Upload já encerrado.", 409, upload.recebido)
+    if offset != upload.recebido:
+        raise ErroUpload(f"Offset esperado: {upload.recebido}.", 409, upload.recebido)
+    ultima = offset + tamanho == upload.tamanho
+    if offset + tamanho > upload.tamanho or (tamanho != upload.tamanho_parte and not ultima):
+        raise ErroUpload(f"A parte deve ter {upload.tamanho_parte} bytes (a última, o que faltar).")
+
+    h = hashlib.sha256()
+    falta = tamanho
+    # r+b: reescreve no lugar o que uma tentativa interrompida deixou depois do offset
+    with open(_parcial(upload), "r+b") as f:
+        f.seek(offset)
+        while falta > 0:
+            pedaco = corpo.read(min(BLOCO_GRAVACAO, falta))
+            if not pedaco:
+                break
+            f.write(pedaco)
+            h.update(pedaco)
+            falta -= len(pedaco)
+    if falta:
+        raise ErroUpload("Parte incompleta; reenvie a partir do mesmo offset.", 400, upload.recebido)
+    if soma_parte and h.hexdigest() != soma_parte.lower():
+        raise ErroUpload("Soma da parte não confere; reenvie.", 460, upload.recebido)
+
+    # avança só se ninguém gravou esta parte antes (duas tentativas simultâneas)
+    partes = upload.partes + [h.hexdigest()]
+    if not UploadParcial.objects.filter(pk=upload.pk, recebido=offset, status=UploadParcial.Status.RECEBENDO).update(
+        recebido=offset + tamanho, partes=partes, atualizado_em=timezone.now()
+    ):
+        upload.refresh_from_db()
+        raise ErroUpload(f"Offset esperado: {upload.recebido}.", 409, upload.recebido)
+    upload.recebido, upload.partes = offset + tamanho, partes
+
+    if ultima:
+        _concluir(upload)
+    return upload
+
+
+def _concluir(upload: UploadParcial):
+    parcial = _parcial(upload)
+    if soma_das_partes(upload.partes) != upload.soma:
+        upload.status = UploadParcial.Status.FALHOU
+        upload.save(update_fields=["status", "atualizado_em"])
+        parcial.unlink(missing_ok=True)
+        raise ErroUpload("Soma do arquivo não confere; envie o arquivo de novo.", 422)
+    os.truncate(parcial, upload.tamanho)
+    os.replace(parcial, upload.destino)
+    upload.status = UploadParcial.Status.CONCLUIDO
+    upload.save(update_fields=["status", "atualizado_em"])
+    print(f"✅ Upload {upload.id} concluído: {upload.destino}")
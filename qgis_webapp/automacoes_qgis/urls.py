@@ -1,16 +1,27 @@
 from django.urls import path
 from .views import (criar_projeto_qgis, enviar_para_qfieldcloud,
                      home, download_pacote_zip, progresso, progresso_qfield,
-                     tentar_overpass, resetar_progresso, baixar_e_enviar_qfieldcloud)
+                     tentar_overpass, resetar_progresso, baixar_e_enviar_qfieldcloud,
+                     download_memoriais_zip, status_job, eventos_progresso,
+                     eventos_progresso_qfield, cancelar_processamento, metrics,
+                     iniciar_upload_partes, upload_parte)
 
 urlpatterns = [
     path("", home, name="home"),
     path("baixar_e_enviar_qfieldcloud/", baixar_e_enviar_qfieldcloud, name="baixar_e_enviar_qfieldcloud"),
     path("criar_projeto_qgis/", criar_projeto_qgis, name="criar_projeto_qgis"),
+    path("uploads/", iniciar_upload_partes, name="iniciar_upload_partes"),
+    path("uploads/<uuid:upload_id>/", upload_parte, name="upload_parte"),
     path("exportar-qfield/", enviar_para_qfieldcloud, name="exportar_qfield"),
     path("download_pacote/", download_pacote_zip, name="download_pacote_zip"),
+    path("memoriais/download/", download_memoriais_zip, name="download_memoriais_zip"),
     path("progresso/", progresso, name="progresso"),
+    path("progresso/eventos/", eventos_progresso, name="eventos_progresso"),
     path("progresso_qfield/", progresso_qfield, name="progresso_qfield"),
+    path("progresso_qfield/eventos/", eventos_progresso_qfield, name="eventos_progresso_qfield"),
+    path("jobs/<int:job_id>/", status_job, name="status_job"),
+    path("cancelar/", cancelar_processamento, name="cancelar_processamento"),
+    path("metrics", metrics, name="metrics"),
     path("tentar_overpass/", tentar_overpass, name="tentar_overpass"),
     path("resetar_progresso/", resetar_progresso, name="resetar_progresso"),
 ]
@@ -1,180 +1,211 @@
-import threading
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 import os
-from django.http import HttpResponse, JsonResponse
+import shutil
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
 from django.views.decorators.cache import never_cache
 from pathlib import Path
-from .criar_projeto_qgis import create_final_project
-from pathlib import Path
-from .pipeline import (
-    dxf_to_shp, corrigir_e_snap, linhas_para_poligonos, dissolve_para_quadras,
-    singlepart_quadras, atribuir_letras_quadras, gerar_pontos_rotulo, join_lotes_quadras,
-    numerar_lotes, corrigir_geometrias, buffer_lotes, extrair_ruas_overpass, create_final_gpkg,
-    converter_ecw_para_tif_reduzido, atribuir_ruas_e_esquinas_precision
-)
-from .qgis_setup import init_qgis
-from io import BytesIO
-import zipfile
-import shutil
-from qfieldcloud_sdk import sdk
+from .zip_stream import tamanho_previsto, zip_de_entradas
+from . import metricas, pacote_qfield, progresso_bus
+from .jobs import cancelar_job, enfileirar_job
+from .models import Job, UploadParcial
+from .organize_files_for_qfield import PASTAS_PACOTE, arquivos_do_pacote
+from .descompactar import compactado, descompactar_upload, nome_sem_compactacao
+from .upload_parcial import ErroUpload, gravar_parte, iniciar_upload
+import base64
+import binascii
+import json
+import re
+from urllib.parse import quote
 from dotenv import load_dotenv
-from qgis.core import (
-        QgsVectorLayer
-)
-from django.contrib.sessions.models import Session
-import time
+from django.db import models
+from django.utils import timezone
+from datetime import timedelta
 
-init_qgis()
+# QGIS, geopandas, python-docx e o cliente do QFieldCloud são importados só
+# dentro das views que os usam; o pipeline roda no worker (tarefas.py).
 load_dotenv()
 
-def atualizar_progresso_thread(session_key, etapa, mensagem):
-    """Atualiza o progresso diretamente na sessão, sem depender do objeto request."""
-    session = Session.objects.get(session_key=session_key)
-    data = session.get_decoded()
-    data["progresso"] = {"etapa": etapa, "mensagem": mensagem}
-    session.session_data = Session.objects.encode(data)
-    session.save()
-    print(f"📊 [{etapa}] {mensagem}")
-
-def atualizar_progresso(request, etapa, mensagem):
-    progresso = {"etapa": etapa, "mensagem": mensagem}
-    request.session["progresso"] = progresso
-    request.session.modified = True
-    print(f"📊 [{etapa}] {mensagem}")
+def _canais_da_sessao(request):
+    """Canais de progresso (pipeline e QFieldCloud) do job desta sessão."""
+    job_id = request.session.get("job_id_canal")
+    if not job_id:
+        return None, None
+    return progresso_bus.canal_job(job_id), progresso_bus.canal_qfield(job_id)
+
+def _situacao_job(job):
+    na_frente = 0
+    if job.status == Job.Status.PENDENTE:
+        na_frente = Job.objects.filter(status=Job.Status.PENDENTE).filter(
+            models.Q(prioridade__gt=job.prioridade)
+            | models.Q(prioridade=job.prioridade, criado_em__lt=job.criado_em)
+        ).count()
+    return {
+        "job_id": job.pk,
+        "tipo": job.tipo,
+        "status": job.status,
+        "na_frente": na_frente,
+        "criado_em": job.criado_em.isoformat(),
+        "iniciado_em": job.iniciado_em.isoformat() if job.iniciado_em else None,
+        "concluido_em": job.concluido_em.isoformat() if job.concluido_em else None,
+        "etapa_interrompida": job.etapa_interrompida,
+    }
+
+def _evento_sse(evento, dados, id_evento=None):
+    linhas = [f"id: {id_evento}"] if id_evento is not None else []
+    linhas += [f"event: {evento}", f"data: {json.dumps(dados, ensure_ascii=False)}"]
+    return "\n".join(linhas) + "\n\n"
+
+def _resposta_sse(eventos):
+    resp = StreamingHttpResponse(eventos, content_type="text/event-stream")
+    resp["Cache-Control"] = "no-store, no-cache"
+    resp["X-Accel-Buffering"] = "no"  # nginx: não segurar os eventos no buffer
+    return resp
 
 @never_cache
 def progresso(request):
-    progresso = request.session.get("progresso", {"etapa": 0, "mensagem": "Aguardando início"})
+    canal, _ = _canais_da_sessao(request)
+    progresso = (canal and progresso_bus.ler(canal)) or progresso_bus.PROGRESSO_INICIAL
     resp = JsonResponse(progresso)
     resp["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp["Pragma"] = "no-cache"
     resp["Expires"] = "0"
     return resp
 
+@never_cache
+def eventos_progresso(request):
+    """
+    SSE do progresso do job desta sessão. Enquanto o job está na fila, manda
+    eventos "fila" com a posição; se o worker morrer, fecha com etapa 99.
+    """
+    canal, _ = _canais_da_sessao(request)
+    if not canal:
+        return JsonResponse({"status": "erro", "mensagem": "Nenhum processamento ativo."}, status=404)
+    job_id = request.session.get("job_id")
+
+    def eventos():
+        yield "retry: 2000\n\n"
+        for estado in progresso_bus.assinar(canal, desde=request.headers.get("Last-Event-ID"),
+                                            duracao=settings.QGIS_SSE_JANELA):
+            if estado is not None:
+                yield _evento_sse("progresso", estado, estado["versao"])
+                continue
+            # pulsação: consulta a fila só enquanto o job ainda não terminou
+            job = Job.objects.filter(pk=job_id).first() if job_id else None
+            if job and job.status in (Job.Status.FALHOU, Job.Status.CANCELADO):
+                mensagem = "🛑 Processamento cancelado." if job.status == Job.Status.CANCELADO else "❌ O processamento falhou."
+                yield _evento_sse("progresso", {"etapa": 99, "mensagem": mensagem, "final": True})
+                return
+            if job and job.status == Job.Status.PENDENTE:
+                yield _evento_sse("fila", _situacao_job(job))
+            else:
+                yield ": ping\n\n"
+
+    return _resposta_sse(eventos())
+
+@never_cache
+def metrics(request):
+    """Métricas dos jobs no formato texto do Prometheus (fila, etapas, caches)."""
+    fila = {s: 0 for s in Job.Status.values}
+    for linha in Job.objects.values("status").annotate(n=models.Count("pk")):
+        fila[linha["status"]] = linha["n"]
+    limite = timezone.now() - timedelta(hours=settings.QGIS_METRICAS_JANELA_HORAS)
+    manifestos = (Job.objects.filter(concluido_em__gte=limite).exclude(metricas={})
+                  .values_list("metricas", flat=True).iterator())
+    return HttpResponse(metricas.exposicao_prometheus(manifestos, fila),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@csrf_exempt
+def cancelar_processamento(request):
+    """
+    Cancela o job desta sessão. Na fila, sai na hora; em execução, o worker
+    para na próxima verificação e apaga as saídas parciais.
+    """
+    if request.method != "POST":
+        return JsonResponse({"status": "erro", "mensagem": "Use POST."}, status=405)
+    job_id = request.session.get("job_id")
+    job = Job.objects.filter(pk=job_id).first() if job_id else None
+    if job is None:
+        return JsonResponse({"status": "erro", "mensagem": "Nenhum processamento ativo."})
+
+    status = cancelar_job(job)
+    if status not in (Job.Status.CANCELADO, Job.Status.EXECUTANDO):
+        return JsonResponse({"status": "erro", "mensagem": "O processamento já terminou."})
+    return JsonResponse({"status": "sucesso", "mensagem": "🛑 Cancelamento solicitado.", "job_status": status})
+
+@never_cache
+def status_job(request, job_id):
+    """Situação de um job desta sessão na fila (pendente, executando, concluido, falhou)."""
+    session_key = request.session.session_key
+    job = Job.objects.filter(pk=job_id, session_key=session_key).first() if session_key else None
+    if job is None:
+        return JsonResponse({"status": "erro", "mensagem": "Job não encontrado."}, status=404)
+    return JsonResponse(_situacao_job(job))
+
 def home(request):
-    request.session["progresso"] = {"etapa": 0, "mensagem": "Aguardando início"}
-    request.session["aguardando_ruas"] = False
+    request.session["job_id_canal"] = None
     request.session["base_dir"] = None
     request.session.modified = True
     return render(request, 'automacoes_qgis/index.html')
 
 @csrf_exempt
 def resetar_progresso(request):
-    request.session["progresso"] = {"etapa": 0, "mensagem": "Aguardando início"}
-    request.session["aguardando_ruas"] = False
+    request.session["job_id_canal"] = None
     request.session["base_dir"] = None
     request.session.modified = True
     request.session.save()
 
     print("🔁 Progresso e sessão zerados (isolado por usuário)")
-    return JsonResponse({"status": "ok", "progresso": request.session["progresso"]})
-
-def executar_pipeline(upload_dir, dxf_path, ortho_path, session_key):
-    try:
-        paths = {
-            "linhas": upload_dir / "lotes_linhas" / "lotes_linhas.shp",
-            "linhas_fix": upload_dir / "temp" / "linhas_fix.shp",
-            "linhas_snap": upload_dir / "temp" / "linhas_snap.shp",
-            "lotes_poly": upload_dir / "lotes_poligonos" / "lotes_poligonos.shp",
-            "lotes_fix": upload_dir / "lotes_poligonos" / "lotes_poligonos_fix.shp",
-            "lotes_buffer": upload_dir / "lotes_poligonos" / "lotes_buffer.shp",
-            "quadras_raw": upload_dir / "quadras" / "quadras_dissolve.shp",
-            "quadras_single": upload_dir / "quadras" / "quadras.shp",
-            "quadras_single2": upload_dir / "quadras" / "quadras_m2s.shp",
-            "quadras_pts": upload_dir / "quadras" / "quadras_rotulo_pt.gpkg",
-            "lotes_join": upload_dir / "lotes_poligonos" / "lotes_com_quadra.shp",
-            "arquivo_final": upload_dir / "final" / "final.shp"
-        }
-
-        for p in paths.values():
-            p.parent.mkdir(parents=True, exist_ok=True)
-
-        atualizar_progresso_thread(session_key, 3, "🔧 Convertendo DXF em camadas vetoriais...")
-        linhas = dxf_to_shp(dxf_path, paths["linhas"])
-
-        atualizar_progresso_thread(session_key, 4, "🧩 Corrigindo e aplicando snap...")
-        linhas_fix = corrigir_e_snap(linhas, paths)
-
-        atualizar_progresso_thread(session_key, 5, "🏠 Gerando polígonos de lotes...")
-        lotes_poly = linhas_para_poligonos(linhas_fix, paths["lotes_poly"])
-
-        atualizar_progresso_thread(session_key, 6, "🧼 Corrigindo geometrias dos lotes...")
-        lotes_fix = corrigir_geometrias(lotes_poly, paths["lotes_fix"])
-
-        atualizar_progresso_thread(session_key, 7, "🗂️ Gerando buffers dos lotes...")
-        lotes_buffer = buffer_lotes(lotes_fix, paths["lotes_buffer"])
-
-        atualizar_progresso_thread(session_key, 8, "🧩 Dissolvendo lotes para criar polígonos das quadras...")
-        quadras_raw = dissolve_para_quadras(lotes_buffer, paths["quadras_raw"])
-
-        atualizar_progresso_thread(session_key, 9, "🧩 Criando polígonos das quadras...")
-        quadras = singlepart_quadras(quadras_raw, paths["quadras_single2"])
-
-        atualizar_progresso_thread(session_key, 10, "🧩 Atribuindo letras às quadras...")
-        quadras = atribuir_letras_quadras(quadras, paths["quadras_single"])
-
-        atualizar_progresso_thread(session_key, 11, "🗂️ Gerando pontos de rótulo das quadras...")
-        gerar_pontos_rotulo(quadras, paths["quadras_pts"])
-
-        atualizar_progresso_thread(session_key, 12, "🏠 Juntando lotes e quadras...")
-        lotes_join = join_lotes_quadras(lotes_fix, quadras, paths["lotes_join"])
-
-        atualizar_progresso_thread(session_key, 13, "🧩 Numerando lotes...")
-        numerar_lotes(lotes_join, paths["arquivo_final"])
-
-        atualizar_progresso_thread(session_key, 14, "🧩 Extraindo ruas do OpenStreetMap...")
-        try:
-            extrair_ruas_overpass(quadras, upload_dir)
-        except RuntimeError as e:
-            atualizar_progresso_thread(session_key, 98, f"⚠️ Falha no Overpass API: {e}")
-            # Salva flag "aguardando_ruas" diretamente na sessão
-            session = Session.objects.get(session_key=session_key)
-            data = session.get_decoded()
-            data["aguardando_ruas"] = True
-            session.session_data = Session.objects.encode(data)
-            session.save()
-            return  # encerra a thread
-
-        # Se deu certo, continua normalmente
-        session = Session.objects.get(session_key=session_key)
-        data = session.get_decoded()
-        data["aguardando_ruas"] = False
-        session.session_data = Session.objects.encode(data)
-        session.save()
-
-        atualizar_progresso_thread(session_key, 15, "🏷️ Atribuindo ruas e detectando lotes de esquina...")
-        atribuir_ruas_e_esquinas_precision(upload_dir)
-
-        atualizar_progresso_thread(session_key, 16, "🗺️ Criando projeto QGIS final...")
-        create_final_project(upload_dir, ortho_path=ortho_path)
-
-        atualizar_progresso_thread(session_key, 17, "✅ Projeto QGIS criado com sucesso!")
-
-    except Exception as e:
-        atualizar_progresso_thread(session_key, 99, f"❌ Erro geral: {e}")
-
+    return JsonResponse({"status": "ok", "progresso": progresso_bus.PROGRESSO_INICIAL})
 
 # -------------------------------
 # CRIAÇÃO DO PROJETO QGIS
 # -------------------------------
-@csrf_exempt
-def criar_projeto_qgis(request):
-    global QFIELD_PROGRESS  # esse ainda é global, porque a exportação QFieldCloud é separada
-
-    # 🔒 Reinicia progresso apenas da sessão atual
-    request.session["progresso"] = {"etapa": 0, "mensagem": "Aguardando início"}
-    request.session["aguardando_ruas"] = False
+def _novo_processamento(request):
+    # 🔒 Reinicia progresso apenas da sessão atual (cada job tem seus canais)
+    request.session["job_id_canal"] = None
     request.session["base_dir"] = None
     request.session.modified = True
 
     request.session.save()
-
-    QFIELD_PROGRESS = {"etapa": 0, "mensagem": ""}
     print("🚀 Novo processamento iniciado (isolado por sessão)")
 
-    atualizar_progresso(request, 0, "Iniciando criação do projeto...")
+def _diretorio_do_job(request, nome_dxf: str) -> Path:
+    from datetime import datetime
+    unique_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    upload_dir = Path(settings.MEDIA_ROOT) / "uploads" / f"{Path(nome_dxf).stem}_{unique_id}"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    request.session["base_dir"] = str(upload_dir)
+    request.session.modified = True
+    return upload_dir
+
+def _descartar_diretorio(request, upload_dir: Path):
+    # upload recusado: nada do job fica para trás, nem o diretório, nem ele na sessão
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    request.session["base_dir"] = None
+    request.session.modified = True
+
+def _enfileirar_pipeline(request, upload_dir: Path, dxf_path: Path, ortho_path: Path = None, **parametros) -> Job:
+    # 🔄 Enfileira o processamento (conversão do ECW inclusa) para os workers QGIS
+    job = enfileirar_job(
+        upload_dir,
+        session_key=request.session.session_key,
+        dxf_path=dxf_path,
+        ortho_path=ortho_path,
+        **parametros,
+    )
+    progresso_bus.publicar(progresso_bus.canal_job(job.pk), 1, "⏳ Na fila de processamento...")
+    request.session["job_id"] = job.pk
+    request.session["job_id_canal"] = job.pk
+    request.session.modified = True
+    return job
+
+@csrf_exempt
+def criar_projeto_qgis(request):
+    _novo_processamento(request)
 
     if request.method != "POST" or not request.FILES.get("arquivo"):
         return JsonResponse({"status": "erro", "mensagem": "Nenhum arquivo enviado."})
@@ -183,21 +214,22 @@ def criar_projeto_qgis(request):
     arquivo = request.FILES["arquivo"]
     ortofoto_file = request.FILES.get("ortofoto")
 
-    from datetime import datetime
-    unique_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    upload_dir = Path(settings.MEDIA_ROOT) / "uploads" / f"{Path(arquivo.name).stem}_{unique_id}"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    dxf_path = upload_dir / arquivo.name
+    upload_dir = _diretorio_do_job(request, nome_sem_compactacao(arquivo.name))
 
-    request.session["base_dir"] = str(upload_dir)
-    request.session.modified = True
-
-    atualizar_progresso(request, 1, "📂 Salvando arquivos enviados...")
-    with open(dxf_path, "wb+") as destino:
-        for chunk in arquivo.chunks():
-            destino.write(chunk)
+    if compactado(arquivo.name):
+        # .zip/.dxf.gz: extrai do próprio upload direto para o diretório do job
+        try:
+            dxf_path, ortho_path = descompactar_upload(arquivo, arquivo.name, upload_dir,
+                                                       com_ortofoto=not ortofoto_file)
+        except ErroUpload as e:
+            _descartar_diretorio(request, upload_dir)
+            return JsonResponse({"status": "erro", "mensagem": str(e)})
+    else:
+        dxf_path, ortho_path = upload_dir / arquivo.name, None
+        with open(dxf_path, "wb+") as destino:
+            for chunk in arquivo.chunks():
+                destino.write(chunk)
 
-    ortho_path = None
     if ortofoto_file:
         ortho_dir = upload_dir / "ortofoto"
         ortho_dir.mkdir(parents=True, exist_ok=True)
@@ -206,48 +238,106 @@ def criar_projeto_qgis(request):
             for chunk in ortofoto_file.chunks():
                 destino.write(chunk)
 
-        if ortho_path.suffix.lower() == ".ecw":
-            try:
-                atualizar_progresso(request, 2.5, "🧩 Convertendo ortofoto ECW para TIFF reduzido (pode demorar)...")
-                # ortho_path = converter_ecw_para_tif_reduzido(ortho_path, escala=96)
-                ortho_path = converter_ecw_para_tif_reduzido(ortho_path, escala=2)
-                print(f"✅ Ortofoto convertida automaticamente: {ortho_path.name}")
-            except Exception as e:
-                print(f"⚠️ Erro ao converter ECW: {e}")
-
-    # 🔄 Inicia o processamento em thread (não bloqueia o servidor)
-    print("Sessão antes da thread:", request.session.get("progresso"))
-    threading.Thread(
-        target=executar_pipeline,
-        args=(upload_dir, dxf_path, ortho_path, request.session.session_key),
-        daemon=True
-    ).start()
+    job = _enfileirar_pipeline(request, upload_dir, dxf_path, ortho_path)
 
     return JsonResponse({
         "status": "sucesso",
-        "mensagem": "🚀 Processamento iniciado. Acompanhe o progresso.",
+        "mensagem": "🚀 Processamento enfileirado. Acompanhe o progresso.",
+        "job_id": job.pk,
         "projeto_path": f"/media/uploads/{arquivo.name}/project.qgz"
     })
 
-def continuar_pipeline_pos_ruas(upload_dir, ortho_path, paths, request):
-    """Executa a parte final da pipeline (após ruas serem baixadas)"""
+@csrf_exempt
+def iniciar_upload_partes(request):
+    """
+    Começa um processamento com upload em partes (upload_parcial.py). Corpo
+    JSON: {"arquivo": {nome, tamanho, tamanho_parte, soma}, "ortofoto": {...} ou null}.
+    Devolve o id de cada arquivo, para as partes irem a /uploads/<id>/.
+    """
+    if request.method != "POST":
+        return JsonResponse({"status": "erro", "mensagem": "Use POST."}, status=405)
     try:
-        atualizar_progresso(request, 15, "🧩 Criando GeoPackage...")
-        create_final_gpkg(paths["arquivo_final"])
-
-        atualizar_progresso(request, 16, "🗺️ Criando projeto QGIS final...")
-        create_final_project(upload_dir, ortho_path=ortho_path)
+        pedido = json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return JsonResponse({"status": "erro", "mensagem": "JSON inválido."}, status=400)
+    arquivos = {"arquivo": UploadParcial.TIPO_DXF, "ortofoto": UploadParcial.TIPO_ORTOFOTO}
+    if not isinstance(pedido.get("arquivo"), dict) or not isinstance(pedido.get("ortofoto") or {}, dict):
+        return JsonResponse({"status": "erro", "mensagem": "Nenhum arquivo enviado."}, status=400)
+
+    _novo_processamento(request)
+    upload_dir = _diretorio_do_job(request, nome_sem_compactacao(str(pedido["arquivo"].get("nome", ""))) or "projeto")
+    uploads = {}
+    try:
+        for campo, tipo in arquivos.items():
+            if pedido.get(campo):
+                d = pedido[campo]
+                upload = iniciar_upload(upload_dir, tipo, d.get("nome"), d.get("tamanho"), d.get("tamanho_parte"),
+                                        d.get("soma"), request.session.session_key)
+                uploads[campo] = {"id": str(upload.id), "offset": 0}
+    except ErroUpload as e:
+        UploadParcial.objects.filter(upload_dir=str(upload_dir)).update(status=UploadParcial.Status.FALHOU)
+        _descartar_diretorio(request, upload_dir)
+        return JsonResponse({"status": "erro", "mensagem": str(e)}, status=e.status)
+    return JsonResponse({"status": "sucesso", "uploads": uploads})
 
-        atualizar_progresso(request, 17, "✅ Projeto QGIS criado com sucesso!")
-        request.session["base_dir"] = str(upload_dir)
-        request.session["aguardando_ruas"] = False
-    except Exception as e:
-        atualizar_progresso(request, 99, f"❌ Erro pós-Overpass: {e}")
+@csrf_exempt
+def upload_parte(request, upload_id):
+    """
+    HEAD/GET: offset já recebido (cabeçalho Upload-Offset e JSON).
+    PATCH: grava a parte do corpo em Upload-Offset; Upload-Checksum
+    ("sha256 <base64>"), se vier, é conferido. Quando o DXF termina, o
+    pipeline é enfileirado mesmo que a ortofoto ainda esteja chegando.
+    """
+    upload = UploadParcial.objects.filter(pk=upload_id, session_key=request.session.session_key or "").first()
+    if upload is None:
+        return JsonResponse({"status": "erro", "mensagem": "Upload não encontrado."}, status=404)
+
+    def resposta(dados, status=200, offset=None):
+        r = JsonResponse({"offset": upload.recebido if offset is None else offset, **dados}, status=status)
+        r["Upload-Offset"] = str(upload.recebido if offset is None else offset)
+        r["Cache-Control"] = "no-store"
+        return r
+
+    if request.method in ("HEAD", "GET"):
+        return resposta({"status": upload.status, "tamanho": upload.tamanho})
+    if request.method != "PATCH":
+        return JsonResponse({"status": "erro", "mensagem": "Use PATCH."}, status=405)
+
+    soma_parte = None
+    tipo_soma, _, valor = request.headers.get("Upload-Checksum", "").partition(" ")
+    if tipo_soma:
+        if tipo_soma.lower() != "sha256":
+            return resposta({"status": "erro", "mensagem": "Só sha256 é aceito em Upload-Checksum."}, 400)
+        try:
+            soma_parte = base64.b64decode(valor, validate=True).hex()
+        except (ValueError, binascii.Error):
+            return resposta({"status": "erro", "mensagem": "Upload-Checksum inválido."}, 400)
+    try:
+        offset = int(request.headers["Upload-Offset"])
+        tamanho = int(request.META.get("CONTENT_LENGTH") or 0)
+        gravar_parte(upload, offset, request, tamanho, soma_parte)
+    except (KeyError, ValueError):
+        return resposta({"status": "erro", "mensagem": "Upload-Offset e Content-Length são obrigatórios."}, 400)
+    except ErroUpload as e:
+        return resposta({"status": "erro", "mensagem": str(e)}, e.status, e.offset)
+
+    dados = {"status": upload.status}
+    if upload.status == UploadParcial.Status.CONCLUIDO and upload.tipo == UploadParcial.TIPO_DXF:
+        ortofoto = UploadParcial.objects.filter(upload_dir=upload.upload_dir, tipo=UploadParcial.TIPO_ORTOFOTO).first()
+        aguardando = ortofoto and ortofoto.status == UploadParcial.Status.RECEBENDO
+        dxf_path = Path(upload.destino)
+        ortho_path = Path(ortofoto.destino) if ortofoto and ortofoto.status != UploadParcial.Status.FALHOU else None
+        parametros = {"ortho_upload": ortofoto.id if aguardando else None}
+        if compactado(upload.destino):
+            # a extração é a primeira etapa do job: o PATCH não espera descompactar
+            parametros["compactado"] = upload.destino
+        job = _enfileirar_pipeline(request, Path(upload.upload_dir), dxf_path, ortho_path, **parametros)
+        dados.update(job_id=job.pk, mensagem="🚀 Processamento enfileirado. Acompanhe o progresso.",
+                     projeto_path=f"/media/uploads/{nome_sem_compactacao(dxf_path.name)}/project.qgz")
+    return resposta(dados)
 
 @csrf_exempt
 def tentar_overpass(request=None):
-    global PROGRESSO
-
     base_dir = request.session.get("base_dir")
     if not base_dir:
         return JsonResponse({"status": "erro", "mensagem": "Nenhum projeto ativo encontrado."})
@@ -258,37 +348,114 @@ def tentar_overpass(request=None):
     if not quadras_path.exists():
         return JsonResponse({"status": "erro", "mensagem": "Quadras não encontradas."})
 
-    try:
-        atualizar_progresso(request, 14, "🔁 Tentando novamente extrair ruas...")
-        quadras = QgsVectorLayer(str(quadras_path), "quadras", "ogr")
-
-        extrair_ruas_overpass(quadras, upload_dir)
-        atualizar_progresso(request, 15, "✅ Ruas obtidas com sucesso!")
-
-        # continua o pipeline
-        request.session["aguardando_ruas"] = False
-        continuar_pipeline_pos_ruas(upload_dir, None, {}, request)
-
-        return JsonResponse({"status": "sucesso", "mensagem": "Ruas extraídas e pipeline retomado."})
+    canal, _ = _canais_da_sessao(request)
+    estado = (canal and progresso_bus.ler(canal)) or {}
+    if not estado.get("aguardando_ruas"):
+        return JsonResponse({"status": "erro", "mensagem": "Nenhuma busca de ruas pendente."})
+
+    # Nova tentativa roda no worker, na frente dos uploads novos, e publica
+    # no mesmo canal do job original
+    job = enfileirar_job(
+        upload_dir,
+        session_key=request.session.session_key,
+        tipo=Job.TIPO_OVERPASS,
+        prioridade=10,
+        ortho_path=estado.get("ortho_path"),
+        canal=canal,
+    )
+    progresso_bus.publicar(canal, 14, "🔁 Nova busca de ruas enfileirada...")
+    request.session["job_id"] = job.pk
+    return JsonResponse({"status": "sucesso", "mensagem": "Nova busca de ruas enfileirada.", "job_id": job.pk})
 
-    except RuntimeError as e:
-        atualizar_progresso(request, 98, f"⚠️ Nova falha no Overpass: {e}")
-        return JsonResponse({"status": "falha_overpass", "mensagem": str(e)})
+def _arquivos_do_pacote(upload_dir: Path):
+    """(caminho, nome no ZIP, método) de cada arquivo do pacote QField, direto das pastas do projeto."""
+    arquivos = arquivos_do_pacote(upload_dir / "project_cloud.qgs", PASTAS_PACOTE)
+    return [(caminho, arcname, pacote_qfield.metodo_compressao(caminho)) for caminho, arcname in arquivos]
 
+_RE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
 
-    except RuntimeError as e:
-        atualizar_progresso(request, 98, f"⚠️ Nova falha no Overpass: {e}")
-        return JsonResponse({
-            "status": "falha_overpass",
-            "mensagem": str(e)
-        })
+def _blocos_arquivo(arquivo, inicio: int, tamanho: int, bloco: int = 1 << 20):
+    try:
+        arquivo.seek(inicio)
+        while tamanho > 0 and (pedaco := arquivo.read(min(bloco, tamanho))):
+            tamanho -= len(pedaco)
+            yield pedaco
+    finally:
+        arquivo.close()
+
+def _resposta_arquivo(request, caminho: Path, nome_download: str, etag: str):
+    """
+    Arquivo pronto para download, retomável: atende Range de um intervalo
+    (If-Range comparado ao ETag) ou delega o envio ao servidor web
+    (QGIS_DOWNLOAD_OFFLOAD), que aí cuida dos intervalos sozinho.
+    """
+    modo = settings.QGIS_DOWNLOAD_OFFLOAD
+    if modo == "x-accel":
+        try:
+            relativo = caminho.resolve().relative_to(Path(settings.MEDIA_ROOT).resolve()).as_posix()
+        except ValueError:
+            modo = ""  # fora do MEDIA_ROOT: o nginx não alcança
+    if modo in ("x-accel", "x-sendfile"):
+        response = HttpResponse(content_type="application/zip")
+        if modo == "x-accel":
+            response["X-Accel-Redirect"] = quote(settings.QGIS_ACCEL_PREFIXO.rstrip("/") + "/" + relativo)
+        else:
+            response["X-Sendfile"] = str(caminho.resolve())
+        response["Content-Disposition"] = f'attachment; filename="{nome_download}"'
+        return response
+
+    arquivo = open(caminho, "rb")
+    tamanho = os.fstat(arquivo.fileno()).st_size
+    pedido = _RE_RANGE.match(request.headers.get("Range", "").replace(" ", ""))
+    if_range = request.headers.get("If-Range")
+    if not pedido or not any(pedido.groups()) or (if_range is not None and if_range != etag):
+        response = FileResponse(arquivo, as_attachment=True, filename=nome_download)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    inicio, fim = pedido.groups()
+    if inicio:
+        inicio, fim = int(inicio), min(int(fim) if fim else tamanho - 1, tamanho - 1)
+    else:
+        # sufixo: os últimos N bytes
+        inicio, fim = max(0, tamanho - int(fim)), tamanho - 1
+    if inicio > fim:
+        arquivo.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{tamanho}"
+        return response
+
+    response = StreamingHttpResponse(_blocos_arquivo(arquivo, inicio, fim - inicio + 1),
+                                     status=206, content_type="application/zip")
+    response["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+    response["Content-Length"] = fim - inicio + 1
+    response["Content-Disposition"] = f'attachment; filename="{nome_download}"'
+    response["Accept-Ranges"] = "bytes"
+    return response
 
-    except Exception as e:
-        atualizar_progresso(request, 99, f"❌ Erro inesperado ao repetir Overpass: {e}")
-        return JsonResponse({
-            "status": "erro",
-            "mensagem": str(e)
-        })
+def _resposta_pacote(request, upload_dir: Path, nome_download: str):
+    """
+    Pacote QField do cache do job, com ETag: se nada mudou desde o último
+    download, 304 ou o ZIP já pronto (com Range ou delegado ao servidor web).
+    Senão o ZIP é gerado em streaming e guardado para os próximos downloads;
+    um Range num pacote ainda não montado é ignorado (200 com o ZIP inteiro),
+    para a requisição nunca ficar parada montando o pacote antes de responder.
+    """
+    pacote = pacote_qfield.preparar_pacote(upload_dir, _arquivos_do_pacote(upload_dir))
+    if pacote.etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    elif pacote.pronto:
+        response = _resposta_arquivo(request, pacote.arquivo, nome_download, pacote.etag)
+    else:
+        response = StreamingHttpResponse(pacote_qfield.gerar_pacote(pacote), content_type="application/zip")
+        response["Content-Disposition"] = f'attachment; filename="{nome_download}"'
+        # Content-Length só quando dá para calcular (membros armazenados)
+        tamanho = tamanho_previsto(pacote.arquivos)
+        if tamanho is not None:
+            response["Content-Length"] = tamanho
+    response["ETag"] = pacote.etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 def download_pacote_zip(request):
     """
@@ -304,15 +471,9 @@ def download_pacote_zip(request):
     if not project_file.exists():
         return HttpResponse("Projeto QGIS não encontrado. Gere o projeto antes.")
 
-    export_folder = upload_dir / "qfield_export"
-    include_data_folders = ["final", "ruas", "quadras", "ortofoto"]
-
+    # Sem staging: o ZIP lê os arquivos do projeto com o caminho do pacote
     try:
-        package_project_for_qfield(
-            project_file=project_file,
-            export_folder=export_folder,   
-            include_data_folders=include_data_folders
-        )
+        return _resposta_pacote(request, upload_dir, "pacote_projeto_qgis.zip")
     except Exception as e:
         import traceback
         print("❌ Erro ao empacotar:", traceback.format_exc())
@@ -321,166 +482,101 @@ def download_pacote_zip(request):
             "mensagem": f"Falha ao empacotar o projeto: {str(e)}"
         })
 
-    # Compacta tudo dentro de qfield_export/
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(export_folder):
-            for fname in files:
-                if not fname.endswith((".gpkg", ".qgs", ".tif", ".vrt")):
-                    continue
-                full = Path(root) / fname
-                arcname = str(full.relative_to(export_folder))
-                zf.write(full, arcname)
-
-    buffer.seek(0)
-
-    # Retorna o ZIP como resposta HTTP (compatível com navegadores)
-    response = HttpResponse(buffer.getvalue(), content_type="application/zip")
-    response["Content-Disposition"] = 'attachment; filename="pacote_projeto_qgis.zip"'
-    response["Content-Length"] = len(buffer.getvalue())
-    return response
-
-def package_project_for_qfield(project_file: Path, export_folder: Path, include_data_folders: list = None):
-    if include_data_folders is None:
-        include_data_folders = []
-
-    export_folder.mkdir(parents=True, exist_ok=True)
-
-    shutil.copy2(project_file, export_folder / project_file.name)
-
-    for rel in include_data_folders:
-        src = project_file.parent / rel
-        dst = export_folder / rel
-        if src.exists() and src.is_dir():
-            shutil.copytree(src, dst)
-        else:
-            # 🔧 Tenta encontrar arquivos que comecem com o nome da pasta
-            pattern = f"{rel} *"
-            for file in project_file.parent.glob(pattern):
-                dst_dir = export_folder / rel
-                dst_dir.mkdir(exist_ok=True)
-                shutil.copy2(file, dst_dir / file.name.replace(f"{rel} ", ""))
-                print(f"📦 Movido: {file} → {dst_dir / file.name.replace(f'{rel} ', '')}")
+def download_memoriais_zip(request):
+    """
+    Gera os memoriais do núcleo e envia um ZIP em streaming, à medida que cada
+    .docx fica pronto (nada é acumulado em memória nem gravado em disco).
+    Parâmetros: ?quadra=1&quadra=2 (ou quadra=1,2), ?tipo=lote|quadra,
+    ?nucleo=, ?municipio=, ?uf=.
+    """
+    base_dir = request.session.get("base_dir")
+    if not base_dir:
+        return HttpResponse("Nenhum diretório base encontrado na sessão. Gere o projeto antes.", status=404)
 
-    print(f"📦 Projeto empacotado em: {export_folder}")
-    return export_folder
+    quadras = [q.strip() for v in request.GET.getlist("quadra") for q in v.split(",") if q.strip()]
+    tipo = request.GET.get("tipo", "lote")
+    nucleo = request.GET.get("nucleo", "Centro")
+    municipio = request.GET.get("municipio", "Condeúba")
+    uf = request.GET.get("uf", "BA")
 
+    from .memorial_docx import carregar_lotes_memorial, iterar_memoriais_lotes, iterar_memoriais_quadras
 
-def enviar_para_qfieldcloud(request):
-    global QFIELD_PROGRESS
-    QFIELD_PROGRESS = {"etapa": 0, "mensagem": "Iniciando upload..."}
-
-    username = os.getenv("QFIELD_USER")
-    password = os.getenv("QFIELD_PASS")
-    base_dir = Path(request.session.get("base_dir", ""))
-
-    if not base_dir.exists():
-        return JsonResponse({"status": "erro", "mensagem": "Base do projeto não encontrada."})
-
-    # Detecta ortofoto e gera nome do projeto
-    ortho_dir = base_dir / "ortofoto"
-    ortho_files = list(ortho_dir.glob("*.tif"))
-    if ortho_files:
-        ortho_name = ortho_files[0].stem.replace("reduzido", "")
-        ortho_name = ortho_name.replace("Ortofoto", "").replace("ortofoto", "").strip().replace(" ", "").replace("_", "")
-        project_name = ortho_name or "Projeto_Sem_Nome"
+    try:
+        gdf = carregar_lotes_memorial(Path(base_dir), quadras)
+    except FileNotFoundError as e:
+        return HttpResponse(f"Não foi possível gerar os memoriais: {e}", status=404)
+    except ValueError as e:
+        # GPKG final existe, mas ainda sem as colunas do memorial
+        return HttpResponse(f"Não foi possível gerar os memoriais: {e}", status=409)
+
+    if gdf.empty:
+        return HttpResponse("Nenhum lote encontrado para as quadras informadas.", status=404)
+
+    if tipo == "quadra":
+        entradas = iterar_memoriais_quadras(gdf, nucleo, municipio, uf)
     else:
-        project_name = "Projeto_Sem_Ortofoto"
-
-    # 🔹 Caminho base de envio (diretório atual do usuário)
-    upload_dir = base_dir
+        entradas = iterar_memoriais_lotes(gdf, nucleo, municipio, uf)
 
-    # 🔹 Login no QFieldCloud
-    client = sdk.Client(url="https://app.qfield.cloud/api/v1/")
-    client.login(username=username, password=password)
+    # .docx já é comprimido → entradas armazenadas (ZIP_STORED) no pacote
+    response = StreamingHttpResponse(zip_de_entradas(entradas), content_type="application/zip")
+    response["Content-Disposition"] = 'attachment; filename="memoriais.zip"'
+    return response
 
-    proj = client.create_project(
-        name=project_name,
-        owner="OrganizacaoTeste",
-        description="Exportado via Django",
-        is_public=False
+def _enfileirar_envio_qfieldcloud(request) -> Job:
+    """
+    Enfileira o envio do projeto da sessão ao QFieldCloud; o worker
+    reaproveita o projeto remoto do último envio (?novo=1 cria outro) e só
+    manda o que mudou. ValueError com a mensagem se não há projeto.
+    """
+    _, canal_qfield = _canais_da_sessao(request)
+    if not canal_qfield:
+        raise ValueError("Nenhum projeto ativo encontrado.")
+
+    base_dir = Path(request.session.get("base_dir") or "")
+    if not request.session.get("base_dir") or not base_dir.exists():
+        raise ValueError("Base do projeto não encontrada.")
+
+    job = enfileirar_job(
+        base_dir,
+        session_key=request.session.session_key,
+        tipo=Job.TIPO_QFIELDCLOUD,
+        prioridade=5,
+        canal=canal_qfield,
+        novo="1" if request.GET.get("novo") == "1" else None,
     )
-    project_id = proj["id"]
-
-    # 🔹 Lista arquivos relevantes da pasta atual
-    pastas_necessarias = ["final", "quadras", "ruas", "ortofoto"]
-    exts = {".gpkg", ".tif", ".vrt", ".png", ".qgs"}
-    files = []
-
-    for pasta in pastas_necessarias:
-        dir_path = upload_dir / pasta
-        if dir_path.exists():
-            for root, _, fnames in os.walk(dir_path):
-                for fname in fnames:
-                    fpath = Path(root) / fname
-                    if fpath.suffix.lower() in exts:
-                        files.append(fpath)
-
-    # inclui projeto e thumbnail
-    project_qgs = upload_dir / "project_cloud.qgs"
-    if project_qgs.exists():
-        files.append(project_qgs)
-
-    files.sort(key=lambda p: (p.suffix.lower() == ".qgs", p.as_posix()))
-    total = len(files)
-    print(f"📦 {total} arquivos encontrados para upload em {upload_dir}")
-
-    # 🔹 Envio mantendo subpastas
-    for i, file_path in enumerate(files, start=1):
-        time.sleep(2)
-        rel_path = file_path.relative_to(upload_dir).as_posix()
-        QFIELD_PROGRESS = {"etapa": i, "mensagem": f"⬆️ Enviando {rel_path} ({i}/{total})"}
-        print(f"➡️ Uploadando: {rel_path}")
+    progresso_bus.publicar(canal_qfield, 0, "⏳ Envio ao QFieldCloud na fila...")
+    # chave própria: /cancelar/ continua mirando o processamento, não o envio
+    request.session["job_id_qfield"] = job.pk
+    request.session.modified = True
+    return job
 
-        try:
-            client.upload_file(
-                project_id,
-                sdk.FileTransferType.PROJECT,
-                file_path,
-                rel_path,
-                show_progress=False,
-            )
-            print(f"✅ Upload concluído: {rel_path}")
-        except Exception as e:
-            print(f"⚠️ Falha ao enviar {rel_path}: {e}")
-
-    QFIELD_PROGRESS = {"etapa": total, "mensagem": "✅ Upload concluído!"}
-    print("✅ Finalizado!")
-    return JsonResponse({"status": "sucesso", "projeto_id": project_id})
+def enviar_para_qfieldcloud(request):
+    """Enfileira o envio ao QFieldCloud; o progresso sai no canal do QFieldCloud do job."""
+    if request.method != "POST":
+        return JsonResponse({"status": "erro", "mensagem": "Use POST."}, status=405)
+    try:
+        job = _enfileirar_envio_qfieldcloud(request)
+    except ValueError as e:
+        return JsonResponse({"status": "erro", "mensagem": str(e)})
+    return JsonResponse({"status": "sucesso", "mensagem": "Envio ao QFieldCloud enfileirado.", "job_id": job.pk})
 
 @csrf_exempt
 def baixar_e_enviar_qfieldcloud(request):
     """
-    Gera o pacote ZIP do projeto QGIS e envia ao QFieldCloud.
-    Retorna o arquivo ZIP como download e também dispara o upload.
+    Gera o pacote ZIP do projeto QGIS e enfileira o envio ao QFieldCloud.
+    Retorna o arquivo ZIP como download; o upload segue no worker.
     """
+    if request.method != "POST":
+        return JsonResponse({"status": "erro", "mensagem": "Use POST."}, status=405)
     base_dir = request.session.get("base_dir")
     if not base_dir:
         return JsonResponse({"status": "erro", "mensagem": "Nenhum projeto ativo encontrado."})
 
     upload_dir = Path(base_dir)
-    export_folder = upload_dir / "qfield_export"
-    include_data_folders = ["final", "ruas", "quadras", "ortofoto"]
 
-    # Etapa 1: gerar pacote ZIP
+    # Etapa 1: pacote ZIP (do cache do job, se nada mudou)
     try:
-        package_project_for_qfield(
-            project_file=upload_dir / "project_cloud.qgs",
-            export_folder=export_folder,
-            include_data_folders=include_data_folders
-        )
-
-        buffer = BytesIO()
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for root, _, files in os.walk(export_folder):
-                for fname in files:
-                    if not fname.endswith((".gpkg", ".qgs", ".tif", ".vrt")):
-                        continue
-                    full = Path(root) / fname
-                    arcname = str(full.relative_to(export_folder))
-                    zf.write(full, arcname)
-
-        buffer.seek(0)
+        response = _resposta_pacote(request, upload_dir, "pacote_projeto_qgis.zip")
 
     except Exception as e:
         import traceback
@@ -490,24 +586,35 @@ def baixar_e_enviar_qfieldcloud(request):
             "mensagem": f"Falha ao empacotar: {str(e)}"
         })
 
-    # Etapa 2: enviar para QFieldCloud
+    # Etapa 2: enfileira o envio ao QFieldCloud (o worker faz o upload)
     try:
-        response_upload = enviar_para_qfieldcloud(request)
-        print("✅ Projeto enviado para o QFieldCloud com sucesso.")
-    except Exception as e:
-        print(f"⚠️ Falha ao enviar para o QFieldCloud: {e}")
-        response_upload = JsonResponse({
-            "status": "erro",
-            "mensagem": f"Falha ao enviar para QFieldCloud: {str(e)}"
-        })
+        job = _enfileirar_envio_qfieldcloud(request)
+        print(f"📤 Envio ao QFieldCloud enfileirado (job {job.pk})")
+    except ValueError as e:
+        print(f"📤 Envio ao QFieldCloud: {e}")
 
     # Etapa 3: retornar o ZIP para download
-    response = HttpResponse(buffer.getvalue(), content_type="application/zip")
-    response["Content-Disposition"] = 'attachment; filename="pacote_projeto_qgis.zip"'
     return response
 
 
+@never_cache
 def progresso_qfield(request):
-    global QFIELD_PROGRESS
-    return JsonResponse(QFIELD_PROGRESS)
+    _, canal_qfield = _canais_da_sessao(request)
+    return JsonResponse((canal_qfield and progresso_bus.ler(canal_qfield)) or {"etapa": 0, "mensagem": ""})
+
+@never_cache
+def eventos_progresso_qfield(request):
+    """SSE do upload ao QFieldCloud do job desta sessão."""
+    _, canal_qfield = _canais_da_sessao(request)
+    if not canal_qfield:
+        return JsonResponse({"status": "erro", "mensagem": "Nenhum projeto ativo encontrado."}, status=404)
+
+    def eventos():
+        yield "retry: 2000\n\n"
+        # um "concluído" de um envio anterior não encerra o monitoramento novo
+        for estado in progresso_bus.assinar(canal_qfield, desde=request.headers.get("Last-Event-ID"),
+                                            duracao=settings.QGIS_SSE_JANELA, ignorar_final_anterior=True):
+            yield ": ping\n\n" if estado is None else _evento_sse("progresso", estado, estado["versao"])
+
+    return _resposta_sse(eventos())
 
@@ -0,0 +1,299 @@
+"""
+Escrita sequencial de arquivos ZIP (sem seek).
+
+Cada entrada é devolvida como bytes assim que é adicionada, então o pacote
+pode ser gravado direto num arquivo ou enviado aos poucos numa resposta HTTP.
+Membros já comprimidos (ParteZip) são reaproveitados sem recomprimir e
+arquivos do disco são lidos em blocos, com memória constante mesmo para
+ortofotos de vários GB. Só os membros com deflate usam o descritor de dados
+no fim do membro; os armazenados levam CRC e tamanhos no cabeçalho local,
+porque o ZipInputStream do Java recusa STORED com descritor.
+"""
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+_LIMITE_32 = 0xFFFFFFFF
+_LIMITE_16 = 0xFFFF
+
+_FLAG_UTF8 = 0x800
+_FLAG_DESCRITOR = 0x08
+
+BLOCO_LEITURA = 1 << 20
+
+
+def _data_hora_dos(instante=None):
+    t = time.localtime(instante)
+    hora = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    data = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return hora, data
+
+
+def _compressor(metodo, nivel=6):
+    if metodo == ZIP_DEFLATED:
+        return zlib.compressobj(nivel, zlib.DEFLATED, -15)
+    return None
+
+
+def _crc_arquivo(caminho, bloco=BLOCO_LEITURA) -> int:
+    crc = 0
+    with open(caminho, "rb") as f:
+        while pedaco := f.read(bloco):
+            crc = zlib.crc32(pedaco, crc)
+    return crc
+
+
+def _precisa_zip64(tamanho: int, metodo) -> bool:
+    # o deflate pode crescer um pouco em dados incomprimíveis (5 bytes a cada 16 KB)
+    folga = 0 if metodo == ZIP_STORED else (tamanho >> 12) + 1024
+    return tamanho + folga >= _LIMITE_32
+
+
+@dataclass(frozen=True)
+class ParteZip:
+    """Membro do ZIP já comprimido, pronto para ser gravado em vários pacotes."""
+    nome: str
+    crc: int
+    tamanho: int
+    dados: bytes
+    metodo: int = ZIP_DEFLATED
+
+    @classmethod
+    def comprimir(cls, nome: str, dados: bytes, metodo=ZIP_DEFLATED, nivel=6):
+        comp = _compressor(metodo, nivel)
+        corpo = comp.compress(dados) + comp.flush() if comp else dados
+        return cls(nome, zlib.crc32(dados), len(dados), corpo, metodo)
+
+
+class ZipStream:
+    """
+    Monta um ZIP de forma incremental.
+
+    Uso:
+        zs = ZipStream()
+        saida.write(zs.adicionar_bytes("a.txt", b"..."))
+        saida.write(zs.finalizar())
+    """
+
+    def __init__(self, instante=None):
+        self._hora, self._data = _data_hora_dos(instante)
+        self._central = []
+        self._offset = 0
+        # (nome, método, crc, tamanho comprimido, tamanho, offset do cabeçalho local)
+        self.membros = []
+
+    @property
+    def offset(self):
+        return self._offset
+
+    # ---------- cabeçalhos ----------
+    def _cabecalho_local(self, nome_b, flags, metodo, crc, csize, usize, zip64):
+        extra = b""
+        if zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, usize, csize)
+            csize = usize = _LIMITE_32
+        versao = 45 if zip64 else 20
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, versao, flags, metodo,
+            self._hora, self._data, crc, csize, usize, len(nome_b), len(extra)
+        ) + nome_b + extra
+
+    def _registrar_central(self, nome_b, flags, metodo, crc, csize, usize, offset):
+        self.membros.append((nome_b.decode("utf-8"), metodo, crc, csize, usize, offset))
+        campos = []
+        if usize >= _LIMITE_32:
+            campos.append(usize)
+            usize = _LIMITE_32
+        if csize >= _LIMITE_32:
+            campos.append(csize)
+            csize = _LIMITE_32
+        if offset >= _LIMITE_32:
+            campos.append(offset)
+            offset = _LIMITE_32
+        extra = b""
+        if campos:
+            extra = struct.pack("<HH", 0x0001, 8 * len(campos)) + struct.pack(f"<{len(campos)}Q", *campos)
+        versao = 45 if campos else 20
+        self._central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | versao, versao, flags, metodo,
+            self._hora, self._data, crc, csize, usize, len(nome_b), len(extra), 0, 0, 0,
+            0o100644 << 16, offset
+        ) + nome_b + extra)
+
+    # ---------- entradas ----------
+    def adicionar_parte(self, parte: ParteZip, nome: str | None = None) -> bytes:
+        """Grava um membro já comprimido (o nome pode ser trocado no pacote)."""
+        nome_b = (nome or parte.nome).encode("utf-8")
+        csize = len(parte.dados)
+        zip64 = parte.tamanho >= _LIMITE_32 or csize >= _LIMITE_32
+        cab = self._cabecalho_local(nome_b, _FLAG_UTF8, parte.metodo, parte.crc, csize, parte.tamanho, zip64)
+        self._registrar_central(nome_b, _FLAG_UTF8, parte.metodo, parte.crc, csize, parte.tamanho, self._offset)
+        self._offset += len(cab) + csize
+        return cab + parte.dados
+
+    def adicionar_bytes(self, nome: str, dados: bytes, metodo=ZIP_DEFLATED) -> bytes:
+        return self.adicionar_parte(ParteZip.comprimir(nome, dados, metodo))
+
+    def adicionar_comprimido(self, nome: str, metodo, crc: int, csize: int, usize: int, blocos):
+        """Membro cujos dados comprimidos (csize bytes) vêm de blocos, p.ex. de outro ZIP."""
+        nome_b = nome.encode("utf-8")
+        zip64 = usize >= _LIMITE_32 or csize >= _LIMITE_32
+        cab = self._cabecalho_local(nome_b, _FLAG_UTF8, metodo, crc, csize, usize, zip64)
+        self._registrar_central(nome_b, _FLAG_UTF8, metodo, crc, csize, usize, self._offset)
+        self._offset += len(cab) + csize
+        yield cab
+        yield from blocos
+
+    def _abrir_membro(self, nome_b, metodo, zip64) -> bytes:
+        # CRC e tamanhos ainda desconhecidos: vão no descritor depois dos dados
+        cab = self._cabecalho_local(nome_b, _FLAG_UTF8 | _FLAG_DESCRITOR, metodo, 0, 0, 0, zip64)
+        self._offset += len(cab)
+        return cab
+
+    def _fechar_membro(self, nome_b, metodo, zip64, crc, csize, usize, offset) -> bytes:
+        self._registrar_central(nome_b, _FLAG_UTF8 | _FLAG_DESCRITOR, metodo, crc, csize, usize, offset)
+        if zip64:
+            descritor = struct.pack("<IIQQ", 0x08074B50, crc, csize, usize)
+        else:
+            descritor = struct.pack("<IIII", 0x08074B50, crc, csize, usize)
+        self._offset += csize + len(descritor)
+        return descritor
+
+    def adicionar_arquivo(self, caminho, nome: str | None = None, metodo=ZIP_DEFLATED, bloco=BLOCO_LEITURA,
+                          crc: int | None = None):
+        """
+        Gera o membro em pedaços enquanto lê o arquivo; nenhum bloco fica
+        retido depois de entregue. Um membro armazenado precisa do CRC antes
+        dos dados: vem de crc (já conhecido) ou de uma primeira leitura.
+        """
+        caminho = Path(caminho)
+        if metodo == ZIP_STORED:
+            yield from self._adicionar_armazenado(caminho, nome or caminho.name, bloco, crc)
+            return
+        nome_b = (nome or caminho.name).encode("utf-8")
+        offset = self._offset
+        zip64 = _precisa_zip64(caminho.stat().st_size, metodo)
+        yield self._abrir_membro(nome_b, metodo, zip64)
+
+        comp = _compressor(metodo)
+        crc = csize = usize = 0
+        with open(caminho, "rb") as f:
+            while pedaco := f.read(bloco):
+                crc = zlib.crc32(pedaco, crc)
+                usize += len(pedaco)
+                if comp:
+                    pedaco = comp.compress(pedaco)
+                csize += len(pedaco)
+                if pedaco:
+                    yield pedaco
+        if comp:
+            resto = comp.flush()
+            csize += len(resto)
+            if resto:
+                yield resto
+        yield self._fechar_membro(nome_b, metodo, zip64, crc, csize, usize, offset)
+
+    def _adicionar_armazenado(self, caminho: Path, nome: str, bloco: int, crc: int | None):
+        tamanho = caminho.stat().st_size
+        if crc is None:
+            crc = _crc_arquivo(caminho, bloco)
+
+        def blocos():
+            lidos = 0
+            with open(caminho, "rb") as f:
+                while pedaco := f.read(bloco):
+                    lidos += len(pedaco)
+                    yield pedaco
+            if lidos != tamanho:
+                raise RuntimeError(f"{caminho} mudou durante o empacotamento ({tamanho} → {lidos} bytes)")
+
+        yield from self.adicionar_comprimido(nome, ZIP_STORED, crc, tamanho, tamanho, blocos())
+
+    def finalizar(self) -> bytes:
+        """Diretório central + registros de fim de arquivo (ZIP64 quando necessário)."""
+        diretorio = b"".join(self._central)
+        inicio_cd = self._offset
+        tam_cd = len(diretorio)
+        total = len(self._central)
+        fim = b""
+        if total >= _LIMITE_16 or tam_cd >= _LIMITE_32 or inicio_cd >= _LIMITE_32:
+            offset_zip64 = inicio_cd + tam_cd
+            fim += struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, total, total, tam_cd, inicio_cd
+            )
+            fim += struct.pack("<IIQI", 0x07064B50, 0, offset_zip64, 1)
+            fim += struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, _LIMITE_16, _LIMITE_16, _LIMITE_32, _LIMITE_32, 0
+            )
+        else:
+            fim += struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, total, total, tam_cd, inicio_cd, 0)
+        self._offset += tam_cd + len(fim)
+        return diretorio + fim
+
+
+def comprimir_arquivo(caminho, destino, metodo=ZIP_DEFLATED, nivel=6, bloco=BLOCO_LEITURA):
+    """Grava em destino os dados comprimidos de caminho; retorna (crc, tamanho comprimido, tamanho)."""
+    comp = _compressor(metodo, nivel)
+    crc = csize = usize = 0
+    with open(caminho, "rb") as f, open(destino, "wb") as saida:
+        while pedaco := f.read(bloco):
+            crc = zlib.crc32(pedaco, crc)
+            usize += len(pedaco)
+            if comp:
+                pedaco = comp.compress(pedaco)
+            csize += len(pedaco)
+            saida.write(pedaco)
+        if comp:
+            resto = comp.flush()
+            csize += len(resto)
+            saida.write(resto)
+    return crc, csize, usize
+
+
+def inicio_dos_dados(arquivo, offset: int) -> int | None:
+    """Posição dos dados do membro cujo cabeçalho local está em offset (None se não houver cabeçalho)."""
+    arquivo.seek(offset)
+    cab = arquivo.read(30)
+    if len(cab) < 30 or struct.unpack("<I", cab[:4])[0] != 0x04034B50:
+        return None
+    tam_nome, tam_extra = struct.unpack("<HH", cab[26:30])
+    return offset + 30 + tam_nome + tam_extra
+
+
+def tamanho_previsto(arquivos) -> int | None:
+    """
+    Tamanho exato do ZIP de zip_de_arquivos para os mesmos arquivos, ou None
+    se algum membro for comprimido (aí o tamanho só se sabe no fim).
+    """
+    zs = ZipStream()
+    for caminho, nome, metodo in arquivos:
+        if metodo != ZIP_STORED:
+            return None
+        tamanho = Path(caminho).stat().st_size
+        for _ in zs.adicionar_comprimido(nome, metodo, 0, tamanho, tamanho, ()):
+            pass
+    zs.finalizar()
+    return zs.offset
+
+
+def zip_de_arquivos(arquivos, bloco=BLOCO_LEITURA):
+    """Gera o ZIP de (caminho, nome no pacote, método) lendo cada arquivo em blocos."""
+    zs = ZipStream()
+    for caminho, nome, metodo in arquivos:
+        yield from zs.adicionar_arquivo(caminho, nome, metodo, bloco)
+    yield zs.finalizar()
+
+
+def zip_de_entradas(entradas, metodo=ZIP_STORED):
+    """
+    Gera o ZIP à medida que cada entrada (nome, bytes ou iterável de bytes)
+    fica pronta. Só uma entrada por vez fica em memória.
+    """
+    zs = ZipStream()
+    for nome, conteudo in entradas:
+        dados = conteudo if isinstance(conteudo, bytes) else b"".join(conteudo)
+        yield zs.adicionar_bytes(nome, dados, metodo)
+    yield zs.finalizar()
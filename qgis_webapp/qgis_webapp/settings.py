@@ -10,8 +10,14 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+# .env também nos processos worker (que não importam as views)
+load_dotenv()
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = BASE_DIR / "media"
@@ -140,3 +146,62 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Fila de jobs QGIS (executados por: python manage.py qgis_worker)
+QGIS_WORKERS = int(os.getenv("QGIS_WORKERS", "2"))
+QGIS_WORKER_INTERVALO = float(os.getenv("QGIS_WORKER_INTERVALO", "1.0"))
+# Reciclagem dos workers (contém vazamentos de memória do QGIS); 0 desativa
+QGIS_WORKER_MAX_JOBS = int(os.getenv("QGIS_WORKER_MAX_JOBS", "50"))
+QGIS_WORKER_MAX_RSS_MB = float(os.getenv("QGIS_WORKER_MAX_RSS_MB", "3072"))
+# Limite de tempo (s) por etapa do pipeline; etapas fora do dicionário usam o padrão.
+# Estourado o limite, o job é cancelado; sem resposta em mais TOLERANCIA segundos,
+# o supervisor mata o processo worker.
+QGIS_LIMITE_ETAPA_PADRAO = float(os.getenv("QGIS_LIMITE_ETAPA_PADRAO", "1800"))
+QGIS_LIMITE_ETAPAS = {
+    "2.5": float(os.getenv("QGIS_LIMITE_ECW", "3600")),      # conversão do ECW
+    "13.5": float(os.getenv("QGIS_LIMITE_ESPERA_ORTOFOTO", "21600")),  # upload em partes da ortofoto
+    "13.6": float(os.getenv("QGIS_LIMITE_ECW", "3600")),     # conversão do ECW que chegou depois do DXF
+    "14": float(os.getenv("QGIS_LIMITE_OVERPASS", "300")),   # ruas do OpenStreetMap
+    "qfieldcloud": float(os.getenv("QGIS_LIMITE_QFIELDCLOUD", "7200")),  # envio do projeto ao QFieldCloud
+}
+QGIS_TOLERANCIA_CANCELAMENTO = float(os.getenv("QGIS_TOLERANCIA_CANCELAMENTO", "30"))
+
+# Upload em partes (/uploads/): tamanho máximo (bytes) de cada arquivo e de cada parte
+QGIS_UPLOAD_TAMANHO_MAXIMO = int(os.getenv("QGIS_UPLOAD_TAMANHO_MAXIMO", str(20 * 2**30)))
+QGIS_UPLOAD_PARTE_MAXIMA = int(os.getenv("QGIS_UPLOAD_PARTE_MAXIMA", str(64 * 2**20)))
+# o pipeline segue sem ortofoto se o upload dela ficar esse tempo (s) sem receber partes
+QGIS_UPLOAD_ESPERA_ORTOFOTO = float(os.getenv("QGIS_UPLOAD_ESPERA_ORTOFOTO", "900"))
+# Uploads compactados (.zip, .dxf.gz): total descompactado (bytes) e taxa máxima de compressão
+QGIS_DESCOMPACTADO_MAXIMO = int(os.getenv("QGIS_DESCOMPACTADO_MAXIMO", str(QGIS_UPLOAD_TAMANHO_MAXIMO)))
+QGIS_TAXA_COMPRESSAO_MAXIMA = float(os.getenv("QGIS_TAXA_COMPRESSAO_MAXIMA", "200"))
+
+# Progresso dos jobs (arquivos JSON por canal, lidos pelo endpoint SSE)
+PROGRESSO_DIR = Path(os.getenv("PROGRESSO_DIR", MEDIA_ROOT / "progresso"))
+# Duração (s) de cada conexão SSE: cada uma prende um worker síncrono do servidor web;
+# o EventSource reconecta sozinho e retoma pelo Last-Event-ID
+QGIS_SSE_JANELA = float(os.getenv("QGIS_SSE_JANELA", "25"))
+# Templates de project_cloud.qgs capturados dos projetos montados pelo QGIS
+QGIS_TEMPLATES_DIR = Path(os.getenv("QGIS_TEMPLATES_DIR", MEDIA_ROOT / "qgis_templates"))
+
+# Métricas por etapa (run_metrics.json e /metrics); tracemalloc custa alguns % de CPU
+QGIS_METRICAS_TRACEMALLOC = os.getenv("QGIS_METRICAS_TRACEMALLOC", "0") == "1"
+# /metrics agrega só os jobs concluídos nas últimas N horas
+QGIS_METRICAS_JANELA_HORAS = float(os.getenv("QGIS_METRICAS_JANELA_HORAS", "24"))
+
+# Entrega dos pacotes prontos: "" (o Django envia, com Range), "x-accel" (nginx) ou
+# "x-sendfile" (Apache/lighttpd). No nginx, QGIS_ACCEL_PREFIXO é uma location
+# `internal` apontando para MEDIA_ROOT.
+QGIS_DOWNLOAD_OFFLOAD = os.getenv("QGIS_DOWNLOAD_OFFLOAD", "")
+QGIS_ACCEL_PREFIXO = os.getenv("QGIS_ACCEL_PREFIXO", "/_media_interna/")
+
+# QFieldCloud: envio em paralelo; o ritmo extra vem dos 429/Retry-After do servidor
+QFIELDCLOUD_URL = os.getenv("QFIELDCLOUD_URL", "https://app.qfield.cloud/api/v1/")
+QFIELDCLOUD_USUARIO = os.getenv("QFIELD_USER", "")
+QFIELDCLOUD_SENHA = os.getenv("QFIELD_PASS", "")
+# token fixo opcional (dispensa login); senão o login é feito uma vez por processo
+QFIELDCLOUD_TOKEN = os.getenv("QFIELDCLOUD_TOKEN", "")
+# novo login depois disso (s), além de sempre que a API responder 401
+QFIELDCLOUD_TOKEN_VALIDADE = float(os.getenv("QFIELDCLOUD_TOKEN_VALIDADE", "43200"))
+QFIELDCLOUD_OWNER = os.getenv("QFIELDCLOUD_OWNER", "OrganizacaoTeste")
+QFIELDCLOUD_UPLOAD_THREADS = int(os.getenv("QFIELDCLOUD_UPLOAD_THREADS", "4"))
+QFIELDCLOUD_UPLOAD_TENTATIVAS = int(os.getenv("QFIELDCLOUD_UPLOAD_TENTATIVAS", "6"))